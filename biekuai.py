@@ -20,8 +20,9 @@
 8. 轻微加颗粒（可选）
 """
 
-import os, sys, subprocess, threading, cv2, numpy as np, hashlib, time, shutil, tempfile
-import urllib.request, zipfile, ssl, json, glob, uuid
+import os, sys, subprocess, threading, queue, cv2, numpy as np, hashlib, time, shutil, tempfile
+import urllib.request, zipfile, ssl, json, glob, uuid, multiprocessing
+from multiprocessing import shared_memory
 from datetime import date
 from tkinter import (Label, Button, Text, filedialog, ttk, messagebox, Frame, 
                      BooleanVar, Checkbutton, StringVar, END, Toplevel, Canvas, 
@@ -30,12 +31,20 @@ from tkinter import (Label, Button, Text, filedialog, ttk, messagebox, Frame,
                      Listbox, SINGLE, TOP, BOTTOM, X, W, E, N, S, NW, NE, SW, SE,
                      CENTER, RIDGE, GROOVE, SUNKEN, RAISED, FLAT)
 from tkinter.ttk import Progressbar, Style, Treeview, Separator
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from PIL import Image, ImageTk
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
 from typing import Dict, List, Optional, Any
 from enum import Enum
 
+try:
+    from threadpoolctl import threadpool_limits     # 限制 NumPy 所用 BLAS 的线程数（见 requirements.txt）
+except ImportError:
+    threadpool_limits = None
+
 
 # ==================== 0. 智能路径管理 ====================
 class PathManager:
@@ -96,8 +105,10 @@ class PathManager:
             self._safe_makedirs(d)
         
         self.exes = {}
-        self._scan_ffmpeg()
-        self._save_config()
+        # 多进程帧并行的工作进程（spawn）会重新导入本模块，只处理帧：不再扫描 FFmpeg、改写 config.json
+        if multiprocessing.current_process().name == "MainProcess":
+            self._scan_ffmpeg()
+            self._save_config()
 
     def _select_best_base(self, candidates):
         for path in candidates:
@@ -578,6 +589,7 @@ class TaskItem:
     progress: float = 0.0
     current_frame: int = 0
     total_frames: int = 0
+    skipped_frames: int = 0
     
     # 处理配置
     use_detail_restore: bool = False
@@ -594,6 +606,12 @@ class TaskItem:
     smart_mode: bool = True
     adv_opts: Dict[str, bool] = field(default_factory=dict)
     
+    # 性能选项
+    perf_opts: Dict[str, Any] = field(default_factory=dict)
+    # 只影响调度、不影响输出的性能选项，切换后断点续传的进度仍然有效
+    # （segment_parallel 改变续传记录的结构；skip_duplicates 会沿用相近帧的输出，改变结果；均不在此列）
+    SCHEDULING_OPTS = ("stream_encode", "frame_parallel", "process_pool", "stage_pipeline", "checkpoint")
+    
     # 时间统计
     start_time: float = 0.0
     elapsed_time: float = 0.0
@@ -623,9 +641,9 @@ class TaskItem:
         elif self.status == TaskStatus.PAUSED:
             return f"已暂停 {self.progress:.0f}%"
         elif self.status == TaskStatus.STOPPED:
-            return "已停止"
+            return f"已停止 {self.progress:.0f}%" + (" (可续传)" if self.perf_opts.get("checkpoint", True) else "")
         elif self.status == TaskStatus.FAILED:
-            return "处理失败"
+            return "处理失败" + (" (可续传)" if self.perf_opts.get("checkpoint", True) else "")
         return ""
     
     def get_config(self) -> Dict[str, Any]:
@@ -643,7 +661,14 @@ class TaskItem:
         cfg.update(self.basic_opts)
         cfg.update(self.filter_opts)
         cfg.update(self.adv_opts)
+        cfg.update(self.perf_opts)
         return cfg
+    
+    def get_config_hash(self) -> str:
+        """配置哈希，用于判断断点续传的进度是否仍然有效（不含只影响调度的选项）"""
+        cfg = {k: v for k, v in self.get_config().items() if k not in self.SCHEDULING_OPTS}
+        raw = json.dumps(cfg, sort_keys=True, ensure_ascii=False)
+        return hashlib.md5(raw.encode('utf-8')).hexdigest()
 
 
 # ==================== 7. 任务管理器 ====================
@@ -684,6 +709,10 @@ class TaskManager:
         """获取待处理任务"""
         return [t for t in self.get_all_tasks() if t.status == TaskStatus.PENDING]
     
+    def get_resumable_tasks(self) -> List[TaskItem]:
+        """获取已停止或失败、可以继续处理的任务"""
+        return [t for t in self.get_all_tasks() if t.status in (TaskStatus.STOPPED, TaskStatus.FAILED)]
+    
     def get_next_task(self) -> Optional[TaskItem]:
         """获取下一个待处理任务"""
         for tid in self.task_order:
@@ -889,6 +918,97 @@ class ImageAnalyzer:
         return recommendations
 
 
+# ==================== 8.1 派生平面缓存 ====================
+class FramePlanes:
+    """单帧的派生平面缓存 - 灰度、Sobel 梯度、Canny 边缘、人脸框按需计算并复用
+    
+    缓存绑定到一个图像数组（各步骤返回新数组、不原地修改输入）：以另一个数组取平面时
+    视为步骤已写出新图像，清空缓存；原样返回输入的步骤（如未检测到人脸）保留缓存。
+    取得的平面只读。counts 为同一执行计划内共享的复用/计算次数。
+    """
+    
+    _count_lock = threading.Lock()
+    
+    def __init__(self, img=None, counts=None):
+        self.img = img
+        self.counts = counts if counts is not None else {"hit": 0, "miss": 0}
+        self._cache = {}
+        self._lock = threading.RLock()
+    
+    @staticmethod
+    def of(img, planes=None):
+        """返回绑定到 img 的缓存：planes 为 None 时新建，否则把 planes 切换到 img"""
+        if planes is None:
+            return FramePlanes(img)
+        with planes._lock:
+            if planes.img is not img:
+                planes.img, planes._cache = img, {}
+        return planes
+    
+    def _get(self, key, compute):
+        with self._lock:
+            hit = key in self._cache
+            if not hit:
+                self._cache[key] = compute()
+            value = self._cache[key]
+        with FramePlanes._count_lock:
+            self.counts["hit" if hit else "miss"] += 1
+        return value
+    
+    def gray(self):
+        """灰度平面；单通道图像（亮度域模式下的 Y 平面）即为其本身"""
+        if self.img.ndim == 2:
+            return self.img
+        return self._get("gray", lambda: cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY))
+    
+    def sobel(self, ddepth=cv2.CV_32F):
+        """灰度的 3x3 Sobel 梯度 (gx, gy)，ddepth 为 CV_32F 或 CV_64F"""
+        def compute():
+            gray = self.gray().astype(np.float64 if ddepth == cv2.CV_64F else np.float32)
+            return cv2.Sobel(gray, ddepth, 1, 0, ksize=3), cv2.Sobel(gray, ddepth, 0, 1, ksize=3)
+        return self._get(("sobel", ddepth), compute)
+    
+    def canny(self, low, high):
+        return self._get(("canny", low, high), lambda: cv2.Canny(self.gray(), low, high))
+    
+    def faces(self):
+        return self._get("faces", lambda: ProfessionalRestorer.detect_faces(self.img, self))
+
+
+# ==================== 8.2 掩码融合 ====================
+class MaskBlend:
+    """单通道掩码的融合与叠加 - 掩码按广播作用于各通道，不再堆叠成三通道副本
+    
+    按 float 计算后与原先的逐步写法一样裁剪到 0-255 并截断取整（不四舍五入），
+    多步串联时不会逐步累积 +0.5 的偏差。
+    """
+    
+    @staticmethod
+    def blend(a, b, mask):
+        """a·(1 - mask) + b·mask；mask 为 (h, w) 权重。a 为 uint8 时截断输出 uint8，否则输出浮点结果"""
+        mask = MaskBlend.expand(mask.astype(np.float32, copy=False), a)
+        weighted = b * mask
+        result = a * (1 - mask)
+        result += weighted
+        if a.dtype == np.uint8:
+            return np.clip(result, 0, 255, out=result).astype(np.uint8)
+        return result
+    
+    @staticmethod
+    def add(img, delta, mask, scale=1.0):
+        """uint8 图像 img + delta·mask·scale，裁剪到 0-255 后截断；delta 为与 img 同形状的浮点数组"""
+        weighted = delta * MaskBlend.expand(mask, img)
+        if scale != 1.0:
+            weighted *= scale
+        weighted += img
+        return np.clip(weighted, 0, 255, out=weighted).astype(np.uint8)
+    
+    @staticmethod
+    def expand(mask, img):
+        """(h, w) 掩码按 img 的通道数扩展为可广播的形状，单通道图像原样返回"""
+        return mask[:, :, None] if img.ndim == 3 else mask
+
+
 # ==================== 9. 专业8步修复流程 ====================
 class ProfessionalRestorer:
     """
@@ -931,32 +1051,31 @@ class ProfessionalRestorer:
         },
     }
     
-    _frame_buffer = []
-    _max_buffer_size = 3
-    _face_cascade = None
-    _face_cascade_loaded = False
+    TEMPORAL_HISTORY = 2  # 时序稳定参考的前序帧数
+    _face_local = threading.local()  # 每个线程各自持有分类器，避免多线程共用
     
     @classmethod
     def _load_face_cascade(cls):
-        if cls._face_cascade_loaded:
-            return cls._face_cascade
+        local = cls._face_local
+        if getattr(local, "loaded", False):
+            return local.cascade
         try:
             cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-            cls._face_cascade = cv2.CascadeClassifier(cascade_path)
-            if cls._face_cascade.empty():
-                cls._face_cascade = None
+            local.cascade = cv2.CascadeClassifier(cascade_path)
+            if local.cascade.empty():
+                local.cascade = None
         except:
-            cls._face_cascade = None
-        cls._face_cascade_loaded = True
-        return cls._face_cascade
+            local.cascade = None
+        local.loaded = True
+        return local.cascade
     
     @staticmethod
-    def detect_faces(img):
+    def detect_faces(img, planes=None):
         cascade = ProfessionalRestorer._load_face_cascade()
         if cascade is None:
             return []
         try:
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            gray = FramePlanes.of(img, planes).gray()
             faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
                                              minSize=(30, 30), flags=cv2.CASCADE_SCALE_IMAGE)
             return faces.tolist() if len(faces) > 0 else []
@@ -964,82 +1083,92 @@ class ProfessionalRestorer:
             return []
     
     @staticmethod
-    def guided_filter(I, p, r, eps):
-        """引导滤波 - 边缘感知平滑"""
+    def guided_filter(I, p, r, eps, dtype=np.float32, subsample=1):
+        """引导滤波 - 边缘感知平滑，按 dtype 精度计算
+        
+        I 为单通道引导图，p 为单通道或多通道 (h, w, c) 输入：引导图的均值/方差只算一次，
+        各通道共用。subsample > 1 时为快速引导滤波（适合大窗口），在 1/subsample 分辨率上
+        求线性系数，再双线性放大后作用于全分辨率引导图。
+        """
         try:
-            I = I.astype(np.float64)
-            p = p.astype(np.float64)
-            mean_I = cv2.boxFilter(I, -1, (r, r))
-            mean_p = cv2.boxFilter(p, -1, (r, r))
-            mean_Ip = cv2.boxFilter(I * p, -1, (r, r))
-            cov_Ip = mean_Ip - mean_I * mean_p
-            mean_II = cv2.boxFilter(I * I, -1, (r, r))
-            var_I = mean_II - mean_I * mean_I
-            a = cov_Ip / (var_I + eps)
-            b = mean_p - a * mean_I
-            mean_a = cv2.boxFilter(a, -1, (r, r))
-            mean_b = cv2.boxFilter(b, -1, (r, r))
-            q = mean_a * I + mean_b
-            return q
+            I = I.astype(dtype, copy=False)
+            p = p.astype(dtype, copy=False)
+            channels = cv2.split(p) if p.ndim == 3 else [p]
+            I_lo, k = I, (r, r)
+            if subsample > 1:
+                size = (max(1, I.shape[1] // subsample), max(1, I.shape[0] // subsample))
+                I_lo = cv2.resize(I, size, interpolation=cv2.INTER_AREA)
+                channels = [cv2.resize(ch, size, interpolation=cv2.INTER_AREA) for ch in channels]
+                k = (max(1, r // subsample) | 1,) * 2
+            mean_I = cv2.boxFilter(I_lo, -1, k)
+            var_I = cv2.boxFilter(I_lo * I_lo, -1, k) - mean_I * mean_I + eps
+            
+            out = []
+            for ch in channels:
+                mean_p = cv2.boxFilter(ch, -1, k)
+                cov_Ip = cv2.boxFilter(I_lo * ch, -1, k) - mean_I * mean_p
+                a = cov_Ip / var_I
+                b = mean_p - a * mean_I
+                mean_a = cv2.boxFilter(a, -1, k)
+                mean_b = cv2.boxFilter(b, -1, k)
+                if subsample > 1:
+                    mean_a = cv2.resize(mean_a, (I.shape[1], I.shape[0]), interpolation=cv2.INTER_LINEAR)
+                    mean_b = cv2.resize(mean_b, (I.shape[1], I.shape[0]), interpolation=cv2.INTER_LINEAR)
+                out.append(mean_a * I + mean_b)
+            return cv2.merge(out) if p.ndim == 3 else out[0]
         except:
             return p
     
     @staticmethod
-    def step1_artifact_removal(img, intensity="medium"):
-        """步骤1: 伪影移除 - 去块、去色带"""
+    def step1_artifact_removal(img, intensity="medium", edges=None, planes=None, dtype=np.float32):
+        """步骤1: 伪影移除 - 去块、去色带
+        
+        edges 为预先在整帧上检测的 Canny 边缘（分块执行时传入图块对应的部分）。
+        """
         cfg = ProfessionalRestorer.INTENSITY.get(intensity, ProfessionalRestorer.INTENSITY["medium"])
         
         try:
             h, w = img.shape[:2]
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float32)
+            planes = FramePlanes.of(img, planes)
+            gray = planes.gray().astype(np.float32)
             
-            edges = cv2.Canny(gray.astype(np.uint8), 45, 110)
+            if edges is None:
+                edges = ProfessionalRestorer.deblock_edges(img, planes)
             edge_protect = cv2.dilate(edges, np.ones((5, 5), np.uint8), iterations=1)
             edge_protect_mask = 1 - edge_protect.astype(np.float32) / 255.0
             
             block_mask = np.zeros((h, w), dtype=np.float32)
             thresh = cfg["deblock_thresh"]
             
+            # 所有块边界线一次切片求跳变，再按网格模板的跨步切片写到边界两侧 ±2 像素（三角权重）
             for block_size in [8, 16]:
-                for x in range(block_size, w - 1, block_size):
-                    if x >= w - 1:
-                        continue
-                    left = gray[:, x-1]
-                    right = gray[:, x]
-                    diff = np.abs(left - right)
+                grid = ProfessionalRestorer.block_grid(w, block_size)
+                if grid:
+                    (left, right), taps = grid
+                    diff = np.abs(gray[:, left] - gray[:, right])
                     boundary = ((diff > 1.5) & (diff < thresh)).astype(np.float32)
-                    for dx in range(-2, 3):
-                        if 0 <= x + dx < w:
-                            weight = 1.0 - abs(dx) * 0.2
-                            block_mask[:, x + dx] = np.maximum(block_mask[:, x + dx], boundary * weight)
+                    for cols, k, weight in taps:
+                        view = block_mask[:, cols]
+                        np.maximum(view, boundary[:, :k] * weight, out=view)
                 
-                for y in range(block_size, h - 1, block_size):
-                    if y >= h - 1:
-                        continue
-                    top = gray[y-1, :]
-                    bottom = gray[y, :]
-                    diff = np.abs(top - bottom)
+                grid = ProfessionalRestorer.block_grid(h, block_size)
+                if grid:
+                    (top, bottom), taps = grid
+                    diff = np.abs(gray[top, :] - gray[bottom, :])
                     boundary = ((diff > 1.5) & (diff < thresh)).astype(np.float32)
-                    for dy in range(-2, 3):
-                        if 0 <= y + dy < h:
-                            weight = 1.0 - abs(dy) * 0.2
-                            block_mask[y + dy, :] = np.maximum(block_mask[y + dy, :], boundary * weight)
+                    for rows, k, weight in taps:
+                        view = block_mask[rows, :]
+                        np.maximum(view, boundary[:k, :] * weight, out=view)
             
             block_mask = block_mask * edge_protect_mask
             block_mask = cv2.GaussianBlur(block_mask, (5, 5), 1.0)
             
             strength = cfg["deblock_strength"]
             gray_guide = gray / 255.0
-            smooth = np.zeros_like(img, dtype=np.float64)
-            for c in range(3):
-                channel = img[:, :, c].astype(np.float64) / 255.0
-                smooth[:, :, c] = ProfessionalRestorer.guided_filter(gray_guide, channel, 5, 0.01) * 255.0
+            smooth = ProfessionalRestorer.guided_filter(gray_guide, img.astype(dtype) / 255.0, 5, 0.01, dtype) * 255.0
             smooth = np.clip(smooth, 0, 255).astype(np.uint8)
             
-            block_mask_3ch = np.stack([block_mask] * 3, axis=-1)
-            result = img.astype(np.float32) * (1 - block_mask_3ch * strength) + \
-                     smooth.astype(np.float32) * (block_mask_3ch * strength)
-            result = np.clip(result, 0, 255).astype(np.uint8)
+            result = MaskBlend.blend(img, smooth, block_mask * strength)
             
             deband_thresh = cfg["deband_threshold"]
             dither = cfg["deband_dither"]
@@ -1050,21 +1179,48 @@ class ProfessionalRestorer:
             banding_mask = banding_mask * edge_protect_mask
             banding_mask = cv2.GaussianBlur(banding_mask, (11, 11), 2.5)
             
-            result_f = result.astype(np.float32)
-            for c in range(3):
-                channel = result_f[:, :, c]
+            result_f = BufferArena.cast(0, result)
+            channels = [result_f] if result_f.ndim == 2 else [result_f[:, :, c] for c in range(result_f.shape[2])]
+            for channel in channels:
                 smoothed = cv2.GaussianBlur(channel, (15, 15), 3.0)
                 noise = np.random.normal(0, dither, channel.shape).astype(np.float32)
                 smoothed = smoothed + noise
-                result_f[:, :, c] = channel * (1 - banding_mask * 0.65) + smoothed * (banding_mask * 0.65)
+                channel[...] = channel * (1 - banding_mask * 0.65) + smoothed * (banding_mask * 0.65)
             
-            return np.clip(result_f, 0, 255).astype(np.uint8)
+            return np.clip(result_f, 0, 255, out=result_f).astype(np.uint8)
         except:
             return img
     
     @staticmethod
-    def step2_presharpen_with_rollback(img, intensity="medium", metrics=None):
-        """步骤2: 预锐化+回调"""
+    @lru_cache(maxsize=64)
+    def block_grid(n, block_size):
+        """长度为 n 的轴上的块边界网格模板（按 (n, block_size) 缓存），没有边界线时返回 None
+        
+        边界线位于 block_size 的倍数（不含两端）。返回 ((线前一像素的跨步切片, 线上的跨步切片), 抽头)，
+        每个抽头为 (各线偏移 d 像素处的跨步切片, 落在图内的线数, 三角权重 1 - 0.2·|d|)，d 取 -2..2。
+        """
+        lines = np.arange(block_size, n - 1, block_size)
+        if not len(lines):
+            return None
+        last = int(lines[-1])
+        pairs = (slice(block_size - 1, last, block_size), slice(block_size, last + 1, block_size))
+        taps = []
+        for d in range(-2, 3):
+            k = int(np.count_nonzero(lines + d < n))
+            if k:
+                start = block_size + d
+                taps.append((slice(start, start + (k - 1) * block_size + 1, block_size), k,
+                             np.float32(1.0 - abs(d) * 0.2)))
+        return pairs, tuple(taps)
+    
+    @staticmethod
+    def deblock_edges(img, planes=None):
+        """步骤1的边缘保护检测；Canny 的滞后阈值沿边缘连通，不是局部运算"""
+        return FramePlanes.of(img, planes).canny(45, 110)
+    
+    @staticmethod
+    def _presharpen_params(intensity, metrics):
+        """步骤2 的 (对比度系数, 回调系数, 锐化强度)，源素材对比度较高时减半"""
         cfg = ProfessionalRestorer.INTENSITY.get(intensity, ProfessionalRestorer.INTENSITY["medium"])
         
         contrast_factor = cfg["pre_sharpen_contrast"]
@@ -1075,6 +1231,12 @@ class ProfessionalRestorer:
             if src_contrast > 60:
                 contrast_factor = 1.0 + (contrast_factor - 1.0) * 0.5
                 rollback = 1.0 - (1.0 - rollback) * 0.5
+        return contrast_factor, rollback, cfg["pre_sharpen_strength"] / 100.0
+    
+    @staticmethod
+    def step2_presharpen_with_rollback(img, intensity="medium", metrics=None):
+        """步骤2: 预锐化+回调"""
+        contrast_factor, rollback, strength = ProfessionalRestorer._presharpen_params(intensity, metrics)
         
         try:
             lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB).astype(np.float32)
@@ -1085,7 +1247,6 @@ class ProfessionalRestorer:
             lab[:, :, 0] = l_enhanced
             result = cv2.cvtColor(lab.astype(np.uint8), cv2.COLOR_LAB2BGR)
             
-            strength = cfg["pre_sharpen_strength"] / 100.0
             blur = cv2.GaussianBlur(result, (0, 0), 2.0)
             result = cv2.addWeighted(result, 1 + strength, blur, -strength, 0)
             
@@ -1100,16 +1261,42 @@ class ProfessionalRestorer:
             return img
     
     @staticmethod
-    def step3_antialiasing(img, intensity="medium"):
-        """步骤3: 反锯齿 + 边缘精修"""
+    def presharpen_ops(intensity="medium", metrics=None):
+        """步骤2 的浮点工作平面版本 (LAB → BGR → LAB)，见 ImageProcessor.space_ops"""
+        contrast_factor, rollback, strength = ProfessionalRestorer._presharpen_params(intensity, metrics)
+        mid = 128 / 2.55        # uint8 LAB 的 L=128 对应浮点 L≈50.2
+        
+        def lightness(lab, factor):
+            l_channel = lab[:, :, 0]
+            l_channel -= mid
+            l_channel *= factor
+            l_channel += mid
+            np.clip(l_channel, 0, 100, out=l_channel)
+            return lab
+        
+        def sharpen(bgr):
+            blur = cv2.GaussianBlur(bgr, (0, 0), 2.0)
+            bgr = cv2.addWeighted(bgr, 1 + strength, blur, -strength, 0)
+            return np.clip(bgr, 0, 1, out=bgr)
+        
+        return (("lab", lambda lab, stat: lightness(lab, contrast_factor)),
+                ("bgr", lambda bgr, stat: sharpen(bgr)),
+                ("lab", lambda lab, stat: lightness(lab, rollback)))
+    
+    @staticmethod
+    def step3_antialiasing(img, intensity="medium", min_mask=100, planes=None, dtype=np.float32):
+        """步骤3: 反锯齿 + 边缘精修
+        
+        锯齿掩码总和不超过 min_mask 时跳过插值；裁剪区域处理时按面积折算门限。
+        """
         cfg = ProfessionalRestorer.INTENSITY.get(intensity, ProfessionalRestorer.INTENSITY["medium"])
         
         try:
             h, w = img.shape[:2]
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float64)
+            planes = FramePlanes.of(img, planes)
+            gray = planes.gray().astype(dtype)
             
-            sobel_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-            sobel_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
+            sobel_x, sobel_y = planes.sobel(cv2.CV_64F if dtype == np.float64 else cv2.CV_32F)
             gradient_mag = np.sqrt(sobel_x**2 + sobel_y**2)
             gradient_dir = np.arctan2(sobel_y, sobel_x)
             edge_strength = np.clip(gradient_mag / 80.0, 0, 1)
@@ -1117,45 +1304,51 @@ class ProfessionalRestorer:
             diff_h = np.abs(np.diff(gray, axis=1, prepend=gray[:, :1]))
             diff_v = np.abs(np.diff(gray, axis=0, prepend=gray[:1, :]))
             step_thresh = 8
-            jagged_h = (diff_h > step_thresh).astype(np.float64) * edge_strength
-            jagged_v = (diff_v > step_thresh).astype(np.float64) * edge_strength
+            jagged_h = (diff_h > step_thresh).astype(dtype) * edge_strength
+            jagged_v = (diff_v > step_thresh).astype(dtype) * edge_strength
             
             abs_dir = np.abs(gradient_dir)
-            near_horizontal = ((abs_dir < 0.3) | (abs_dir > np.pi - 0.3)).astype(np.float64)
-            near_vertical = (np.abs(abs_dir - np.pi/2) < 0.3).astype(np.float64)
+            near_horizontal = ((abs_dir < 0.3) | (abs_dir > np.pi - 0.3)).astype(dtype)
+            near_vertical = (np.abs(abs_dir - np.pi/2) < 0.3).astype(dtype)
             
-            result = img.astype(np.float64)
+            result = BufferArena.cast(0, img, dtype)
             aa_strength = cfg["aa_strength"]
             
             h_mask = jagged_v * near_horizontal
-            if np.sum(h_mask) > 100:
-                v_kernel = np.array([[0.15], [0.20], [0.30], [0.20], [0.15]])
-                v_interp = cv2.filter2D(result, -1, v_kernel)
-                h_mask_3ch = np.stack([h_mask] * 3, axis=-1)
-                result = result + (v_interp - result) * h_mask_3ch * aa_strength * 0.5
+            if np.sum(h_mask) > min_mask:
+                v_kernel = np.array([[0.15], [0.20], [0.30], [0.20], [0.15]], dtype)
+                delta = cv2.filter2D(result, -1, v_kernel, dst=BufferArena.get(1, img.shape, dtype))
+                delta -= result
+                delta *= MaskBlend.expand(h_mask, result)
+                delta *= aa_strength
+                delta *= 0.5
+                result += delta
             
             v_mask = jagged_h * near_vertical
-            if np.sum(v_mask) > 100:
-                h_kernel = np.array([[0.15, 0.20, 0.30, 0.20, 0.15]])
-                h_interp = cv2.filter2D(result, -1, h_kernel)
-                v_mask_3ch = np.stack([v_mask] * 3, axis=-1)
-                result = result + (h_interp - result) * v_mask_3ch * aa_strength * 0.5
+            if np.sum(v_mask) > min_mask:
+                h_kernel = np.array([[0.15, 0.20, 0.30, 0.20, 0.15]], dtype)
+                delta = cv2.filter2D(result, -1, h_kernel, dst=BufferArena.get(1, img.shape, dtype))
+                delta -= result
+                delta *= MaskBlend.expand(v_mask, result)
+                delta *= aa_strength
+                delta *= 0.5
+                result += delta
             
             edge_refine = cfg["edge_refine"]
-            edge_region = (edge_strength > 0.2).astype(np.float64)
+            edge_region = (edge_strength > 0.2).astype(dtype)
             edge_region = cv2.GaussianBlur(edge_region, (3, 3), 0.5)
             
-            tangent_smooth = cv2.GaussianBlur(result, (3, 3), 0.5)
-            edge_3ch = np.stack([edge_region] * 3, axis=-1)
-            result = result * (1 - edge_3ch * edge_refine * 0.15) + \
-                    tangent_smooth * (edge_3ch * edge_refine * 0.15)
+            tangent_smooth = cv2.GaussianBlur(result, (3, 3), 0.5, dst=BufferArena.get(1, img.shape, dtype))
+            edge_region *= edge_refine
+            edge_region *= 0.15
+            result = MaskBlend.blend(result, tangent_smooth, edge_region)
             
-            return np.clip(result, 0, 255).astype(np.uint8)
+            return np.clip(result, 0, 255, out=result).astype(np.uint8)
         except:
             return img
     
     @staticmethod
-    def step4_denoise(img, intensity="medium", metrics=None):
+    def step4_denoise(img, intensity="medium", metrics=None, planes=None):
         """步骤4: 去噪"""
         cfg = ProfessionalRestorer.INTENSITY.get(intensity, ProfessionalRestorer.INTENSITY["medium"])
         
@@ -1163,30 +1356,25 @@ class ProfessionalRestorer:
             strength = cfg["denoise_strength"]
             preserve = cfg["denoise_preserve"]
             
-            denoised = cv2.bilateralFilter(img, 9, 45, 45)
+            denoised = cv2.bilateralFilter(img, 9, 45, 45, dst=BufferArena.get(0, img.shape, np.uint8))
             
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float32)
+            gray = FramePlanes.of(img, planes).gray().astype(np.float32)
             local_var = cv2.blur(gray**2, (7, 7)) - cv2.blur(gray, (7, 7))**2
             local_var = np.sqrt(np.maximum(local_var, 0))
             texture_mask = (local_var > 12).astype(np.float32)
             texture_mask = cv2.GaussianBlur(texture_mask, (5, 5), 1.0)
             
             denoise_mask = (1 - texture_mask * preserve) * strength
-            denoise_mask_3ch = np.stack([denoise_mask] * 3, axis=-1)
-            
-            result = img.astype(np.float32) * (1 - denoise_mask_3ch) + \
-                    denoised.astype(np.float32) * denoise_mask_3ch
-            
-            return np.clip(result, 0, 255).astype(np.uint8)
+            return MaskBlend.blend(img, denoised, denoise_mask)
         except:
             return img
     
     @staticmethod
-    def step5_face_repair(img, intensity="medium"):
+    def step5_face_repair(img, intensity="medium", planes=None, dtype=np.float32):
         """步骤5: 人脸修复"""
         cfg = ProfessionalRestorer.INTENSITY.get(intensity, ProfessionalRestorer.INTENSITY["medium"])
         
-        faces = ProfessionalRestorer.detect_faces(img)
+        faces = FramePlanes.of(img, planes).faces()
         if not faces:
             return img
         
@@ -1200,21 +1388,20 @@ class ProfessionalRestorer:
                 
                 face_region = result[y1:y2, x1:x2].copy()
                 
-                face_f = face_region.astype(np.float64)
+                face_f = face_region.astype(dtype)
                 low_freq = cv2.GaussianBlur(face_f, (0, 0), 2.0)
                 high_freq = face_f - low_freq
                 
                 low_smooth = cv2.bilateralFilter(low_freq.astype(np.uint8), 7, 35, 35)
                 
                 high_preserve = 1 - cfg["face_strength"] * 0.3
-                face_result = low_smooth.astype(np.float64) + high_freq * high_preserve
+                face_result = low_smooth.astype(dtype) + high_freq * high_preserve
                 face_result = np.clip(face_result, 0, 255).astype(np.uint8)
                 
                 hsv = cv2.cvtColor(face_region, cv2.COLOR_BGR2HSV)
                 skin_mask = cv2.inRange(hsv, np.array([0, 20, 70]), np.array([20, 255, 255]))
                 skin_mask = cv2.GaussianBlur(skin_mask, (15, 15), 3.0)
                 skin_mask = skin_mask.astype(np.float32) / 255.0 * cfg["face_strength"]
-                skin_mask_3ch = np.stack([skin_mask] * 3, axis=-1)
                 
                 border = int(min(y2-y1, x2-x1) * 0.15)
                 transition = np.ones((y2-y1, x2-x1), dtype=np.float32)
@@ -1224,32 +1411,25 @@ class ProfessionalRestorer:
                     transition[-(i+1), :] *= factor
                     transition[:, i] *= factor
                     transition[:, -(i+1)] *= factor
-                transition_3ch = np.stack([transition] * 3, axis=-1)
-                
-                face_blended = face_region.astype(np.float32) * (1 - skin_mask_3ch) + \
-                              face_result.astype(np.float32) * skin_mask_3ch
                 
-                final_blend = result[y1:y2, x1:x2].astype(np.float32) * (1 - transition_3ch) + \
-                             face_blended * transition_3ch
-                result[y1:y2, x1:x2] = np.clip(final_blend, 0, 255).astype(np.uint8)
+                face_blended = MaskBlend.blend(face_region.astype(np.float32), face_result, skin_mask)
+                result[y1:y2, x1:x2] = MaskBlend.blend(result[y1:y2, x1:x2], face_blended, transition)
             
             return result
         except:
             return img
     
     @staticmethod
-    def step6_hair_protect(img, original, intensity="medium"):
+    def step6_hair_protect(img, original, intensity="medium", planes=None):
         """步骤6: 毛发保护"""
         cfg = ProfessionalRestorer.INTENSITY.get(intensity, ProfessionalRestorer.INTENSITY["medium"])
         
-        faces = ProfessionalRestorer.detect_faces(img)
+        faces = FramePlanes.of(img, planes).faces()
         if not faces:
             return img
         
-        result = img.copy()
-        
         try:
-            h, w = result.shape[:2]
+            h, w = img.shape[:2]
             hair_mask = np.zeros((h, w), dtype=np.float32)
             
             for (x, y, fw, fh) in faces:
@@ -1266,15 +1446,12 @@ class ProfessionalRestorer:
             hair_detail = original.astype(np.float32) - blur.astype(np.float32)
             
             hair_protect = cfg["hair_protect"]
-            hair_mask_3ch = np.stack([hair_mask] * 3, axis=-1)
-            result = result.astype(np.float32) + hair_detail * hair_mask_3ch * hair_protect * 0.4
-            
-            return np.clip(result, 0, 255).astype(np.uint8)
+            return MaskBlend.add(img, hair_detail, hair_mask, hair_protect * 0.4)
         except:
             return img
     
     @staticmethod
-    def step7_final_sharpen(img, intensity="medium", metrics=None):
+    def step7_final_sharpen(img, intensity="medium", metrics=None, planes=None, dtype=np.float32):
         """步骤7: 最终轻锐化"""
         cfg = ProfessionalRestorer.INTENSITY.get(intensity, ProfessionalRestorer.INTENSITY["medium"])
         
@@ -1286,27 +1463,25 @@ class ProfessionalRestorer:
         try:
             strength = cfg["final_sharp"] * 0.4
             
-            blur = cv2.GaussianBlur(img, (0, 0), 1.0)
-            diff = img.astype(np.float64) - blur.astype(np.float64)
+            blur = cv2.GaussianBlur(img, (0, 0), 1.0, dst=BufferArena.get(0, img.shape, np.uint8))
+            diff = BufferArena.cast(1, img, dtype)
+            diff -= BufferArena.cast(2, blur, dtype)
             
             max_diff = 15
-            diff_limited = np.tanh(diff / max_diff) * max_diff
+            diff /= max_diff
+            diff_limited = np.tanh(diff, out=diff)
+            diff_limited *= max_diff
             
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float32)
-            sobel_x = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
-            sobel_y = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+            sobel_x, sobel_y = FramePlanes.of(img, planes).sobel(cv2.CV_32F)
             gradient = np.sqrt(sobel_x**2 + sobel_y**2)
             edge_strength = np.clip(gradient / 50.0, 0, 1)
-            edge_strength_3ch = np.stack([edge_strength] * 3, axis=-1)
             
-            result = img.astype(np.float64) + diff_limited * edge_strength_3ch * strength
-            
-            return np.clip(result, 0, 255).astype(np.uint8)
+            return MaskBlend.add(img, diff_limited, edge_strength, strength)
         except:
             return img
     
     @staticmethod
-    def step8_add_grain(img, intensity="medium"):
+    def step8_add_grain(img, intensity="medium", planes=None):
         """步骤8: 轻微加颗粒"""
         cfg = ProfessionalRestorer.INTENSITY.get(intensity, ProfessionalRestorer.INTENSITY["medium"])
         
@@ -1315,125 +1490,194 @@ class ProfessionalRestorer:
             
             noise = np.random.normal(0, strength, img.shape).astype(np.float32)
             
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            gray = FramePlanes.of(img, planes).gray()
             mask = cv2.threshold(gray, 25, 1, cv2.THRESH_BINARY)[1].astype(np.float32)
             mask = cv2.GaussianBlur(mask, (0, 0), 5)
-            mask_3ch = np.stack([mask] * 3, axis=-1)
-            
-            result = img.astype(np.float32) + noise * mask_3ch
             
-            return np.clip(result, 0, 255).astype(np.uint8)
+            return MaskBlend.add(img, noise, mask)
         except:
             return img
     
-    @classmethod
-    def temporal_stabilize(cls, current_frame, weight=0.2):
-        """时序稳定"""
+    @staticmethod
+    def temporal_stabilize(current_frame, history, weight=0.2):
+        """时序稳定 - history 为此前的原始帧列表（旧→新），由调用方显式传入"""
         try:
-            cls._frame_buffer.append(current_frame.copy())
-            if len(cls._frame_buffer) > cls._max_buffer_size:
-                cls._frame_buffer.pop(0)
-            
-            if len(cls._frame_buffer) < 2:
+            if not history:
                 return current_frame
             
-            result = current_frame.astype(np.float32)
-            total_weight = 1.0
-            
-            for i, frame in enumerate(cls._frame_buffer[:-1]):
-                frame_weight = weight * (0.5 ** (len(cls._frame_buffer) - 1 - i))
-                diff = np.abs(current_frame.astype(np.float32) - frame.astype(np.float32))
+            history = history[-ProfessionalRestorer.TEMPORAL_HISTORY:]
+            current = BufferArena.cast(0, current_frame)
+            result = BufferArena.cast(1, current_frame)
+            total_weight = BufferArena.get(2, current_frame.shape)
+            total_weight.fill(1.0)
+            diff = BufferArena.get(3, current_frame.shape)
+            
+            for i, frame in enumerate(history):
+                frame_weight = weight * (0.5 ** (len(history) - i))
+                frame_f = BufferArena.cast(4, frame)
+                np.abs(np.subtract(current, frame_f, out=diff), out=diff)
                 diff_gray = np.mean(diff, axis=2)
                 stable_mask = (diff_gray < 25).astype(np.float32)
                 stable_mask = cv2.GaussianBlur(stable_mask, (9, 9), 2.0)
-                stable_mask_3ch = np.stack([stable_mask] * 3, axis=-1)
-                result = result + frame.astype(np.float32) * frame_weight * stable_mask_3ch
-                total_weight = total_weight + frame_weight * stable_mask_3ch
-            
-            result = result / total_weight
-            return np.clip(result, 0, 255).astype(np.uint8)
+                stable_mask = stable_mask[:, :, None]
+                frame_f *= frame_weight
+                frame_f *= stable_mask
+                result += frame_f
+                total_weight += frame_weight * stable_mask
+            
+            np.divide(result, total_weight, out=result)
+            return np.clip(result, 0, 255, out=result).astype(np.uint8)
         except:
             return current_frame
     
-    @classmethod
-    def clear_frame_buffer(cls):
-        cls._frame_buffer = []
+    @staticmethod
+    def temporal_stabilize_i420(current_frame, history, weight=0.2):
+        """时序稳定的 yuv420p 版本 - 帧为 I420 布局 (h*3/2, w)，Y/U/V 整块按像素加权
+        
+        稳定掩码由 Y 平面的差值求得（代替 BGR 三通道差值的均值），色度使用缩小到半分辨率的掩码。
+        """
+        try:
+            if not history:
+                return current_frame
+            
+            history = history[-ProfessionalRestorer.TEMPORAL_HISTORY:]
+            h, w = current_frame.shape[0] * 2 // 3, current_frame.shape[1]
+            current = BufferArena.cast(0, current_frame)
+            result = BufferArena.cast(1, current_frame)
+            total_weight = BufferArena.get(2, current_frame.shape)
+            total_weight.fill(1.0)
+            mask = BufferArena.get(3, current_frame.shape)
+            luma_mask, chroma_mask = mask[:h], mask[h:].reshape(2, h // 2, w // 2)
+            
+            for i, frame in enumerate(history):
+                frame_weight = weight * (0.5 ** (len(history) - i))
+                frame_f = BufferArena.cast(4, frame)
+                np.abs(np.subtract(current[:h], frame_f[:h], out=luma_mask), out=luma_mask)
+                stable_mask = (luma_mask < 25).astype(np.float32)
+                cv2.GaussianBlur(stable_mask, (9, 9), 2.0, dst=luma_mask)
+                chroma_mask[:] = cv2.resize(luma_mask, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+                frame_f *= frame_weight
+                frame_f *= mask
+                result += frame_f
+                mask *= frame_weight
+                total_weight += mask
+            
+            np.divide(result, total_weight, out=result)
+            return np.clip(result, 0, 255, out=result).astype(np.uint8)
+        except:
+            return current_frame
 
 
 # ==================== 10. 并行处理管理器 ====================
 class ParallelProcessor:
-    """并行处理管理器"""
+    """并行处理管理器 - 常驻工作线程池 + 按输入/输出声明调度的小型 DAG 调度器
+    
+    run_graph 的每个节点声明 (名称, fn, 输入名)，结果以节点名登记为输出；输入全部就绪的
+    节点同时执行，其中一个由调用线程自身执行，其余交给线程池。线程池随处理器常驻，
+    首次使用时创建。stats 按节点名累计执行次数、等待（就绪到开始执行）与执行耗时。
+    """
     
     def __init__(self, max_workers=None, resource_ratio=0.7):
         if max_workers is None:
             cores = os.cpu_count() or 4
             max_workers = max(2, int(cores * resource_ratio))
-        self.max_workers = min(max_workers, 8)
+        self.max_workers = max_workers
         self.resource_ratio = resource_ratio
+        self.stats = {}
+        self._executor = None
+        self._lock = threading.Lock()
     
-    def process_frame_parallel(self, img, opts, intensity, metrics, original):
-        """并行处理单帧的多个后期效果"""
-        result = img.copy()
-        
-        if opts.get("detail_deblock", False):
-            result = ProfessionalRestorer.step1_artifact_removal(result, intensity)
-        
-        if opts.get("detail_presharpen", False):
-            result = ProfessionalRestorer.step2_presharpen_with_rollback(result, intensity, metrics)
-        
-        stage3_results = {}
-        
-        def do_aa():
-            if opts.get("detail_aa", False):
-                return ("aa", ProfessionalRestorer.step3_antialiasing(result, intensity))
-            return None
-        
-        def do_denoise():
-            if opts.get("detail_denoise", False):
-                return ("denoise", ProfessionalRestorer.step4_denoise(result, intensity, metrics))
-            return None
-        
-        with ThreadPoolExecutor(max_workers=min(2, self.max_workers)) as executor:
-            futures = [executor.submit(do_aa), executor.submit(do_denoise)]
-            for future in as_completed(futures):
-                res = future.result()
-                if res:
-                    stage3_results[res[0]] = res[1]
-        
-        if "aa" in stage3_results:
-            result = stage3_results["aa"]
-        if "denoise" in stage3_results:
-            aa_result = stage3_results.get("aa", result)
-            denoise_result = stage3_results["denoise"]
-            gray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY).astype(np.float32)
-            edge = cv2.Canny(gray.astype(np.uint8), 50, 150)
-            edge_mask = cv2.dilate(edge, np.ones((3,3), np.uint8))
-            edge_mask = cv2.GaussianBlur(edge_mask.astype(np.float32), (5,5), 1.0) / 255.0
-            edge_mask_3ch = np.stack([edge_mask] * 3, axis=-1)
-            result = (aa_result.astype(np.float32) * edge_mask_3ch + 
-                     denoise_result.astype(np.float32) * (1 - edge_mask_3ch))
-            result = np.clip(result, 0, 255).astype(np.uint8)
-        
-        if opts.get("detail_face", False):
-            result = ProfessionalRestorer.step5_face_repair(result, intensity)
-        
-        if opts.get("detail_hair", False):
-            result = ProfessionalRestorer.step6_hair_protect(result, original, intensity)
-        
-        if opts.get("detail_final_sharp", False):
-            has_other_sharp = opts.get("opt_sharp", False)
-            if not has_other_sharp:
-                result = ProfessionalRestorer.step7_final_sharpen(result, intensity, metrics)
-        
-        if opts.get("detail_grain", False):
-            result = ProfessionalRestorer.step8_add_grain(result, intensity)
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="graph")
+            return self._executor
+    
+    def close(self):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+    
+    def run_graph(self, nodes, values):
+        """执行 DAG：nodes 为 [(名称, fn, (输入名, ...))]，values 为初始输入；返回含全部输出的字典
         
+        节点不得在工作线程内再调用 run_graph（线程池中的节点不等待其它节点，不会互相阻塞）。
+        """
+        values = dict(values)
+        pending = list(nodes)
+        running = {}
+        while pending or running:
+            ready = [node for node in pending if all(name in values for name in node[2])]
+            if not ready and not running:
+                raise ValueError(f"节点依赖无法满足: {[node[0] for node in pending]}")
+            for node in ready:
+                pending.remove(node)
+            
+            now = time.time()
+            inline = ready.pop() if ready else None
+            for name, fn, inputs in ready:
+                args = [values[i] for i in inputs]
+                running[self.executor.submit(self._run_node, name, fn, args, now)] = name
+            if inline:
+                name, fn, inputs = inline
+                values[name] = self._run_node(name, fn, [values[i] for i in inputs], now)
+                done = [future for future in running if future.done()]
+            else:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                values[running.pop(future)] = future.result()
+        return values
+    
+    def _run_node(self, name, fn, args, ready_time):
+        t0 = time.time()
+        result = fn(*args)
+        t1 = time.time()
+        with self._lock:
+            st = self.stats.setdefault(name, {"runs": 0, "wait": 0.0, "busy": 0.0})
+            st["runs"] += 1
+            st["wait"] += t0 - ready_time
+            st["busy"] += t1 - t0
         return result
+    
+    def report(self):
+        """各节点统计摘要，供日志输出"""
+        with self._lock:
+            return [f"[{name}] {st['runs']}次 | 执行 {st['busy']:.1f}s | 等待 {st['wait']:.1f}s"
+                    for name, st in self.stats.items()]
+    
+    def antialias_denoise(self, img, intensity, metrics, aa=True, denoise=True, min_mask=100, planes=None,
+                          dtype=np.float32):
+        """步骤3-4：反锯齿与降噪并行执行；开启降噪时按反锯齿结果（或原图）的边缘融合，平坦区取降噪"""
+        PR = ProfessionalRestorer
+        if not denoise:
+            return PR.step3_antialiasing(img, intensity, min_mask, planes, dtype)
+        
+        planes = FramePlanes.of(img, planes)
+        nodes = [("denoise", lambda src: PR.step4_denoise(src, intensity, metrics, planes), ("img",)),
+                 ("edge_mask", lambda aa_result: self._edge_mask(aa_result, planes), ("aa",)),
+                 ("blend", MaskBlend.blend, ("denoise", "aa", "edge_mask"))]
+        values = {"img": img}
+        if aa:
+            nodes.append(("aa", lambda src: PR.step3_antialiasing(src, intensity, min_mask, planes, dtype), ("img",)))
+        else:
+            values["aa"] = img
+        return self.run_graph(nodes, values)["blend"]
+    
+    @staticmethod
+    def _edge_mask(img, planes):
+        # 与降噪同时执行：反锯齿结果另用一份缓存，不切换降噪仍在使用的 planes
+        if img is not planes.img:
+            planes = FramePlanes(img, planes.counts)
+        edge = planes.canny(50, 150)
+        edge_mask = cv2.dilate(edge, np.ones((3,3), np.uint8))
+        return cv2.GaussianBlur(edge_mask.astype(np.float32), (5,5), 1.0) / 255.0
 
 
 # ==================== 11. 图像处理器 (智能后期) ====================
 class ImageProcessor:
-    """智能后期处理器"""
+    """智能后期处理器 - 各效果的实现，按任务配置的组合与参数由 ProcessingPlan 编译"""
     
     INTENSITY = {
         "original": {"bright": 10, "contrast": 1.15, "sat": 1.3, "sharp": 0.5, "grain": 4.5, "denoise": 5},
@@ -1442,337 +1686,2392 @@ class ImageProcessor:
         "heavy": {"bright": 18, "contrast": 1.25, "sat": 1.45, "sharp": 0.7, "grain": 6.5, "denoise": 8},
     }
     
+    # 高级后期的执行顺序；GLOBAL_STATS 中的步骤依赖整帧统计量
+    ADVANCED_STEPS = ('opt_auto_wb', 'opt_auto_levels', 'opt_shadow',
+                      'opt_highlight_rec', 'opt_denoise', 'opt_dehaze')
+    GLOBAL_STATS = ('opt_auto_wb', 'opt_auto_levels', 'opt_dehaze')
+    
+    # ---- 基础后期 ----
+    @staticmethod
+    def brighten(img, beta):
+        return cv2.convertScaleAbs(img, alpha=1.0, beta=beta)
+    
+    @staticmethod
+    def contrast(img, alpha):
+        return cv2.convertScaleAbs(img, alpha=alpha, beta=-5)
+    
+    @staticmethod
+    def saturate(img, factor):
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype("float32")
+        hsv[:,:,1] = np.clip(hsv[:,:,1] * factor, 0, 255)
+        return cv2.cvtColor(hsv.astype("uint8"), cv2.COLOR_HSV2BGR)
+    
+    @staticmethod
+    def warm(img):
+        b, g, r = cv2.split(img)
+        b = cv2.add(b, 8)
+        r = cv2.subtract(r, 5)
+        return cv2.merge((b, g, r))
+    
+    @staticmethod
+    def highlight(img):
+        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+        l, a, b_ch = cv2.split(lab)
+        l = cv2.add(l, 10)
+        return cv2.cvtColor(cv2.merge((l, a, b_ch)), cv2.COLOR_LAB2BGR)
+    
+    # ---- 高级后期 ----
+    @staticmethod
+    def advanced_stat(key, img):
+        """整帧统计量：自动白平衡的 a/b 均值、自动色阶的 1%/99% 分位、去雾的大气光
+        
+        整帧处理与分块执行共用：分块执行时先在整帧上算好，再注入各图块。
+        """
+        if key == 'opt_auto_wb':
+            lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+            _, avg_a, avg_b, _ = cv2.mean(lab)
+            return avg_a, avg_b
+        if key == 'opt_auto_levels':
+            # 直方图求分位，与 np.percentile 的线性插值等价，避免整帧 float64 拷贝和排序
+            levels = []
+            n = img.shape[0] * img.shape[1]
+            for i in range(3):
+                cum = np.cumsum(np.bincount(img[:,:,i].ravel(), minlength=256))
+                bounds = []
+                for q in (1, 99):
+                    pos = q / 100.0 * (n - 1)
+                    k = int(np.floor(pos))
+                    lo_v = np.searchsorted(cum, k, side='right')
+                    hi_v = np.searchsorted(cum, min(k + 1, n - 1), side='right')
+                    bounds.append(lo_v + (pos - k) * (hi_v - lo_v))
+                levels.append(tuple(bounds))
+            return levels
+        if key == 'opt_dehaze':
+            # 暗通道的最小值/腐蚀与 /255 缩放可交换，直接在 uint8 上统计；
+            # 取暗通道最大的 n 个像素，并列时取下标靠后的（与稳定排序取末尾 n 个一致）
+            kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
+            dark = cv2.erode(np.min(img, axis=2), kernel).ravel()
+            n = max(1, int(dark.size * 0.001))
+            cum = np.cumsum(np.bincount(dark, minlength=256)[::-1])
+            v = 255 - int(np.searchsorted(cum, n))
+            above = np.flatnonzero(dark > v)
+            ties = np.flatnonzero(dark == v)[len(above) - n:]
+            idx = np.concatenate([above, ties])
+            A = np.mean(img.reshape(-1, 3)[idx], axis=0) / 255.0
+            return np.clip(A, 0.1, 1.0)
+        return None
+    
     @staticmethod
-    def apply_basic_parallel(img, opts, intensity="medium", metrics=None, smart_mode=False):
-        """并行应用基础后期处理"""
-        cfg = ImageProcessor.INTENSITY.get(intensity, ImageProcessor.INTENSITY["medium"])
+    def auto_wb(img, stat=None):
+        avg_a, avg_b = stat if stat is not None else ImageProcessor.advanced_stat('opt_auto_wb', img)
+        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB).astype(np.float32)
+        lab[:,:,1] = lab[:,:,1] - ((avg_a - 128) * (lab[:,:,0] / 255.0) * 1.1)
+        lab[:,:,2] = lab[:,:,2] - ((avg_b - 128) * (lab[:,:,0] / 255.0) * 1.1)
+        return cv2.cvtColor(np.clip(lab, 0, 255).astype(np.uint8), cv2.COLOR_LAB2BGR)
+    
+    @staticmethod
+    def auto_levels(img, stat=None):
+        levels = stat if stat is not None else ImageProcessor.advanced_stat('opt_auto_levels', img)
         result = img.copy()
+        for i in range(3):
+            ch = result[:,:,i]
+            lo, hi = levels[i]
+            if hi > lo:
+                result[:,:,i] = np.clip((ch - lo) * 255.0 / (hi - lo), 0, 255).astype(np.uint8)
+        return result
+    
+    @staticmethod
+    def lift_shadows(img):
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype(np.float32)
+        v = hsv[:,:,2]
+        mask = np.power(1 - v/255.0, 2)
+        hsv[:,:,2] = np.clip(v + 25 * mask, 0, 255)
+        return cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+    
+    @staticmethod
+    def recover_highlights(img):
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV).astype(np.float32)
+        v = hsv[:,:,2]
+        mask = np.power(v/255.0, 3)
+        hsv[:,:,2] = np.clip(v - 20 * mask, 0, 255)
+        return cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+    
+    @staticmethod
+    def nl_denoise(img, h):
+        return cv2.fastNlMeansDenoisingColored(img, None, h, h, 7, 21)
+    
+    @staticmethod
+    def _dehaze(img, strength=0.85, A=None, dtype=np.float32):
+        if A is None:
+            A = ImageProcessor.advanced_stat('opt_dehaze', img)
+        img_f = BufferArena.cast(0, img, dtype)
+        img_f /= 255.0
+        result = ImageProcessor.dehaze_bgr(img_f, A, strength, out=BufferArena.get(1, img.shape, dtype))
+        result *= 255
+        return result.astype(np.uint8)
+    
+    @staticmethod
+    def dehaze_bgr(bgr, A, strength=0.85, out=None):
+        """去雾的浮点版本：bgr 为 0-1 的浮点平面，A 为大气光；结果截断到 0-1，写入 out（默认新分配）"""
+        A = np.asarray(A, bgr.dtype)
+        result = np.divide(bgr, np.maximum(A, 0.01), out=out)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
+        trans = 1 - strength * cv2.erode(np.min(result, axis=2), kernel)
+        trans = np.clip(trans, 0.1, 1.0)
+        for i in range(3):
+            channel = result[:,:,i]
+            np.subtract(bgr[:,:,i], A[i], out=channel)
+            channel /= trans
+            channel += A[i]
+        return np.clip(result, 0, 1, out=result)
+    
+    # ---- 滤镜 ----
+    @staticmethod
+    def sharpen(img, amount, planes=None):
+        gray = FramePlanes.of(img, planes).gray()
+        mask = cv2.threshold(gray, 25, 1, cv2.THRESH_BINARY)[1].astype(np.float32)
+        mask = cv2.GaussianBlur(mask, (0,0), 5)
         
-        tasks = []
-        
-        if opts.get('opt_bright'):
-            if not smart_mode or not metrics or metrics.get("brightness", 128) < 160:
-                tasks.append(("bright", cfg["bright"]))
-        
-        if opts.get('opt_contrast'):
-            if not smart_mode or not metrics or metrics.get("contrast", 50) < 70:
-                tasks.append(("contrast", cfg["contrast"]))
-        
-        if opts.get('opt_sat'):
-            if not smart_mode or not metrics or metrics.get("saturation", 100) < 150:
-                tasks.append(("sat", cfg["sat"]))
-        
-        if opts.get('opt_temp'):
-            tasks.append(("temp", None))
-        
-        if opts.get('opt_highlight'):
-            tasks.append(("highlight", None))
-        
-        for task, param in tasks:
-            if task == "bright":
-                result = cv2.convertScaleAbs(result, alpha=1.0, beta=param)
-            elif task == "contrast":
-                result = cv2.convertScaleAbs(result, alpha=param, beta=-5)
-            elif task == "sat":
-                hsv = cv2.cvtColor(result, cv2.COLOR_BGR2HSV).astype("float32")
-                hsv[:,:,1] = np.clip(hsv[:,:,1] * param, 0, 255)
-                result = cv2.cvtColor(hsv.astype("uint8"), cv2.COLOR_HSV2BGR)
-            elif task == "temp":
-                b, g, r = cv2.split(result)
-                b = cv2.add(b, 8)
-                r = cv2.subtract(r, 5)
-                result = cv2.merge((b, g, r))
-            elif task == "highlight":
-                lab = cv2.cvtColor(result, cv2.COLOR_BGR2LAB)
-                l, a, b_ch = cv2.split(lab)
-                l = cv2.add(l, 10)
-                result = cv2.cvtColor(cv2.merge((l, a, b_ch)), cv2.COLOR_LAB2BGR)
+        blur = cv2.GaussianBlur(img, (0,0), 2.0)
+        unsharp = cv2.addWeighted(img, 1 + amount, blur, -amount, 0)
+        return MaskBlend.blend(img, unsharp, mask)
+    
+    @staticmethod
+    def landscape(img):
+        result = cv2.convertScaleAbs(img, alpha=1.1, beta=0)
+        hsv = cv2.cvtColor(result, cv2.COLOR_BGR2HSV).astype("float32")
+        hsv[:,:,1] = np.clip(hsv[:,:,1] * 1.2, 0, 255)
+        result = cv2.cvtColor(hsv.astype("uint8"), cv2.COLOR_HSV2BGR)
+        b, g, r = cv2.split(result)
+        b = cv2.add(b, 12)
+        return cv2.merge((b, g, r))
+    
+    @staticmethod
+    def vintage(img):
+        img_f = img.astype(np.float32) / 255.0
+        b, g, r = cv2.split(img_f)
+        b = b + (1.0 - b) * 0.2 * (1.0 - r)
+        r = r + r * 0.2
+        return (np.clip(cv2.merge((b, g, r)), 0, 1) * 255).astype(np.uint8)
+    
+    @staticmethod
+    def cinematic(img):
+        b, g, r = cv2.split(img.astype(np.float32))
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+        b = b + (1 - gray) * 15 * 0.25
+        r = r + gray * 10 * 0.25
+        return np.clip(cv2.merge((b, g, r)), 0, 255).astype(np.uint8)
+    
+    @staticmethod
+    def anime_enhance(img):
+        smoothed = cv2.bilateralFilter(img, 9, 75, 75)
+        hsv = cv2.cvtColor(smoothed, cv2.COLOR_BGR2HSV).astype(np.float32)
+        hsv[:,:,1] = np.clip(hsv[:,:,1] * 1.2, 0, 255)
+        return cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
+    
+    @staticmethod
+    def film_grain(img, sigma, planes=None):
+        gray = FramePlanes.of(img, planes).gray()
+        mask = cv2.threshold(gray, 25, 1, cv2.THRESH_BINARY)[1].astype(np.float32)
+        mask = cv2.GaussianBlur(mask, (0,0), 5)
+        noise = np.random.normal(0, sigma, img.shape).astype(np.float32)
+        return MaskBlend.add(img, noise, mask)
+    
+    # ---- 浮点工作平面 ----
+    # 供 ProcessingPlan 合并相邻步骤的色彩空间转换：BGR 为 0-1 的 float32，LAB/HSV 沿用 OpenCV
+    # 的浮点约定（L 0-100、a/b 约 ±127；H 0-360、S/V 0-1）。各函数就地修改并返回工作平面，
+    # 参数与上面的 uint8 版本一致（按浮点量纲换算）。
+    @classmethod
+    def space_ops(cls, key):
+        """key 对应效果的浮点版本 ((色彩空间, fn(平面, 整帧统计量)), ...)，没有时返回 None
         
-        return result
+        自动白平衡不提供浮点版本：它依赖 uint8 LAB 往返的截断，饱和色上浮点 LAB 的结果
+        会相差数十级，因此始终单独按 uint8 执行。
+        """
+        return {
+            "opt_auto_levels": (("bgr", cls.auto_levels_bgr),),
+            "opt_shadow": (("hsv", lambda hsv, stat: cls.lift_shadows_hsv(hsv)),),
+            "opt_highlight_rec": (("hsv", lambda hsv, stat: cls.recover_highlights_hsv(hsv)),),
+            "opt_dehaze": (("bgr", lambda bgr, stat: cls.dehaze_bgr(bgr, stat)),),
+            "opt_landscape": (("bgr", lambda bgr, stat: cls._gain_bgr(bgr, 1.1)),
+                              ("hsv", lambda hsv, stat: cls.saturate_hsv(hsv, 1.2)),
+                              ("bgr", lambda bgr, stat: cls._offset_blue(bgr, 12))),
+            "opt_vintage": (("bgr", lambda bgr, stat: cls.vintage_bgr(bgr)),),
+            "opt_cinematic": (("bgr", lambda bgr, stat: cls.cinematic_bgr(bgr)),),
+            "opt_anime_enhance": (("bgr", lambda bgr, stat: cv2.bilateralFilter(bgr, 9, 75 / 255.0, 75)),
+                                  ("hsv", lambda hsv, stat: cls.saturate_hsv(hsv, 1.2))),
+        }.get(key)
     
     @staticmethod
-    def apply_advanced_parallel(img, opts, intensity="medium", metrics=None, smart_mode=False):
-        """并行应用高级后期处理"""
-        cfg = ImageProcessor.INTENSITY.get(intensity, ImageProcessor.INTENSITY["medium"])
-        result = img.copy()
+    def saturate_hsv(hsv, factor):
+        s = hsv[:,:,1]
+        s *= factor
+        np.minimum(s, 1, out=s)
+        return hsv
+    
+    @staticmethod
+    def auto_levels_bgr(bgr, stat):
+        # 各通道 (x - lo) / (hi - lo) 合为一次仿射变换
+        m = np.zeros((3, 4), np.float32)
+        for i, (lo, hi) in enumerate(stat):
+            scale = 255.0 / (hi - lo) if hi > lo else 1.0
+            m[i, i] = scale
+            m[i, 3] = -lo / 255.0 * scale if hi > lo else 0.0
+        bgr = cv2.transform(bgr, m)
+        return np.clip(bgr, 0, 1, out=bgr)
+    
+    @staticmethod
+    def lift_shadows_hsv(hsv):
+        v = hsv[:,:,2]
+        mask = 1 - v
+        mask *= mask
+        v += mask * (25 / 255.0)
+        np.minimum(v, 1, out=v)
+        return hsv
+    
+    @staticmethod
+    def recover_highlights_hsv(hsv):
+        v = hsv[:,:,2]
+        v -= v * v * v * (20 / 255.0)
+        np.maximum(v, 0, out=v)
+        return hsv
+    
+    @staticmethod
+    def _gain_bgr(bgr, alpha):
+        bgr *= alpha
+        return np.minimum(bgr, 1, out=bgr)
+    
+    @staticmethod
+    def _offset_blue(bgr, beta):
+        b = bgr[:,:,0]
+        b += beta / 255.0
+        np.minimum(b, 1, out=b)
+        return bgr
+    
+    @staticmethod
+    def vintage_bgr(bgr):
+        b, r = bgr[:,:,0], bgr[:,:,2]
+        b += (1.0 - b) * (1.0 - r) * 0.2
+        r *= 1.2
+        return np.minimum(bgr, 1, out=bgr)
+    
+    @staticmethod
+    def cinematic_bgr(bgr):
+        # gray 是 BGR 的线性组合，b += (1 - gray)·kb、r += gray·kr 合为一次仿射变换
+        weights = np.float32([0.114, 0.587, 0.299])
+        kb, kr = 15 * 0.25 / 255.0, 10 * 0.25 / 255.0
+        m = np.zeros((3, 4), np.float32)
+        m[:, :3] = np.eye(3)
+        m[0, :3] -= kb * weights
+        m[0, 3] = kb
+        m[2, :3] += kr * weights
+        bgr = cv2.transform(bgr, m)
+        return np.minimum(bgr, 1, out=bgr)
+
+
+# ==================== 12. 音频处理 ====================
+class FFmpegRunner:
+    """FFmpeg命令执行器 - 逐行读取 -progress 输出汇报编码进度
+    
+    不设总时长上限：只有输出在 STALL_SECONDS 内没有任何进展（帧数、时间戳、文件大小
+    都不变）时才判定卡死并结束进程，长视频编码不会再被固定超时误杀。
+    """
+    
+    STALL_SECONDS = 120
+    
+    def __init__(self, cmd, on_progress=None, stall_seconds=None):
+        # -progress 必须放在输入/输出参数之前，紧跟可执行文件
+        self.cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+        self.on_progress = on_progress    # on_progress({"frame", "fps", "speed", "out_time"})
+        self.stall_seconds = stall_seconds or self.STALL_SECONDS
+        self.returncode = None
+        self.stalled = False
+        self._stderr_tail = deque(maxlen=20)
+        self._last_change = 0.0
+    
+    def _drain_stderr(self, proc):
+        try:
+            for line in iter(proc.stderr.readline, b''):
+                self._stderr_tail.append(line.decode('utf-8', errors='ignore').rstrip())
+        except:
+            pass
+    
+    def _watchdog(self, proc):
+        while proc.poll() is None:
+            time.sleep(1)
+            if time.time() - self._last_change > self.stall_seconds and proc.poll() is None:
+                self.stalled = True
+                print(f"[FFmpeg错误] {self.stall_seconds}秒无进展，判定卡死")
+                proc.kill()
+                return
+    
+    def run(self):
+        """执行命令直到结束，返回进程返回码（卡死或无法启动时为非0）"""
+        si = subprocess.STARTUPINFO()
+        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        proc = subprocess.Popen(self.cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, startupinfo=si)
+        
+        self._last_change = time.time()
+        threads = [threading.Thread(target=self._drain_stderr, args=(proc,), daemon=True),
+                   threading.Thread(target=self._watchdog, args=(proc,), daemon=True)]
+        for t in threads:
+            t.start()
+        
+        block, last_state = {}, None
+        for raw in iter(proc.stdout.readline, b''):
+            key, _, value = raw.decode('utf-8', errors='ignore').strip().partition('=')
+            block[key] = value
+            if key != 'progress':
+                continue
+            
+            state = (block.get('frame'), block.get('out_time_us'), block.get('total_size'))
+            if state != last_state:
+                last_state = state
+                self._last_change = time.time()
+            if self.on_progress:
+                try:
+                    self.on_progress(self._parse(block))
+                except:
+                    pass
+            block = {}
         
-        def should_apply(key):
-            if not opts.get(key):
+        proc.wait()
+        threads[0].join(timeout=5)
+        self.returncode = proc.returncode if not self.stalled else -1
+        return self.returncode
+    
+    @staticmethod
+    def _parse(block):
+        def num(key, cast):
+            try:
+                return cast(block.get(key, 0))
+            except:
+                return cast(0)
+        return {
+            "frame": num('frame', int),
+            "fps": num('fps', float),
+            "speed": block.get('speed', 'N/A').strip(),
+            "out_time": num('out_time_us', int) / 1e6,
+        }
+    
+    def get_error(self):
+        if self.stalled:
+            return f"{self.stall_seconds}秒无进展，已终止"
+        return "\n".join(list(self._stderr_tail)[-5:]) or "无"
+
+
+class AudioHandler:
+    @staticmethod
+    def _get_ffmpeg():
+        exe = PM.get_exe("ffmpeg")
+        return exe if exe and os.path.isfile(exe) else "ffmpeg"
+    
+    # 各输出容器可直接流复制的音频编码；不在表中的容器或编码一律转AAC
+    COPY_AUDIO_CODECS = {
+        '.mp4': {'aac', 'mp3', 'ac3', 'eac3', 'alac'},
+        '.m4v': {'aac', 'mp3', 'ac3', 'eac3', 'alac'},
+        '.mov': {'aac', 'mp3', 'ac3', 'eac3', 'alac', 'pcm_s16le', 'pcm_s24le'},
+        '.mkv': None,   # Matroska 可容纳任意音频编码
+        '.avi': {'mp3', 'ac3', 'pcm_s16le'},
+    }
+    
+    @staticmethod
+    def can_copy_audio(codec, output):
+        """源音频编码能否原样放进 output 的容器"""
+        if not codec:
+            return False
+        ext = os.path.splitext(output)[1].lower()
+        if ext not in AudioHandler.COPY_AUDIO_CODECS:
+            return False
+        allowed = AudioHandler.COPY_AUDIO_CODECS[ext]
+        return allowed is None or codec in allowed
+    
+    @staticmethod
+    def _audio_args(audio, output):
+        """音频编码参数：容器支持源编码时流复制（无损、几乎不耗CPU），否则转AAC"""
+        if AudioHandler.can_copy_audio(MediaProbe.audio_codec(audio), output):
+            return ['-c:a', 'copy']
+        return ['-c:a', 'aac', '-b:a', '128k', '-ac', '2']
+    
+    @staticmethod
+    def has_audio(path):
+        """path 是否含音轨；无法探测时返回 None，由 '-map N:a:0?' 兜底"""
+        codec = MediaProbe.audio_codec(path)
+        return None if codec is None else bool(codec)
+    
+    @staticmethod
+    def _h264_args(fps):
+        """H.264视频编码参数 - 2025万能兼容版"""
+        # GOP大小：30fps用90，60fps用180
+        gop_size = 90 if fps <= 30 else 180
+        keyint_min = 30 if fps <= 30 else 60
+        return [
+            '-c:v', 'libx264',
+            '-profile:v', 'main',
+            '-level', '4.0',
+            '-preset', 'medium',
+            '-crf', '23',                    # 画质优秀，体积更小
+            '-pix_fmt', 'yuv420p',
+            '-g', str(gop_size),             # 关键帧间隔
+            '-keyint_min', str(keyint_min),
+            '-bf', '2',
+            '-movflags', '+faststart',       # 网页秒开必加
+        ]
+    
+    # ==================== 4. 替换 AudioHandler 类的 merge_h264 方法 ====================
+    @staticmethod
+    def merge_h264(video_frames_dir, audio, output, fps, width, height, on_progress=None):
+        """使用FFmpeg的H.264编码合并视频 - 2025万能兼容版"""
+        try:
+            ffmpeg = AudioHandler._get_ffmpeg()
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            
+            if not os.path.isfile(ffmpeg):
+                print(f"[FFmpeg错误] FFmpeg不存在: {ffmpeg}")
                 return False
-            if smart_mode and metrics:
-                recommendations = ImageAnalyzer.get_recommendations(metrics)
-                rec = recommendations.get(key, {})
-                if rec.get("skip"):
-                    return False
-            return True
-        
-        if should_apply('opt_auto_wb'):
-            lab = cv2.cvtColor(result, cv2.COLOR_BGR2LAB).astype(np.float32)
-            avg_a, avg_b = np.average(lab[:,:,1]), np.average(lab[:,:,2])
-            lab[:,:,1] = lab[:,:,1] - ((avg_a - 128) * (lab[:,:,0] / 255.0) * 1.1)
-            lab[:,:,2] = lab[:,:,2] - ((avg_b - 128) * (lab[:,:,0] / 255.0) * 1.1)
-            result = cv2.cvtColor(np.clip(lab, 0, 255).astype(np.uint8), cv2.COLOR_LAB2BGR)
+            
+            first_frame = os.path.join(video_frames_dir, 'frame_000000.png')
+            if not os.path.exists(first_frame):
+                print(f"[FFmpeg错误] 帧文件不存在: {first_frame}")
+                return False
+            
+            cmd = [
+                ffmpeg,
+                '-y',
+                '-framerate', str(fps),
+                '-i', os.path.join(video_frames_dir, 'frame_%06d.png'),
+            ]
+            
+            if audio and os.path.exists(audio):
+                cmd.extend(['-i', audio, '-map', '0:v:0', '-map', '1:a:0?'])
+            
+            cmd.extend(AudioHandler._h264_args(fps))
+            
+            if audio and os.path.exists(audio):
+                cmd.extend(AudioHandler._audio_args(audio, output))
+            
+            cmd.append(output)
+            
+            print(f"[FFmpeg] 万能兼容编码中...")
+            
+            runner = FFmpegRunner(cmd, on_progress)
+            if runner.run() != 0:
+                print(f"[FFmpeg错误] 返回码: {runner.returncode}")
+                print(f"[FFmpeg stderr] {runner.get_error()}")
+                return False
+            
+            if os.path.exists(output) and os.path.getsize(output) > 1000:
+                print(f"[FFmpeg] 编码成功: {output}")
+                return True
+            else:
+                print(f"[FFmpeg错误] 输出文件无效")
+                return False
+                
+        except Exception as e:
+            print(f"[FFmpeg错误] 异常: {e}")
+            return False
+    
+    @staticmethod
+    def merge(video, audio, output, on_progress=None):
+        """合并视频和音频"""
+        try:
+            ffmpeg = AudioHandler._get_ffmpeg()
+            FFmpegRunner([ffmpeg, '-i', video, '-i', audio, '-map', '0:v:0', '-map', '1:a:0?',
+                          '-c:v', 'copy'] + AudioHandler._audio_args(audio, output) + ['-y', output],
+                         on_progress).run()
+            return os.path.exists(output)
+        except:
+            return False
+    
+    @staticmethod
+    def concat(segments, audio, output, list_path, on_progress=None):
+        """用concat分离器无损拼接分段视频（视频流复制，不重新编码）"""
+        try:
+            ffmpeg = AudioHandler._get_ffmpeg()
+            
+            with open(list_path, 'w', encoding='utf-8') as f:
+                for seg in segments:
+                    path = os.path.abspath(seg).replace('\\', '/').replace("'", "'\\''")
+                    f.write(f"file '{path}'\n")
+            
+            cmd = [ffmpeg, '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+            if audio and os.path.exists(audio):
+                cmd.extend(['-i', audio, '-map', '0:v:0', '-map', '1:a:0?'])
+                cmd.extend(AudioHandler._audio_args(audio, output))
+            cmd.extend(['-c:v', 'copy', '-movflags', '+faststart', output])
+            
+            runner = FFmpegRunner(cmd, on_progress)
+            if runner.run() != 0:
+                print(f"[FFmpeg错误] 拼接失败, 返回码: {runner.returncode}")
+                print(f"[FFmpeg stderr] {runner.get_error()}")
+                return False
+            return os.path.exists(output) and os.path.getsize(output) > 1000
+        except Exception as e:
+            print(f"[FFmpeg错误] 拼接异常: {e}")
+            return False
+    
+    # ==================== 5. 替换 AudioHandler 类的 encode_h264 方法 ====================
+    @staticmethod
+    def encode_h264(input_raw, output, fps, on_progress=None):
+        """将原始视频重新编码为H.264 - 2025万能兼容版"""
+        try:
+            ffmpeg = AudioHandler._get_ffmpeg()
+            
+            cmd = [ffmpeg, '-y', '-i', input_raw]
+            cmd.extend(AudioHandler._h264_args(fps))
+            cmd.extend(AudioHandler._audio_args(input_raw, output))
+            cmd.append(output)
+            
+            FFmpegRunner(cmd, on_progress).run()
+            return os.path.exists(output)
+        except:
+            return False
+
+# ==================== 12.1 FFmpeg流式编码器 ====================
+class FFmpegStreamWriter:
+    """FFmpeg流式编码器 - 通过stdin管道写入原始BGR帧，处理与编码同时进行，不落地中间图片
+    
+    pix_fmt 为 "yuv420p" 时写入 I420 布局的平面帧（见 FFmpegFrameReader），编码器不再做色彩转换。
+    """
+    
+    def __init__(self, output, fps, audio=None, pix_fmt="bgr24"):
+        self.output = output
+        self.fps = fps
+        self.audio = audio
+        self.pix_fmt = pix_fmt
+        self.proc = None
+        self.size = None
+        self.frames_written = 0
+        self._stderr_tail = []
+        self._stderr_thread = None
+    
+    def _build_cmd(self, width, height):
+        ffmpeg = AudioHandler._get_ffmpeg()
+        cmd = [
+            ffmpeg,
+            '-y',
+            '-f', 'rawvideo',
+            '-pix_fmt', self.pix_fmt,
+            '-s', f'{width}x{height}',
+            '-framerate', str(self.fps),
+            '-i', 'pipe:0',
+        ]
+        
+        if self.audio and os.path.exists(self.audio):
+            cmd.extend(['-i', self.audio, '-map', '0:v:0', '-map', '1:a:0?'])
+        
+        cmd.extend(AudioHandler._h264_args(self.fps))
+        
+        if self.audio and os.path.exists(self.audio):
+            cmd.extend(AudioHandler._audio_args(self.audio, self.output))
+        
+        cmd.append(self.output)
+        return cmd
+    
+    def _drain_stderr(self):
+        """持续读取stderr，避免管道写满导致FFmpeg阻塞"""
+        try:
+            for line in iter(self.proc.stderr.readline, b''):
+                self._stderr_tail.append(line.decode('utf-8', errors='ignore').rstrip())
+                if len(self._stderr_tail) > 20:
+                    self._stderr_tail.pop(0)
+        except:
+            pass
+    
+    def start(self, width, height):
+        """启动FFmpeg进程"""
+        try:
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            
+            self.size = (width, height)
+            self.proc = subprocess.Popen(
+                self._build_cmd(width, height),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                startupinfo=si,
+            )
+            self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+            self._stderr_thread.start()
+            print(f"[FFmpeg] 流式编码已启动: {width}x{height} @ {self.fps:.2f}fps")
+            return True
+        except Exception as e:
+            print(f"[FFmpeg错误] 无法启动流式编码: {e}")
+            self.proc = None
+            return False
+    
+    def write(self, frame):
+        """写入一帧BGR图像（yuv420p 模式下为 I420 平面帧）"""
+        if self.proc is None:
+            raise IOError("FFmpeg流式编码未启动")
+        
+        if self.pix_fmt == "bgr24" and (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size)
+        
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(frame).data)
+            self.frames_written += 1
+        except (BrokenPipeError, OSError, ValueError):
+            raise IOError(f"FFmpeg流式编码中断: {self.get_error()}")
+    
+    def close(self):
+        """结束输入并等待编码完成"""
+        if self.proc is None:
+            return False
+        
+        try:
+            self.proc.stdin.close()
+        except:
+            pass
+        
+        returncode = self.proc.wait()
+        if self._stderr_thread:
+            self._stderr_thread.join(timeout=5)
+        
+        if returncode != 0:
+            print(f"[FFmpeg错误] 返回码: {returncode}")
+            print(f"[FFmpeg stderr] {self.get_error()}")
+            return False
+        
+        if os.path.exists(self.output) and os.path.getsize(self.output) > 1000:
+            print(f"[FFmpeg] 编码成功: {self.output} ({self.frames_written}帧)")
+            return True
+        
+        print("[FFmpeg错误] 输出文件无效")
+        return False
+    
+    def abort(self):
+        """终止编码并删除不完整的输出文件"""
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+            except:
+                pass
+            try:
+                self.proc.kill()
+                self.proc.wait(timeout=10)
+            except:
+                pass
+        
+        try:
+            if os.path.exists(self.output):
+                os.remove(self.output)
+        except:
+            pass
+    
+    def get_error(self):
+        return "\n".join(self._stderr_tail[-5:]) if self._stderr_tail else "无"
+
+# ==================== 12.2 帧级并行调度 ====================
+class OrderedFramePool:
+    """帧级数据并行 - N个工作线程各自处理整帧，重排缓冲区按帧序交给输出端"""
+    
+    def __init__(self, process_fn, emit_fn, workers=4, queue_size=None, start_index=0, budget=None):
+        self.process_fn = process_fn    # process_fn(frame, history) -> result
+        self.emit_fn = emit_fn          # emit_fn(index, result)，严格按帧序调用
+        self.workers = max(1, workers)
+        self.budget = budget            # CPUBudget：给出时同时处理的线程数受其闸门限制
+        self.queue_size = queue_size or self.workers * 2
+        
+        self._in_queue = queue.Queue(maxsize=self.queue_size)
+        # 限制在途帧总数（输入队列 + 处理中 + 重排缓冲），防止慢帧导致缓冲无限增长
+        self._inflight = threading.Semaphore(self.queue_size + self.workers * 2)
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._next_index = start_index
+        self._submitted = start_index
+        self._closed = False
+        self._error = None
+        self._threads = []
+        self._emitter = None
+    
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"frame-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        self._emitter = threading.Thread(target=self._emit_loop, name="frame-emitter", daemon=True)
+        self._emitter.start()
+    
+    def submit(self, index, frame, history):
+        """提交一帧（在途帧过多时阻塞，形成背压）"""
+        while not self._inflight.acquire(timeout=0.1):
+            self._raise_if_failed()
+        self._raise_if_failed()
+        self._in_queue.put((index, frame, history))
+        with self._cond:
+            self._submitted = index + 1
+    
+    def finish(self):
+        """停止接收新帧，等待已提交的帧全部输出"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for _ in self._threads:
+            self._in_queue.put(None)
+        for t in self._threads:
+            t.join()
+        if self._emitter:
+            self._emitter.join()
+        self._raise_if_failed()
+    
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+    
+    def _fail(self, error):
+        with self._cond:
+            if self._error is None:
+                self._error = error
+            self._cond.notify_all()
+    
+    def _worker(self):
+        while True:
+            job = self._in_queue.get()
+            if job is None:
+                break
+            if self._error is not None:
+                continue
+            
+            index, frame, history = job
+            try:
+                if self.budget:
+                    with self.budget.slot():
+                        result = self.process_fn(frame, history)
+                else:
+                    result = self.process_fn(frame, history)
+            except Exception as e:
+                self._fail(e)
+                continue
+            
+            with self._cond:
+                self._pending[index] = result
+                self._cond.notify_all()
+    
+    def _emit_loop(self):
+        while True:
+            with self._cond:
+                while (self._next_index not in self._pending and self._error is None
+                       and not (self._closed and self._next_index >= self._submitted)):
+                    self._cond.wait()
+                if self._error is not None or self._next_index not in self._pending:
+                    return
+                index = self._next_index
+                result = self._pending.pop(index)
+                self._next_index += 1
+            
+            try:
+                self.emit_fn(index, result)
+            except Exception as e:
+                self._fail(e)
+                return
+            self._inflight.release()
+
+
+# ==================== 12.3 多进程帧并行 (共享内存) ====================
+class FrameProcessPool:
+    """多进程帧并行 - 绕开GIL
+    
+    帧数据放在 multiprocessing.shared_memory 预分配的环形帧槽中，
+    进程间只传递 (帧序号, 槽位号)，帧数组本身从不经过pickle。
+    第 i 帧固定使用槽位 i % slots，输入槽同时充当后续帧的时序参考。
+    主进程已建好的颜色查找表（每张 64MB）同样放入共享内存，工作进程编译计划时直接复用。
+    """
+    
+    def __init__(self, task, sample_metrics, emit_fn, workers=4, tables=None):
+        self.task = task
+        self.sample_metrics = sample_metrics
+        self.tables = tables or {}
+        self.emit_fn = emit_fn
+        self.workers = max(1, workers)
+        self.history_len = ProfessionalRestorer.TEMPORAL_HISTORY
+        self.slots = self.workers * 2 + self.history_len + 1
+        
+        self.shape = None
+        self._base_index = 0
+        self._shm_in = None
+        self._shm_out = None
+        self._shm_tables = []
+        self._in_ring = None
+        self._out_ring = None
+        self._jobs = None
+        self._done = None
+        self._procs = []
+        self._collector = None
+        
+        self._cond = threading.Condition()
+        self._submitted = 0
+        self._emitted = 0
+        self._closed = False
+        self._error = None
+    
+    def start(self, shape):
+        """按帧尺寸分配共享内存并启动工作进程"""
+        self.shape = tuple(shape)
+        frame_bytes = int(np.prod(self.shape))
+        self._shm_in = shared_memory.SharedMemory(create=True, size=frame_bytes * self.slots)
+        self._shm_out = shared_memory.SharedMemory(create=True, size=frame_bytes * self.slots)
+        self._in_ring = np.ndarray((self.slots,) + self.shape, np.uint8, buffer=self._shm_in.buf)
+        self._out_ring = np.ndarray((self.slots,) + self.shape, np.uint8, buffer=self._shm_out.buf)
+        
+        tables = []
+        for key, table in self.tables.items():
+            shm = shared_memory.SharedMemory(create=True, size=table.nbytes)
+            np.ndarray(table.shape, table.dtype, buffer=shm.buf)[...] = table
+            self._shm_tables.append(shm)
+            tables.append((key, shm.name, table.shape, table.dtype.str))
+        
+        ctx = multiprocessing.get_context("spawn")
+        self._jobs = ctx.Queue()
+        self._done = ctx.Queue()
+        for i in range(self.workers):
+            p = ctx.Process(
+                target=FrameProcessPool._worker_main,
+                args=(self.task, self.sample_metrics, self._shm_in.name, self._shm_out.name,
+                      self.slots, self.shape, self._jobs, self._done, tables),
+                name=f"frame-proc-{i}", daemon=True,
+            )
+            p.start()
+            self._procs.append(p)
+        
+        self._collector = threading.Thread(target=self._collect_loop, name="frame-collector", daemon=True)
+        self._collector.start()
+    
+    def submit(self, index, frame, history=None):
+        """写入输入槽并派发任务；时序参考帧取自前序槽位
+        
+        history 只在首帧时使用：从中途开始（断点续传）时把预热帧放入前序槽位。
+        """
+        if self.shape is None:
+            self.start(frame.shape)
+            history = list(history or [])[-self.history_len:]
+            self._base_index = index - len(history)
+            for i, prev in enumerate(history):
+                self._write_slot(self._base_index + i, prev)
+            with self._cond:
+                self._submitted = self._emitted = index
+        
+        # 槽位复用条件：上一轮占用该槽的帧及以它为参考的帧都已输出
+        with self._cond:
+            while self._emitted < index - self.slots + self.history_len + 1 and self._error is None:
+                self._cond.wait(0.1)
+        self._raise_if_failed()
+        
+        slot = self._write_slot(index, frame)
+        history_slots = [j % self.slots for j in range(max(self._base_index, index - self.history_len), index)]
+        with self._cond:
+            self._submitted = index + 1
+        self._jobs.put((index, slot, history_slots))
+    
+    def _write_slot(self, index, frame):
+        slot = index % self.slots
+        if frame.shape != self.shape:
+            frame = cv2.resize(frame, (self.shape[1], self.shape[0]))
+        self._in_ring[slot][...] = frame
+        return slot
+    
+    def finish(self):
+        """等待已提交的帧全部输出，然后关闭工作进程并释放共享内存"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        
+        try:
+            if self._collector:
+                self._collector.join()
+            for _ in self._procs:
+                self._jobs.put(None)
+            for p in self._procs:
+                p.join(timeout=5)
+                if p.is_alive():
+                    p.terminate()
+        finally:
+            self._release()
+        
+        self._raise_if_failed()
+    
+    def _release(self):
+        self._in_ring = None
+        self._out_ring = None
+        for shm in [self._shm_in, self._shm_out] + self._shm_tables:
+            if shm is None:
+                continue
+            try:
+                shm.close()
+                shm.unlink()
+            except:
+                pass
+        self._shm_in = None
+        self._shm_out = None
+        self._shm_tables = []
+    
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+    
+    def _fail(self, error):
+        with self._cond:
+            if self._error is None:
+                self._error = error
+            self._cond.notify_all()
+    
+    def _collect_loop(self):
+        """收集工作进程的完成通知，按帧序输出"""
+        finished = set()
+        while True:
+            with self._cond:
+                if self._error is not None:
+                    return
+                if self._closed and self._emitted >= self._submitted:
+                    return
+            
+            try:
+                kind, index, info = self._done.get(timeout=0.1)
+            except queue.Empty:
+                # 工作进程只在 finish() 发出结束信号、本循环退出后才正常退出；此前任一进程退出
+                # （被系统杀掉、cv2 原生崩溃）都意味着它手上的帧不会再完成；退出前发出的错误先取走
+                dead = [p for p in self._procs if not p.is_alive()]
+                if dead and self._done.empty():
+                    self._fail(RuntimeError(f"工作进程 {dead[0].name} 意外退出 (退出码 {dead[0].exitcode})"))
+                    return
+                continue
+            
+            if kind == "error":
+                if index is None:
+                    self._fail(RuntimeError(f"工作进程启动失败: {info}"))
+                else:
+                    self._fail(RuntimeError(f"工作进程处理第{index}帧失败: {info}"))
+                return
+            
+            finished.add(index)
+            while self._emitted in finished:
+                index = self._emitted
+                finished.remove(index)
+                try:
+                    self.emit_fn(index, self._out_ring[index % self.slots].copy())
+                except Exception as e:
+                    self._fail(e)
+                    return
+                with self._cond:
+                    self._emitted += 1
+                    self._cond.notify_all()
+    
+    @staticmethod
+    def _worker_main(task, sample_metrics, shm_in_name, shm_out_name, slots, shape, jobs, done, tables=()):
+        """工作进程入口：从共享内存槽读帧，处理后写回输出槽
+        
+        启动失败（连接共享内存、编译计划）时发出 ("error", None, 原因) 后退出。
+        """
+        cv2.setNumThreads(1)
+        shm_in = shm_out = None
+        shm_tables = []
+        in_ring = out_ring = pipeline = shared_tables = None
+        try:
+            shm_in = shared_memory.SharedMemory(name=shm_in_name)
+            shm_out = shared_memory.SharedMemory(name=shm_out_name)
+            in_ring = np.ndarray((slots,) + tuple(shape), np.uint8, buffer=shm_in.buf)
+            out_ring = np.ndarray((slots,) + tuple(shape), np.uint8, buffer=shm_out.buf)
+            for _, name, _, _ in tables:
+                shm_tables.append(shared_memory.SharedMemory(name=name))
+            shared_tables = {key: np.ndarray(table_shape, np.dtype(dtype), buffer=shm.buf)
+                             for (key, _, table_shape, dtype), shm in zip(tables, shm_tables)}
+            
+            pipeline = VideoPipeline(task, lambda msg: None, {"cores": 2}, 1.0)
+            pipeline.sample_metrics = sample_metrics
+            pipeline._compile_plan(task.get_config(), shared_tables)
+            
+            while True:
+                job = jobs.get()
+                if job is None:
+                    break
+                index, slot, history_slots = job
+                try:
+                    history = [in_ring[s] for s in history_slots]
+                    out_ring[slot][...] = pipeline._process_frame(in_ring[slot], history)
+                    done.put(("ok", index, None))
+                except Exception as e:
+                    done.put(("error", index, str(e)))
+        except Exception as e:
+            done.put(("error", None, f"{type(e).__name__}: {e}"))
+        finally:
+            # 帧槽与计划中的查找表引用共享内存，先释放
+            in_ring = out_ring = pipeline = shared_tables = None
+            for shm in [shm_in, shm_out] + shm_tables:
+                if shm is not None:
+                    shm.close()
+
+
+# ==================== 12.4 流水线并行 ====================
+class StagePipeline:
+    """流水线并行 - 解码、各处理阶段、编码各占一个线程，阶段间以有界队列相连
+    
+    队列写满时上游阻塞（背压），解码和编码的耗时因此被计算阶段掩盖。
+    每个阶段统计处理时间、等待输入时间、输出阻塞时间和输入队列平均深度。
+    """
+    
+    _END = object()
+    
+    def __init__(self, stages, queue_size=4):
+        self.stages = stages            # [(name, fn)]，fn(item) -> item
+        self.queue_size = max(1, queue_size)
+        self.stats = {}
+        self._error = None
+        self._stop = threading.Event()
+    
+    def run(self, source, sink, source_name="decode", sink_name="encode"):
+        """source() 逐个产出 (index, item)；sink(index, item) 在独立线程中按序消费"""
+        names = [source_name] + [name for name, _ in self.stages] + [sink_name]
+        self.stats = {name: {"items": 0, "busy": 0.0, "wait_in": 0.0, "wait_out": 0.0,
+                             "depth_sum": 0, "depth_samples": 0} for name in names}
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        
+        threads = [threading.Thread(target=self._run_source, args=(source, source_name, queues[0]),
+                                    name=f"stage-{source_name}", daemon=True)]
+        for i, (name, fn) in enumerate(self.stages):
+            threads.append(threading.Thread(target=self._run_stage, args=(name, fn, queues[i], queues[i + 1]),
+                                            name=f"stage-{name}", daemon=True))
+        threads.append(threading.Thread(target=self._run_sink, args=(sink, sink_name, queues[-1]),
+                                        name=f"stage-{sink_name}", daemon=True))
+        
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        if self._error is not None:
+            raise self._error
+    
+    def report(self):
+        """各阶段统计摘要，供日志输出"""
+        lines = []
+        for name, st in self.stats.items():
+            if st["depth_samples"]:
+                depth = f"{st['depth_sum'] / st['depth_samples']:.1f}/{self.queue_size}"
+            else:
+                depth = "-"
+            lines.append(f"[{name}] {st['items']}项 | 处理 {st['busy']:.1f}s | "
+                         f"等待输入 {st['wait_in']:.1f}s | 输出阻塞 {st['wait_out']:.1f}s | "
+                         f"输入队列 {depth}")
+        return lines
+    
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+    
+    def _get(self, q, st):
+        t0 = time.time()
+        st["depth_sum"] += q.qsize()
+        st["depth_samples"] += 1
+        while not self._stop.is_set():
+            try:
+                item = q.get(timeout=0.1)
+                st["wait_in"] += time.time() - t0
+                return item
+            except queue.Empty:
+                continue
+        return self._END
+    
+    def _put(self, q, item, st):
+        t0 = time.time()
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                st["wait_out"] += time.time() - t0
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _run_source(self, source, name, out_q):
+        st = self.stats[name]
+        try:
+            it = iter(source())
+            while True:
+                t0 = time.time()
+                item = next(it, self._END)
+                st["busy"] += time.time() - t0
+                if item is self._END or not self._put(out_q, item, st):
+                    break
+                st["items"] += 1
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(out_q, self._END, st)
+    
+    def _run_stage(self, name, fn, in_q, out_q):
+        st = self.stats[name]
+        try:
+            while True:
+                item = self._get(in_q, st)
+                if item is self._END:
+                    break
+                index, payload = item
+                t0 = time.time()
+                result = fn(payload)
+                st["busy"] += time.time() - t0
+                st["items"] += 1
+                if not self._put(out_q, (index, result), st):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(out_q, self._END, st)
+    
+    def _run_sink(self, sink, name, in_q):
+        st = self.stats[name]
+        try:
+            while True:
+                item = self._get(in_q, st)
+                if item is self._END:
+                    break
+                index, payload = item
+                t0 = time.time()
+                sink(index, payload)
+                st["busy"] += time.time() - t0
+                st["items"] += 1
+        except Exception as e:
+            self._fail(e)
+
+
+# ==================== 12.5 媒体探测 ====================
+class MediaProbe:
+    """ffprobe 媒体信息探测
+    
+    一次 ffprobe 调用同时取得时长、帧数、帧率、旋转角度和关键帧索引，
+    结果按 (路径, 大小, 修改时间) 缓存，同一文件在分析、分段、续传时不再重复探测。
+    """
+    
+    _cache = {}
+    _lock = threading.Lock()
+    
+    @staticmethod
+    def _get_ffprobe():
+        exe = PM.get_exe("ffprobe")
+        return exe if exe and os.path.isfile(exe) else "ffprobe"
+    
+    @staticmethod
+    def _rate(text):
+        try:
+            num, _, den = str(text).partition('/')
+            value = float(num) / float(den or 1)
+            return value if value > 0 else 0.0
+        except:
+            return 0.0
+    
+    @staticmethod
+    def _float(text):
+        try:
+            return float(text)
+        except:
+            return 0.0
+    
+    @classmethod
+    def probe(cls, path):
+        """返回 {width, height, fps, frames, duration, rotation, keyframes, codec}；失败返回 None
+        
+        width/height 为旋转后的显示尺寸（FFmpeg 解码默认自动旋转）。
+        帧数优先使用数据包计数，容器未写 nb_frames 或写错时也准确。
+        """
+        try:
+            st = os.stat(path)
+            key = (os.path.abspath(path), st.st_size, int(st.st_mtime))
+        except:
+            return None
+        
+        with cls._lock:
+            if key in cls._cache:
+                return cls._cache[key]
+        
+        info = cls._probe(path)
+        with cls._lock:
+            cls._cache[key] = info
+        return info
+    
+    @classmethod
+    def _probe(cls, path):
+        try:
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            cmd = [cls._get_ffprobe(), '-v', 'error', '-select_streams', 'v:0',
+                   '-show_entries',
+                   'stream=codec_name,width,height,r_frame_rate,avg_frame_rate,nb_frames,duration'
+                   ':stream_tags=rotate:stream_side_data=rotation'
+                   ':format=duration:packet=pts_time,flags',
+                   '-of', 'json', path]
+            result = subprocess.run(cmd, capture_output=True, startupinfo=si, timeout=120,
+                                    text=True, encoding='utf-8', errors='ignore')
+            if result.returncode != 0:
+                return None
+            
+            data = json.loads(result.stdout)
+            streams = data.get("streams", [])
+            if not streams:
+                return None
+            stream = streams[0]
+            
+            width, height = int(stream.get("width", 0)), int(stream.get("height", 0))
+            if width <= 0 or height <= 0:
+                return None
+            
+            fps = cls._rate(stream.get("avg_frame_rate")) or cls._rate(stream.get("r_frame_rate")) or 25.0
+            duration = cls._float(stream.get("duration")) or cls._float(data.get("format", {}).get("duration"))
+            
+            rotation = cls._float(stream.get("tags", {}).get("rotate"))
+            for side in stream.get("side_data_list", []):
+                if "rotation" in side:
+                    rotation = cls._float(side["rotation"])
+            rotation = int(round(rotation)) % 360
+            if rotation in (90, 270):
+                width, height = height, width
+            
+            packets = [p for p in data.get("packets", []) if p.get("pts_time") not in (None, "N/A")]
+            frames = len(packets) or int(cls._float(stream.get("nb_frames"))) or int(round(duration * fps))
+            
+            keyframes = []
+            if packets:
+                t0 = min(float(p["pts_time"]) for p in packets)
+                keyframes = sorted({int(round((float(p["pts_time"]) - t0) * fps))
+                                    for p in packets if 'K' in p.get("flags", "")})
+            
+            return {"width": width, "height": height, "fps": fps, "frames": frames,
+                    "duration": duration or frames / fps, "rotation": rotation,
+                    "keyframes": keyframes, "codec": stream.get("codec_name", "")}
+        except:
+            return None
+    
+    @classmethod
+    def audio_codec(cls, path):
+        """返回首条音轨的编码名；无音轨返回 ""，ffprobe 不可用返回 None。只读文件头"""
+        try:
+            st = os.stat(path)
+            key = ("audio", os.path.abspath(path), st.st_size, int(st.st_mtime))
+        except:
+            return None
+        
+        with cls._lock:
+            if key in cls._cache:
+                return cls._cache[key]
+        
+        codec = None
+        try:
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            cmd = [cls._get_ffprobe(), '-v', 'error', '-select_streams', 'a:0',
+                   '-show_entries', 'stream=codec_name', '-of', 'json', path]
+            result = subprocess.run(cmd, capture_output=True, startupinfo=si, timeout=30,
+                                    text=True, encoding='utf-8', errors='ignore')
+            if result.returncode == 0:
+                streams = json.loads(result.stdout).get("streams", [])
+                codec = streams[0].get("codec_name", "") if streams else ""
+        except:
+            codec = None
+        
+        with cls._lock:
+            cls._cache[key] = codec
+        return codec
+    
+    @classmethod
+    def keyframes(cls, path):
+        """返回视频关键帧的帧序号（升序）。只读取包头，不解码；失败时返回空列表"""
+        info = cls.probe(path)
+        return info["keyframes"] if info else []
+
+
+class FFmpegFrameReader:
+    """FFmpeg rawvideo 管道解码器 - 与 cv2.VideoCapture 相同的 read/set/get/release 接口
+    
+    帧数、帧率来自 MediaProbe，不依赖 CAP_PROP_FRAME_COUNT 的估算值；
+    定位用输入端 -ss：从前一个关键帧开始解码并丢弃到目标帧，既快又精确到帧。
+    pix_fmt 为 "yuv420p" 时输出 I420 布局的 (h*3/2, w) 平面帧（Y 在前，U、V 各占 h/4 行），不经 BGR 转换。
+    """
+    
+    FRAME_SHAPES = {"bgr24": lambda w, h: (h, w, 3), "yuv420p": lambda w, h: (h * 3 // 2, w)}
+    
+    def __init__(self, path, info, pix_fmt="bgr24"):
+        self.path = path
+        self.info = info
+        self.pix_fmt = pix_fmt
+        self.width, self.height = info["width"], info["height"]
+        self.frame_shape = self.FRAME_SHAPES[pix_fmt](self.width, self.height)
+        self.frame_bytes = int(np.prod(self.frame_shape))
+        self.proc = None
+        self.position = 0
+        self._open(0)
+    
+    @classmethod
+    def open(cls, path, info=None, pix_fmt="bgr24"):
+        """ffprobe 可用时返回管道解码器，否则返回 None 由调用方回退到 cv2.VideoCapture"""
+        info = info or MediaProbe.probe(path)
+        if not info:
+            return None
+        reader = cls(path, info, pix_fmt)
+        return reader if reader.isOpened() else None
+    
+    @classmethod
+    def grab(cls, path, index, info=None):
+        """单独启动一次快速定位，只解码第 index 帧（用于抽样分析，不影响主解码流）"""
+        info = info or MediaProbe.probe(path)
+        if not info:
+            return None
+        reader = cls(path, info)
+        try:
+            reader.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ret, frame = reader.read()
+            return frame if ret else None
+        finally:
+            reader.release()
+    
+    def _open(self, index):
+        self._kill()
+        cmd = [AudioHandler._get_ffmpeg(), '-v', 'error', '-nostdin']
+        if index > 0:
+            # 回退半帧，避免时间戳舍入把目标帧本身跳过
+            cmd += ['-ss', f"{max(0.0, (index - 0.5) / self.info['fps']):.6f}"]
+        cmd += ['-i', self.path, '-map', '0:v:0', '-an', '-sn', '-vsync', 'passthrough',
+                '-f', 'rawvideo', '-pix_fmt', self.pix_fmt, 'pipe:1']
+        try:
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            self.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                         stderr=subprocess.DEVNULL, startupinfo=si,
+                                         bufsize=self.frame_bytes)
+            self.position = index
+        except:
+            self.proc = None
+    
+    def _kill(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.kill()
+            self.proc.stdout.close()
+            self.proc.wait(timeout=5)
+        except:
+            pass
+        self.proc = None
+    
+    def isOpened(self):
+        return self.proc is not None
+    
+    def read(self, image=None):
+        """读取下一帧；image 为同尺寸的连续 uint8 数组时直接解码到其中（与 cv2 的 read(image) 一致）"""
+        if self.proc is None:
+            return False, None
+        if (image is None or image.shape != self.frame_shape or image.dtype != np.uint8
+                or not image.flags.c_contiguous):
+            image = np.empty(self.frame_shape, np.uint8)
+        view, got = memoryview(image.reshape(-1)), 0
+        while got < self.frame_bytes:
+            n = self.proc.stdout.readinto(view[got:])
+            if not n:
+                return False, None
+            got += n
+        self.position += 1
+        return True, image
+    
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self._open(max(0, int(value)))
+            return self.proc is not None
+        return False
+    
+    def get(self, prop):
+        return {
+            cv2.CAP_PROP_FPS: self.info["fps"],
+            cv2.CAP_PROP_FRAME_COUNT: self.info["frames"],
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_POS_FRAMES: self.position,
+        }.get(prop, 0)
+    
+    def release(self):
+        self._kill()
+
+
+# ==================== 12.6 断点续传 ====================
+class TaskCheckpoint:
+    """任务断点 - 持久化的任务工作目录 + manifest.json
+    
+    工作目录按输入文件路径和配置哈希确定：程序崩溃后以相同配置重新添加同一文件也能找回进度，
+    同一文件以不同配置排队的多个任务各用各的目录，互不清空。
+    manifest 记录配置哈希、源文件签名、已提交的帧数和已编码完成的分块。
+    """
+    
+    MANIFEST = "manifest.json"
+    
+    def __init__(self, task):
+        self.config_hash = task.get_config_hash()
+        raw = f"{os.path.abspath(task.input_path)}|{self.config_hash}"
+        key = hashlib.md5(raw.encode('utf-8')).hexdigest()[:16]
+        self.work_dir = os.path.join(PM.temp_dir, "tasks", key)
+        self.manifest_path = os.path.join(self.work_dir, self.MANIFEST)
+        self.source = self._source_signature(task.input_path)
+        self.data = self._fresh()
+    
+    @staticmethod
+    def _source_signature(path):
+        try:
+            st = os.stat(path)
+            return f"{st.st_size}-{int(st.st_mtime)}"
+        except:
+            return ""
+    
+    def _fresh(self):
+        return {"config_hash": self.config_hash, "source": self.source,
+                "committed_frame": 0, "chunks": [], "segments": None, "segments_done": {}}
+    
+    @staticmethod
+    def has_progress(task):
+        """是否存在可续传的进度（供界面判断）"""
+        try:
+            cp = TaskCheckpoint(task)
+            with open(cp.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return (data.get("config_hash") == cp.config_hash and data.get("source") == cp.source
+                    and (data.get("committed_frame", 0) > 0 or data.get("segments_done")))
+        except:
+            return False
+    
+    def load(self):
+        """读取断点，返回可续传的起始帧；配置或源文件已变化时清空重来"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            chunks_ok = all(os.path.isfile(os.path.join(self.work_dir, c)) for c in data.get("chunks", []))
+            if data.get("config_hash") == self.config_hash and data.get("source") == self.source and chunks_ok:
+                self.data = data
+                return data.get("committed_frame", 0)
+        except:
+            pass
+        self.reset()
+        return 0
+    
+    def reset(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.data = self._fresh()
+        self.save()
+    
+    def save(self):
+        """原子写入 manifest，避免中途崩溃留下半个文件"""
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+    
+    def clear(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+    
+    def next_chunk_path(self):
+        return os.path.join(self.work_dir, f"chunk_{len(self.data['chunks']):04d}.mp4")
+    
+    def chunk_paths(self):
+        return [os.path.join(self.work_dir, c) for c in self.data["chunks"]]
+    
+    def commit_chunk(self, path, frames):
+        self.data["chunks"].append(os.path.basename(path))
+        self.data["committed_frame"] += frames
+        self.save()
+    
+    def commit_segment(self, index, frames):
+        self.data["segments_done"][str(index)] = frames
+        self.data["committed_frame"] = sum(self.data["segments_done"].values())
+        self.save()
+
+
+class ChunkedStreamWriter:
+    """分块流式编码 - 每 chunk_frames 帧结束一个分块并提交到断点，崩溃时最多损失一个分块"""
+    
+    def __init__(self, checkpoint, fps, chunk_frames, pix_fmt="bgr24"):
+        self.checkpoint = checkpoint
+        self.fps = fps
+        self.chunk_frames = max(1, chunk_frames)
+        self.pix_fmt = pix_fmt
+        self.size = None
+        self.writer = None
+        self.count = 0
+    
+    def open(self, width, height):
+        """启动第一个分块的编码进程，失败返回False"""
+        self.size = (width, height)
+        self.writer = FFmpegStreamWriter(self.checkpoint.next_chunk_path(), self.fps, pix_fmt=self.pix_fmt)
+        if not self.writer.start(width, height):
+            self.writer = None
+            return False
+        return True
+    
+    def write(self, frame):
+        if self.writer is None and not self.open(*(self.size or (frame.shape[1], frame.shape[0]))):
+            raise IOError("FFmpeg流式编码启动失败")
+        self.writer.write(frame)
+        self.count += 1
+        if self.count >= self.chunk_frames:
+            self.commit()
+    
+    def commit(self):
+        """结束当前分块并写入断点"""
+        if self.writer is None:
+            return
+        writer, count = self.writer, self.count
+        self.writer, self.count = None, 0
+        if count == 0:
+            writer.abort()
+            return
+        if not writer.close():
+            raise RuntimeError(f"分块编码失败: {writer.get_error()}")
+        self.checkpoint.commit_chunk(writer.output, count)
+    
+    def abort(self):
+        """丢弃未完成的分块，已提交的分块保留"""
+        if self.writer is not None:
+            self.writer.abort()
+        self.writer, self.count = None, 0
+
+
+# ==================== 12.7 重复帧跳过 ====================
+class FrameDeduplicator:
+    """重复帧跳过 - 下采样亮度指纹快速排除，再用全分辨率最大绝对差确认
+    
+    参照帧是一段重复开始时的输入帧而不是上一帧，缓慢渐变累积超过阈值后会重新处理。
+    重复段的前 HISTORY 帧仍正常处理，使时序稳定的参考帧全部落在段内，
+    此后的重复帧不再经过修复链，直接复用前一帧的输出结果，并按帧序插入输出流。
+    """
+    
+    FINGERPRINT_SIZE = (64, 36)     # 指纹分辨率 (宽, 高)
+    FINGERPRINT_DIFF = 2            # 指纹最大差值，超过即判为不同帧
+    PIXEL_DIFF = 6                  # 全分辨率最大绝对差容差
+    HISTORY = ProfessionalRestorer.TEMPORAL_HISTORY
+    
+    def __init__(self, emit_fn, start_index=0):
+        self.emit_fn = emit_fn          # emit_fn(index, result)，严格按帧序调用
+        self.skipped = 0
+        self._ref_frame = None
+        self._ref_print = None
+        self._run = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._next_index = start_index
+        self._last_result = None
+        self._pool_next = start_index
+        self._pool_sources = {}
+    
+    def is_duplicate(self, frame):
+        """与参照帧比较，返回该帧是否可以跳过处理；不重复时该帧成为新的参照帧"""
+        # yuv420p 平面帧（I420 布局）直接取 Y 平面
+        gray = frame[:frame.shape[0] * 2 // 3] if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        fingerprint = cv2.resize(gray, self.FINGERPRINT_SIZE, interpolation=cv2.INTER_AREA)
+        
+        ref = self._ref_frame
+        if (ref is not None and ref.shape == frame.shape
+                and cv2.norm(fingerprint, self._ref_print, cv2.NORM_INF) <= self.FINGERPRINT_DIFF
+                and cv2.norm(frame, ref, cv2.NORM_INF) <= self.PIXEL_DIFF):
+            self._run += 1
+            if self._run > self.HISTORY:
+                self.skipped += 1
+                return True
+            return False
+        
+        self._ref_frame, self._ref_print = frame, fingerprint
+        self._run = 0
+        return False
+    
+    def emit(self, index, result):
+        """按帧序输出；result 为 None 表示复用前一帧的结果"""
+        with self._lock:
+            self._pending[index] = result
+            while self._next_index in self._pending:
+                result = self._pending.pop(self._next_index)
+                if result is None:
+                    result = self._last_result
+                self.emit_fn(self._next_index, result)
+                self._last_result = result
+                self._next_index += 1
+    
+    def pool_index(self, index):
+        """帧池要求连续的帧序号：为非重复帧分配池内序号，并记住对应的源帧序号"""
+        pool_index = self._pool_next
+        self._pool_sources[pool_index] = index
+        self._pool_next += 1
+        return pool_index
+    
+    def pool_emit(self, pool_index, result):
+        self.emit(self._pool_sources.pop(pool_index), result)
+
+
+# ==================== 12.8 脏区域处理 ====================
+class DirtyRegionTracker:
+    """脏区域处理 - 按图块网格比较与参照帧的差异，只重新处理变化的区域
+    
+    每个变化区域按启用步骤的感受野半径之和向外扩展 halo 后裁剪处理，只取回中心部分，
+    未变化的图块直接沿用上一帧的输出。图块及其 halo 邻域连续静止超过 TEMPORAL_HISTORY
+    帧后才沿用，保证感受野内的输入和时序稳定的参考帧都与上一帧输出时一致。
+    """
+    
+    TILE = 64                       # 图块边长，须为16的倍数（与 step1 的去块网格对齐）
+    PIXEL_DIFF = 4                  # 图块内最大绝对差容差
+    FULL_FRAME_RATIO = 0.5          # 需处理的图块超过此比例时整帧处理
+    HISTORY = ProfessionalRestorer.TEMPORAL_HISTORY
+    
+    # 各步骤的感受野半径（像素）
+    KERNEL_RADIUS = {
+        "temporal": 4,              # temporal_stabilize: GaussianBlur 9x9
+        "detail_deblock": 13,       # step1: Canny+膨胀、blur 9x9+GaussianBlur 11x11、GaussianBlur 15x15
+        "detail_presharpen": 8,     # step2: GaussianBlur sigma=2
+        "detail_aa": 4,             # step3: Sobel + 5抽头插值 + GaussianBlur 3x3
+        "detail_denoise": 6,        # step4: bilateral d=9、blur 7x7+GaussianBlur 5x5
+        "detail_final_sharp": 5,    # step7: GaussianBlur sigma=1 + Sobel
+        "opt_denoise": 13,          # fastNlMeans: 搜索窗21 + 模板7
+        "opt_sharp": 20,            # 锐化掩码 GaussianBlur sigma=5
+        "opt_anime_enhance": 4,     # bilateral d=9
+        "detail_grain": 20,         # step8: 颗粒掩码 GaussianBlur sigma=5
+        "opt_dehaze": 7,            # 透射率腐蚀 15x15（大气光为整帧统计量）
+        "opt_grain": 20,            # 颗粒掩码 GaussianBlur sigma=5
+    }
+    
+    # 依赖整帧统计、人脸位置或逐帧随机噪声的步骤，裁剪处理会改变结果
+    GLOBAL_STAGES = {
+        "detail_face": "人脸修复", "detail_hair": "毛发保护", "detail_grain": "加颗粒",
+        "opt_auto_wb": "自动白平衡", "opt_auto_levels": "自动色阶", "opt_dehaze": "去雾",
+        "opt_grain": "胶片颗粒",
+    }
+    
+    ADVANCED_KEYS = {"opt_auto_wb", "opt_auto_levels", "opt_shadow", "opt_highlight_rec",
+                     "opt_denoise", "opt_dehaze"}
+    
+    def __init__(self, cfg):
+        halo = sum(r for key, r in self.KERNEL_RADIUS.items() if key == "temporal" or self._enabled(cfg, key))
+        if cfg.get("luma_detail") and self._enabled(cfg, "detail_denoise"):
+            halo += ProcessingPlan.LUMA_CHROMA_RADIUS
+        self.halo = -(-halo // 16) * 16
+        self.tiles_total = 0
+        self.tiles_processed = 0
+        self._ref = None
+        self._counts = None
+        self._last = None
+    
+    @classmethod
+    def _enabled(cls, cfg, key):
+        if key.startswith("detail_"):
+            return bool(cfg.get("use_detail_restore") and cfg.get(key))
+        if key in cls.ADVANCED_KEYS:
+            return bool(cfg.get("use_advanced") and cfg.get(key))
+        return bool(cfg.get(key))
+    
+    @classmethod
+    def unsupported(cls, cfg):
+        """返回与脏区域处理不兼容的已启用步骤名称列表"""
+        return [name for key, name in cls.GLOBAL_STAGES.items() if cls._enabled(cfg, key)]
+    
+    def plan(self, frame):
+        """返回需处理的区域 [(y0, y1, x0, x1)]；None 表示整帧处理，[] 表示整帧沿用上一帧输出"""
+        h, w = frame.shape[:2]
+        t = self.TILE
+        gh, gw = -(-h // t), -(-w // t)
+        self.tiles_total += gh * gw
+        
+        if self._ref is None or self._ref.shape != frame.shape:
+            self._ref = frame.copy()
+            self._counts = np.zeros((gh, gw), np.int32)
+            self.tiles_processed += gh * gw
+            return None
+        
+        diff = np.zeros((gh * t, gw * t), np.uint8)
+        diff[:h, :w] = cv2.absdiff(frame, self._ref).max(axis=2)
+        changed = diff.reshape(gh, t, gw, t).max(axis=(1, 3)) > self.PIXEL_DIFF
+        
+        self._counts += 1
+        self._counts[changed] = 0
+        if changed.any():
+            mask = np.repeat(np.repeat(changed, t, axis=0), t, axis=1)[:h, :w]
+            np.copyto(self._ref, frame, where=mask[:, :, None])
+        
+        # 图块的输出依赖 halo 范围内的邻域，邻近图块变化时同样需要重新处理
+        dirty = (self._counts <= self.HISTORY).astype(np.uint8)
+        r = -(-self.halo // t)
+        dirty = cv2.dilate(dirty, np.ones((2 * r + 1, 2 * r + 1), np.uint8)) > 0
+        count = int(dirty.sum())
+        if count > dirty.size * self.FULL_FRAME_RATIO:
+            self.tiles_processed += gh * gw
+            return None
+        self.tiles_processed += count
+        
+        rects = []
+        n, _, stats, _ = cv2.connectedComponentsWithStats(dirty.astype(np.uint8), connectivity=8)
+        for x, y, bw, bh, _ in stats[1:n]:
+            rects.append((y * t, min(h, (y + bh) * t), x * t, min(w, (x + bw) * t)))
+        return rects
+    
+    def crop(self, frame, rect):
+        """按区域加 halo 裁剪，返回 (裁剪窗口, 中心在窗口内的切片)"""
+        return TileExecutor.window(frame.shape, rect, self.halo)
+    
+    def compose(self, result):
+        """按帧序调用：result 为整帧结果或 [(rect, 区域结果)]，与上一帧输出合成整帧"""
+        if isinstance(result, np.ndarray):
+            self._last = result
+            return result
+        
+        out = self._last.copy()
+        for (y0, y1, x0, x1), patch in result:
+            out[y0:y1, x0:x1] = patch
+        self._last = out
+        return out
+    
+    def report(self):
+        ratio = self.tiles_processed / self.tiles_total * 100 if self.tiles_total else 0
+        return f"🧩 脏区域: 处理 {self.tiles_processed}/{self.tiles_total} 个图块 ({ratio:.1f}%), halo {self.halo}px"
+
+
+# ==================== 12.9 分块执行 ====================
+class TileExecutor:
+    """分块执行器 - 大分辨率帧按图块（含 halo）逐块执行局部步骤，只取回图块中心拼成整帧
+    
+    4K/8K 帧的各步骤会分配多份整帧大小的 float 临时数组，分块后临时数组只有图块大小，
+    可留在缓存中。halo 取该段步骤的感受野半径之和（见 DirtyRegionTracker.KERNEL_RADIUS），
+    图块边缘受裁剪影响的像素都落在 halo 内被丢弃。
+    """
+    
+    TILE = 512                      # 图块边长，须为16的倍数（与 step1 的去块网格对齐）
+    MIN_PIXELS = 2560 * 1440        # 超过此像素数的帧才分块执行
+    
+    def __init__(self, workers=1, tile=None):
+        self.workers = max(1, workers)
+        self.tile = tile or self.TILE
+        self._executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+    
+    @classmethod
+    def wants(cls, frame):
+        return frame.shape[0] * frame.shape[1] >= cls.MIN_PIXELS
+    
+    @staticmethod
+    def window(shape, rect, halo):
+        """按区域加 halo 裁剪，返回 (裁剪窗口, 中心在窗口内的切片)"""
+        h, w = shape[:2]
+        y0, y1, x0, x1 = rect
+        cy0, cy1 = max(0, y0 - halo), min(h, y1 + halo)
+        cx0, cx1 = max(0, x0 - halo), min(w, x1 + halo)
+        return (cy0, cy1, cx0, cx1), (slice(y0 - cy0, y1 - cy0), slice(x0 - cx0, x1 - cx0))
+    
+    def map(self, fn, img, halo):
+        """对每个图块调用 fn(图块, 裁剪窗口 (y0, y1, x0, x1))，将结果中心拼回整帧"""
+        h, w = img.shape[:2]
+        t = self.tile
+        halo = -(-halo // 16) * 16
+        out = np.empty_like(img)
+        
+        def run(rect):
+            (cy0, cy1, cx0, cx1), center = self.window(img.shape, rect, halo)
+            result = fn(img[cy0:cy1, cx0:cx1], (cy0, cy1, cx0, cx1))
+            y0, y1, x0, x1 = rect
+            out[y0:y1, x0:x1] = result[center]
+        
+        rects = [(y, min(h, y + t), x, min(w, x + t)) for y in range(0, h, t) for x in range(0, w, t)]
+        if self._executor:
+            list(self._executor.map(run, rects))
+        else:
+            for rect in rects:
+                run(rect)
+        return out
+    
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+# ==================== 12.10 执行计划 ====================
+@dataclass(frozen=True)
+class PlanStage:
+    """执行计划中的一步：fn(img, ctx) 返回处理结果，不修改输入"""
+    key: str
+    label: str
+    group: str                  # restore / basic / post，流水线模式按组划分阶段
+    fn: Any
+    radius: int = 0             # 感受野半径，分块处理的 halo
+    full_frame: bool = False    # 依赖整帧（人脸检测），分块执行时在拼好的整帧上执行
+    stat: Any = None            # 整帧统计量 stat(img)，分块执行时预先计算，经 ctx["stats"] 注入
+    point: str = None           # 逐像素运算："channel" 各通道独立，"color" 依赖整个 BGR 颜色
+    ops: Any = None             # 浮点工作平面版本 ((色彩空间, fn(平面, 整帧统计量)), ...)，相邻步骤合并转换
+    planar: Any = None          # yuv420p 版本 planar(I420 帧, ctx)，平面直通模式下不经 BGR 转换
+    table: Any = None           # 合并后的颜色查找表，多进程模式经共享内存传给工作进程
+
+
+class ProcessingPlan:
+    """执行计划 - 任务开始时把配置编译成按顺序排列、参数已绑定的步骤列表
+    
+    开关、强度参数和智能模式的跳过建议都在编译时确定，逐帧只按顺序调用各步骤；
+    未开启的步骤不进入计划。各步骤都返回新数组，不再逐组拷贝输入。
+    """
+    
+    GROUP_NAMES = {"restore": "修复", "basic": "后期", "post": "高级/滤镜"}
+    PRECISION = {False: np.float32, True: np.float64}   # float64_precision 开关 → 修复/去雾的浮点精度（开启时单步也走浮点色彩链）
+    COLOR_CHUNK = 16                # 构建颜色查找表时每批处理的蓝色取值数（每批 16×65536 像素）
+    SPACE_CODES = {("bgr", "lab"): cv2.COLOR_BGR2LAB, ("lab", "bgr"): cv2.COLOR_LAB2BGR,
+                   ("bgr", "hsv"): cv2.COLOR_BGR2HSV, ("hsv", "bgr"): cv2.COLOR_HSV2BGR}
+    # luma_detail 开关下只在 Y 平面上执行的修复步骤；值为是否对色度做半分辨率平滑（降噪）
+    LUMA_STAGES = {"detail_deblock": False, "detail_aa": False, "detail_denoise": True,
+                   "detail_aa+detail_denoise": True, "detail_final_sharp": False}
+    LUMA_CHROMA_RADIUS = 4          # 色度半分辨率平滑（INTER_AREA 缩小 + 3x3 高斯 + 线性放大）的感受野
+    
+    def __init__(self, stages):
+        self.stages = tuple(stages)
+        self.plane_counts = {"hit": 0, "miss": 0}     # 各帧 FramePlanes 共享的复用/计算次数
+    
+    @classmethod
+    def compile(cls, cfg, metrics=None, smart_mode=False, parallel=None, tables=None):
+        """按任务配置（TaskItem.get_config()）和采样帧指标编译执行计划
+        
+        tables 为已建好的颜色查找表 {合并步骤键: 表}（见 color_tables），给出时直接复用。
+        """
+        PR, IP = ProfessionalRestorer, ImageProcessor
+        radius = DirtyRegionTracker.KERNEL_RADIUS
+        parallel = parallel or ParallelProcessor(2)
+        smart = bool(smart_mode and metrics)
+        ft = cls.PRECISION[bool(cfg.get("float64_precision"))]
+        stages = []
+        
+        def add(key, label, group, fn, **kwargs):
+            kwargs.setdefault("radius", radius.get(key, 0))
+            stages.append(PlanStage(key, label, group, fn, **kwargs))
+        
+        add("temporal", "时序稳定", "restore", lambda img, ctx: PR.temporal_stabilize(img, ctx["history"]),
+            planar=lambda frame, ctx: PR.temporal_stabilize_i420(frame, ctx["history"]))
+        
+        if cfg.get("use_detail_restore"):
+            di = cfg.get("detail_intensity", "medium")
+            if cfg.get("detail_deblock"):
+                add("detail_deblock", f"去块/去色带 ({di})", "restore",
+                    lambda img, ctx: PR.step1_artifact_removal(img, di, ctx["stats"].get("detail_deblock"), ctx["planes"], ft),
+                    stat=PR.deblock_edges)
+            if cfg.get("detail_presharpen"):
+                add("detail_presharpen", f"预锐化+回调 ({di})", "restore",
+                    lambda img, ctx: PR.step2_presharpen_with_rollback(img, di, metrics),
+                    ops=PR.presharpen_ops(di, metrics))
+            aa, dn = bool(cfg.get("detail_aa")), bool(cfg.get("detail_denoise"))
+            if aa or dn:
+                # 反锯齿的"掩码总和"门限按面积折算，裁剪区域与整帧按相同的锯齿密度判定
+                key = "+".join(k for k, on in (("detail_aa", aa), ("detail_denoise", dn)) if on)
+                label = {"detail_aa": "反锯齿", "detail_denoise": "降噪", 
+                         "detail_aa+detail_denoise": "反锯齿 ∥ 降噪 (按边缘融合)"}[key]
+                add(key, f"{label} ({di})", "restore",
+                    lambda img, ctx: parallel.antialias_denoise(img, di, metrics, aa, dn, 100 * ctx["area_scale"],
+                                                               ctx["planes"], ft),
+                    radius=radius["detail_aa"] * aa + radius["detail_denoise"] * dn)
+            if cfg.get("detail_face"):
+                add("detail_face", f"人脸修复 ({di})", "restore",
+                    lambda img, ctx: PR.step5_face_repair(img, di, ctx["planes"], ft), full_frame=True)
+            if cfg.get("detail_hair"):
+                add("detail_hair", f"毛发保护 ({di})", "restore",
+                    lambda img, ctx: PR.step6_hair_protect(img, ctx["original"], di, ctx["planes"]), full_frame=True)
+            # 已开启滤镜锐化，或源素材已足够清晰时跳过最终锐化
+            if (cfg.get("detail_final_sharp") and not cfg.get("opt_sharp")
+                    and not (metrics and metrics.get("sharpness", 300) > 600)):
+                add("detail_final_sharp", f"最终锐化 ({di})", "restore",
+                    lambda img, ctx: PR.step7_final_sharpen(img, di, metrics, ctx["planes"], ft))
+            if cfg.get("detail_grain"):
+                add("detail_grain", f"加颗粒 ({di})", "restore", lambda img, ctx: PR.step8_add_grain(img, di, ctx["planes"]))
+        
+        if cfg.get("use_basic"):
+            p = IP.INTENSITY.get(cfg.get("basic_intensity", "medium"), IP.INTENSITY["medium"])
+            if cfg.get("opt_bright") and (not smart or metrics.get("brightness", 128) < 160):
+                add("opt_bright", f"亮度 +{p['bright']}", "basic",
+                    lambda img, ctx, beta=p["bright"]: IP.brighten(img, beta), point="channel")
+            if cfg.get("opt_contrast") and (not smart or metrics.get("contrast", 50) < 70):
+                add("opt_contrast", f"对比度 ×{p['contrast']}", "basic",
+                    lambda img, ctx, alpha=p["contrast"]: IP.contrast(img, alpha), point="channel")
+            if cfg.get("opt_sat") and (not smart or metrics.get("saturation", 100) < 150):
+                add("opt_sat", f"饱和度 ×{p['sat']}", "basic",
+                    lambda img, ctx, factor=p["sat"]: IP.saturate(img, factor), point="color")
+            if cfg.get("opt_temp"):
+                add("opt_temp", "色温偏暖", "basic", lambda img, ctx: IP.warm(img), point="channel")
+            if cfg.get("opt_highlight"):
+                add("opt_highlight", "高光提亮", "basic", lambda img, ctx: IP.highlight(img), point="color")
+        
+        if cfg.get("use_advanced"):
+            p = IP.INTENSITY.get(cfg.get("adv_intensity", "medium"), IP.INTENSITY["medium"])
+            recommendations = ImageAnalyzer.get_recommendations(metrics) if smart else {}
+            advanced = {
+                "opt_auto_wb": ("自动白平衡", IP.auto_wb, None),
+                "opt_auto_levels": ("自动色阶", IP.auto_levels, None),
+                "opt_shadow": ("阴影提亮", lambda img, stat: IP.lift_shadows(img), "color"),
+                "opt_highlight_rec": ("高光恢复", lambda img, stat: IP.recover_highlights(img), "color"),
+                "opt_denoise": (f"NL降噪 h={p.get('denoise', 5)}",
+                                lambda img, stat, h=p.get("denoise", 5): IP.nl_denoise(img, h), None),
+                "opt_dehaze": ("去雾", lambda img, stat: IP._dehaze(img, A=stat, dtype=ft), None),
+            }
+            for key in IP.ADVANCED_STEPS:
+                if not cfg.get(key) or recommendations.get(key, {}).get("skip"):
+                    continue
+                label, op, point = advanced[key]
+                add(key, label, "post", lambda img, ctx, key=key, op=op: op(img, ctx["stats"].get(key)),
+                    stat=(lambda img, key=key: IP.advanced_stat(key, img)) if key in IP.GLOBAL_STATS else None,
+                    point=point, ops=IP.space_ops(key))
+        
+        p = IP.INTENSITY.get(cfg.get("basic_intensity", "medium"), IP.INTENSITY["medium"])
+        if cfg.get("opt_sharp"):
+            add("opt_sharp", f"锐化 {p['sharp']}", "post", lambda img, ctx, amount=p["sharp"]: IP.sharpen(img, amount, ctx["planes"]))
+        if cfg.get("opt_landscape"):
+            add("opt_landscape", "风景", "post", lambda img, ctx: IP.landscape(img), point="color",
+                ops=IP.space_ops("opt_landscape"))
+        if cfg.get("opt_vintage"):
+            add("opt_vintage", "老电影", "post", lambda img, ctx: IP.vintage(img), point="color",
+                ops=IP.space_ops("opt_vintage"))
+        if cfg.get("opt_cinematic"):
+            add("opt_cinematic", "电影感", "post", lambda img, ctx: IP.cinematic(img), point="color",
+                ops=IP.space_ops("opt_cinematic"))
+        if cfg.get("opt_anime_enhance"):
+            add("opt_anime_enhance", "动漫增强", "post", lambda img, ctx: IP.anime_enhance(img),
+                ops=IP.space_ops("opt_anime_enhance"))
+        if cfg.get("opt_grain"):
+            add("opt_grain", f"胶片颗粒 σ={p['grain']}", "post",
+                lambda img, ctx, sigma=p["grain"]: IP.film_grain(img, sigma, ctx["planes"]))
+        
+        if cfg.get("luma_detail"):
+            stages = cls._on_luma(stages)
+        return cls(cls._fuse_color_spaces(cls._fuse_point_ops(stages, tables or {}), ft is np.float64))
+    
+    @classmethod
+    def _fuse_point_ops(cls, stages, tables=None):
+        """把同一组内连续的逐像素运算合并为一次查表
+        
+        全部为逐通道运算时合并为 cv2.LUT；含颜色相关运算（HSV/LAB 转换、通道混合）时，
+        在全部 2^24 种 8 位颜色上执行一遍原步骤得到完整颜色表，逐帧只做一次查表，
+        结果与原步骤逐一执行完全一致。tables 中已有同键的颜色表时直接复用。
+        """
+        fused, run = [], []
+        
+        def flush():
+            if len(run) >= 2:
+                key = "+".join(stage.key for stage in run)
+                color = any(stage.point == "color" for stage in run)
+                if color:
+                    table = tables.get(key) if tables else None
+                    if table is None:
+                        table = cls._color_table(run)
+                else:
+                    table = cls._channel_table(run)
+                apply = cls._lookup_color if color else cv2.LUT
+                label = " → ".join(stage.label for stage in run)
+                fused.append(PlanStage(key, f"{'颜色查找表' if color else '通道查找表'}: {label}", run[0].group,
+                                       lambda img, ctx, table=table: apply(img, table),
+                                       point="color" if color else "channel", table=table))
+            else:
+                fused.extend(run)
+            run.clear()
+        
+        for stage in stages:
+            if not stage.point or (run and run[0].group != stage.group):
+                flush()
+            if stage.point:
+                run.append(stage)
+            else:
+                fused.append(stage)
+        flush()
+        return fused
+    
+    @staticmethod
+    def _channel_table(stages):
+        """在 0-255 的灰阶上执行逐通道运算，得到 cv2.LUT 查找表（三通道相同时为单通道表）"""
+        table = np.repeat(np.arange(256, dtype=np.uint8)[None, :, None], 3, axis=2)
+        for stage in stages:
+            table = stage.fn(table, ProcessingPlan.context(table))
+        if (table == table[:, :, :1]).all():
+            return np.ascontiguousarray(table[:, :, 0])
+        return table
+    
+    @classmethod
+    def _color_table(cls, stages):
+        """在全部 2^24 种 BGR 颜色上执行运算，返回按 (b<<16)|(g<<8)|r 索引的 uint32 表（BGRA 打包）"""
+        table = np.zeros((1 << 24, 4), np.uint8)
+        gr = np.arange(1 << 16, dtype=np.uint32)
+        n = cls.COLOR_CHUNK
+        for b in range(0, 256, n):
+            block = np.empty((n, 1 << 16, 3), np.uint8)
+            block[:, :, 0] = np.arange(b, b + n, dtype=np.uint8)[:, None]
+            block[:, :, 1] = gr >> 8
+            block[:, :, 2] = gr & 255
+            for stage in stages:
+                block = stage.fn(block, cls.context(block))
+            table[b << 16:(b + n) << 16, :3] = block.reshape(-1, 3)
+        return table.view(np.uint32).ravel()
+    
+    @staticmethod
+    def _lookup_color(img, table):
+        idx = img[:, :, 0].astype(np.uint32) << 16
+        idx |= img[:, :, 1].astype(np.uint32) << 8
+        idx |= img[:, :, 2]
+        out = np.take(table, idx)
+        return cv2.cvtColor(out.view(np.uint8).reshape(img.shape[0], img.shape[1], 4), cv2.COLOR_BGRA2BGR)
+    
+    @classmethod
+    def _on_luma(cls, stages):
+        """亮度域模式：LUMA_STAGES 中的步骤改为只处理 YCrCb 的 Y 平面
+        
+        输出最终编码为 yuv420p，色度只有 1/4 分辨率：色度平面原样保留，降噪步骤在
+        半分辨率上对色度做一次轻度高斯平滑，代替全分辨率三通道的双边滤波。
+        整帧统计量（去块的边缘图）同样在 Y 平面上计算。
+        """
+        result = []
+        for stage in stages:
+            if stage.key not in cls.LUMA_STAGES:
+                result.append(stage)
+                continue
+            smooth = cls.LUMA_STAGES[stage.key]
+            result.append(replace(stage, label=f"{stage.label} [Y]",
+                                  fn=lambda img, ctx, fn=stage.fn, smooth=smooth: cls._run_luma(img, ctx, fn, smooth),
+                                  stat=(lambda img, stat=stage.stat: stat(cls._luma(img))) if stage.stat else None,
+                                  radius=stage.radius + cls.LUMA_CHROMA_RADIUS * smooth,
+                                  planar=lambda frame, ctx, fn=stage.fn, smooth=smooth:
+                                      cls._run_luma_i420(frame, ctx, fn, smooth)))
+        return result
+    
+    @staticmethod
+    def _luma(img):
+        return cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb)[:, :, 0]
+    
+    @staticmethod
+    def _run_luma(img, ctx, fn, smooth_chroma):
+        ycc = cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb)
+        y = fn(cv2.extractChannel(ycc, 0), ctx)
+        if smooth_chroma:
+            h, w = img.shape[:2]
+            half = cv2.resize(ycc[:, :, 1:], ((w + 1) // 2, (h + 1) // 2), interpolation=cv2.INTER_AREA)
+            half = cv2.GaussianBlur(half, (3, 3), 0.8)
+            ycc[:, :, 1:] = cv2.resize(half, (w, h), interpolation=cv2.INTER_LINEAR)
+        cv2.insertChannel(y, ycc, 0)
+        return cv2.cvtColor(ycc, cv2.COLOR_YCrCb2BGR)
+    
+    @staticmethod
+    def _run_luma_i420(frame, ctx, fn, smooth_chroma):
+        """_run_luma 的 yuv420p 版本：直接处理 Y 平面，色度本身已是半分辨率"""
+        h = frame.shape[0] * 2 // 3
+        out = frame.copy()
+        out[:h] = fn(frame[:h], ctx)
+        if smooth_chroma:
+            for plane in out[h:].reshape(2, h // 2, frame.shape[1] // 2):
+                cv2.GaussianBlur(plane, (3, 3), 0.8, dst=plane)
+        return out
+    
+    @classmethod
+    def _fuse_color_spaces(cls, stages, precise=False):
+        """把同一组内连续、带浮点版本（ops）的步骤合并为一段浮点色彩链
         
-        if should_apply('opt_auto_levels'):
-            for i in range(3):
-                ch = result[:,:,i]
-                lo, hi = np.percentile(ch, [1, 99])
-                if hi > lo:
-                    result[:,:,i] = np.clip((ch - lo) * 255.0 / (hi - lo), 0, 255).astype(np.uint8)
-        
-        if should_apply('opt_shadow'):
-            hsv = cv2.cvtColor(result, cv2.COLOR_BGR2HSV).astype(np.float32)
-            v = hsv[:,:,2]
-            mask = np.power(1 - v/255.0, 2)
-            hsv[:,:,2] = np.clip(v + 25 * mask, 0, 255)
-            result = cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
-        
-        if should_apply('opt_highlight_rec'):
-            hsv = cv2.cvtColor(result, cv2.COLOR_BGR2HSV).astype(np.float32)
-            v = hsv[:,:,2]
-            mask = np.power(v/255.0, 3)
-            hsv[:,:,2] = np.clip(v - 20 * mask, 0, 255)
-            result = cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
-        
-        if should_apply('opt_denoise'):
-            denoise_val = cfg.get("denoise", 5)
-            result = cv2.fastNlMeansDenoisingColored(result, None, denoise_val, denoise_val, 7, 21)
-        
-        if should_apply('opt_dehaze'):
-            result = ImageProcessor._dehaze(result)
+        进入时转换一次，相邻运算的色彩空间不同时才转换，工作平面全程保持 float32，
+        离开时只量化一次。能合并为查找表的逐像素运算已先行合并（查表更快）；
+        依赖整帧统计量的步骤只能作为段首，分块执行时统计量在段前的整帧上计算。
+        单个步骤的浮点 LAB 转换比 uint8 慢，只在高精度模式下为避免中间量化而单独转为浮点。
+        """
+        fused, run = [], []
         
-        return result
+        def flush():
+            if len(run) >= 2 or (precise and run and len(run[0].ops) >= 2):
+                fused.append(cls._color_run(run))
+            else:
+                fused.extend(run)
+            run.clear()
+        
+        for stage in stages:
+            if not stage.ops or stage.stat or (run and run[0].group != stage.group):
+                flush()
+            if stage.ops:
+                run.append(stage)
+            else:
+                fused.append(stage)
+        flush()
+        return fused
+    
+    @classmethod
+    def _color_run(cls, run):
+        head = run[0]
+        key = "+".join(stage.key for stage in run)
+        ops = tuple(op for stage in run for op in stage.ops)
+        
+        def fn(img, ctx):
+            stat = ctx["stats"].get(key)
+            if stat is None and head.stat:
+                stat = head.stat(img)
+            work, space = np.multiply(img, np.float32(1 / 255.0), dtype=np.float32), "bgr"
+            for target, op in ops:
+                work = cls._convert(work, space, target)
+                work, space = op(work, stat), target
+            return cv2.convertScaleAbs(cls._convert(work, space, "bgr"), alpha=255)
+        
+        return PlanStage(key, f"浮点色彩链: {' → '.join(stage.label for stage in run)}", head.group, fn,
+                         radius=sum(stage.radius for stage in run), stat=head.stat)
+    
+    @classmethod
+    def _convert(cls, work, src, dst):
+        """浮点工作平面在色彩空间之间转换（经 BGR 中转，超出色域的部分与 uint8 转换一样截断）"""
+        if src == dst:
+            return work
+        if src != "bgr":
+            work = cv2.cvtColor(work, cls.SPACE_CODES[src, "bgr"])
+            np.clip(work, 0, 1, out=work)
+        if dst != "bgr":
+            work = cv2.cvtColor(work, cls.SPACE_CODES["bgr", dst])
+        return work
     
     @staticmethod
-    def _dehaze(img, strength=0.85):
-        img_f = img.astype(np.float64) / 255.0
-        dark = np.min(img_f, axis=2)
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 15))
-        dark = cv2.erode(dark, kernel)
-        h, w = img.shape[:2]
-        flat = dark.flatten()
-        n = max(1, int(h*w*0.001))
-        idx = np.argsort(flat)[-n:]
-        A = np.mean(img_f.reshape(-1, 3)[idx], axis=0)
-        A = np.clip(A, 0.1, 1.0)
-        trans = 1 - strength * cv2.erode(np.min(img_f / np.maximum(A, 0.01), axis=2), kernel)
-        trans = np.clip(trans, 0.1, 1.0)
-        result = np.zeros_like(img_f)
-        for i in range(3):
-            result[:,:,i] = (img_f[:,:,i] - A[i]) / np.maximum(trans, 0.1) + A[i]
-        return np.clip(result * 255, 0, 255).astype(np.uint8)
+    def context(frame, history=(), counts=None):
+        """单帧的执行上下文：时序参考帧、原始帧、整帧统计量、相对整帧的面积比例、派生平面缓存"""
+        return {"history": history, "original": frame, "stats": {}, "area_scale": 1.0,
+                "planes": FramePlanes(frame, counts)}
     
     @staticmethod
-    def apply_filters(img, opts, intensity="medium"):
-        """应用滤镜效果"""
-        cfg = ImageProcessor.INTENSITY.get(intensity, ImageProcessor.INTENSITY["medium"])
-        result = img.copy()
+    def crop_context(ctx, window, area_scale):
+        """裁剪区域的执行上下文：参考帧、原始帧和逐像素的统计量（如边缘图）按窗口裁剪"""
+        y0, y1, x0, x1 = window
+        shape = ctx["original"].shape[:2]
+        
+        def crop(value):
+            if isinstance(value, np.ndarray) and value.shape[:2] == shape:
+                return value[y0:y1, x0:x1]
+            return value
+        
+        return {"history": [crop(prev) for prev in ctx["history"]],
+                "original": crop(ctx["original"]),
+                "stats": {key: crop(value) for key, value in ctx["stats"].items()},
+                "area_scale": ctx["area_scale"] * area_scale,
+                "planes": FramePlanes(None, ctx["planes"].counts)}
+    
+    def run(self, img, ctx=None, group=None):
+        """按顺序执行计划（group 不为 None 时只执行该组的步骤）"""
+        if ctx is None:
+            ctx = self.context(img, counts=self.plane_counts)
+        for stage in self.stages:
+            if group is None or stage.group == group:
+                img = stage.fn(img, ctx)
+        return img
+    
+    def run_planar(self, frame, ctx, run_bgr=None):
+        """在 yuv420p 帧（I420 布局 (h*3/2, w)）上执行计划
+        
+        带 planar 版本的步骤直接处理 Y/U/V 平面；其余连续的步骤成段转换为 BGR，由
+        run_bgr(img, stages, ctx) 执行（默认逐步执行）后再转换回 yuv420p。ctx 的 original 与
+        history 为 I420 帧，BGR 段使用按需转换一次的 BGR 原始帧。
+        """
+        pending, bgr_ctx = [], None
+        
+        def flush(frame):
+            nonlocal bgr_ctx
+            if not pending:
+                return frame
+            if bgr_ctx is None:
+                bgr_ctx = dict(ctx, original=cv2.cvtColor(ctx["original"], cv2.COLOR_YUV2BGR_I420),
+                               planes=FramePlanes(None, ctx["planes"].counts))
+            stages = tuple(pending)
+            pending.clear()
+            img = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
+            if run_bgr:
+                img = run_bgr(img, stages, bgr_ctx)
+            else:
+                for stage in stages:
+                    img = stage.fn(img, bgr_ctx)
+            return cv2.cvtColor(img, cv2.COLOR_BGR2YUV_I420)
         
-        if opts.get('opt_sharp'):
-            gray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
-            mask = cv2.threshold(gray, 25, 1, cv2.THRESH_BINARY)[1].astype(np.float32)
-            mask = cv2.GaussianBlur(mask, (0,0), 5)
-            mask3 = cv2.merge([mask, mask, mask])
-            
-            blur = cv2.GaussianBlur(result, (0,0), 2.0)
-            unsharp = cv2.addWeighted(result, 1 + cfg["sharp"], blur, -cfg["sharp"], 0)
-            result = np.clip(result * (1 - mask3) + unsharp * mask3, 0, 255).astype(np.uint8)
-        
-        if opts.get('opt_landscape'):
-            result = cv2.convertScaleAbs(result, alpha=1.1, beta=0)
-            hsv = cv2.cvtColor(result, cv2.COLOR_BGR2HSV).astype("float32")
-            hsv[:,:,1] = np.clip(hsv[:,:,1] * 1.2, 0, 255)
-            result = cv2.cvtColor(hsv.astype("uint8"), cv2.COLOR_HSV2BGR)
-            b, g, r = cv2.split(result)
-            b = cv2.add(b, 12)
-            result = cv2.merge((b, g, r))
-        
-        if opts.get('opt_vintage'):
-            img_f = result.astype(np.float32) / 255.0
-            b, g, r = cv2.split(img_f)
-            b = b + (1.0 - b) * 0.2 * (1.0 - r)
-            r = r + r * 0.2
-            result = (np.clip(cv2.merge((b, g, r)), 0, 1) * 255).astype(np.uint8)
-        
-        if opts.get('opt_cinematic'):
-            b, g, r = cv2.split(result.astype(np.float32))
-            gray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
-            b = b + (1 - gray) * 15 * 0.25
-            r = r + gray * 10 * 0.25
-            result = np.clip(cv2.merge((b, g, r)), 0, 255).astype(np.uint8)
-        
-        if opts.get('opt_anime_enhance'):
-            smoothed = cv2.bilateralFilter(result, 9, 75, 75)
-            hsv = cv2.cvtColor(smoothed, cv2.COLOR_BGR2HSV).astype(np.float32)
-            hsv[:,:,1] = np.clip(hsv[:,:,1] * 1.2, 0, 255)
-            result = cv2.cvtColor(hsv.astype(np.uint8), cv2.COLOR_HSV2BGR)
-        
-        if opts.get('opt_grain'):
-            gray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
-            mask = cv2.threshold(gray, 25, 1, cv2.THRESH_BINARY)[1].astype(np.float32)
-            mask = cv2.GaussianBlur(mask, (0,0), 5)
-            mask3 = cv2.merge([mask, mask, mask])
-            noise = np.random.normal(0, cfg["grain"], result.shape).astype(np.float32)
-            result = np.clip(result.astype(np.float32) + noise * mask3, 0, 255).astype(np.uint8)
+        for stage in self.stages:
+            if stage.planar:
+                frame = stage.planar(flush(frame), ctx)
+            else:
+                pending.append(stage)
+        return flush(frame)
+    
+    def planar_report(self, tiled=False):
+        """平面直通模式下的执行概况：直接处理平面的步骤数与需转换 BGR 的段数
         
-        return result
+        tiled 为大分辨率帧分块执行时：分块只作用于 BGR 段，直接处理平面的步骤按整帧执行。
+        """
+        planar = sum(1 for stage in self.stages if stage.planar)
+        runs = sum(1 for i, stage in enumerate(self.stages)
+                   if not stage.planar and (i == 0 or self.stages[i - 1].planar))
+        report = (f"🎞️ yuv420p 平面直通: {planar}/{len(self.stages)} 步直接处理 Y/U/V 平面"
+                  + (f"，其余 {runs} 段各转换一次 BGR" if runs else "，全程不经 BGR"))
+        if tiled and planar:
+            report += "（平面步骤不分块，按整帧执行" + ("；BGR 段仍分块）" if runs else "）")
+        return report
+    
+    def describe(self):
+        """返回计划的可读描述（每步一行），用于日志"""
+        lines = [f"📋 执行计划: {len(self.stages)} 步"]
+        for i, stage in enumerate(self.stages, 1):
+            notes = []
+            if stage.radius:
+                notes.append(f"halo {stage.radius}px")
+            if stage.full_frame:
+                notes.append("整帧")
+            if stage.stat:
+                notes.append("整帧统计")
+            suffix = f"  [{', '.join(notes)}]" if notes else ""
+            lines.append(f"   {i:2d}. {self.GROUP_NAMES[stage.group]} · {stage.label}{suffix}")
+        return lines
+    
+    def color_tables(self):
+        """计划中的颜色查找表 {合并步骤键: 表}，供 compile(tables=...) 在其它进程中复用"""
+        return {stage.key: stage.table for stage in self.stages
+                if stage.point == "color" and stage.table is not None}
+    
+    def plane_report(self):
+        """派生平面缓存的统计，尚未取用过平面时返回 None"""
+        hit, miss = self.plane_counts["hit"], self.plane_counts["miss"]
+        if not hit + miss:
+            return None
+        return f"🗂️ 派生平面缓存: 复用 {hit} 次, 计算 {miss} 次 (命中率 {hit * 100 // (hit + miss)}%)"
 
 
-# ==================== 12. 音频处理 ====================
-class AudioHandler:
-    @staticmethod
-    def _get_ffmpeg():
-        exe = PM.get_exe("ffmpeg")
-        return exe if exe and os.path.isfile(exe) else "ffmpeg"
+# ==================== 12.11 临时缓冲区池 ====================
+class BufferArena:
+    """临时缓冲区池 - 每个线程按 (槽位, 形状, dtype) 复用整帧大小的中间数组
+    
+    步骤在各自线程内顺序执行，借出的缓冲只在当前步骤内有效：之后任何步骤借用同一槽位
+    都会覆盖其内容，因此不能作为步骤结果返回、跨帧保存，步骤内也不能在持有槽位时调用
+    同样借用该槽位的函数。所有线程保留的缓冲合计不超过 MAX_BYTES，超出时按最近使用
+    淘汰（被淘汰的缓冲若仍在借用中，借用方持有的引用不受影响），工作线程数随 CPU 预算
+    增加时总占用不变；release() 在处理结束后清空全部缓冲。counts 为新分配/复用次数。
+    """
     
-    @staticmethod
-    def extract(video, audio):
-        try:
-            ffmpeg = AudioHandler._get_ffmpeg()
-            si = subprocess.STARTUPINFO()
-            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            subprocess.run([ffmpeg, '-i', video, '-vn', '-acodec', 'copy', '-y', audio],
-                         capture_output=True, startupinfo=si, timeout=60)
-            return os.path.exists(audio) and os.path.getsize(audio) > 0
-        except:
-            return False
+    MAX_BYTES = 1024 * 1024 * 1024
+    counts = {"alloc": 0, "reuse": 0}
+    _buffers = OrderedDict()        # (线程, 槽位, 形状, dtype) -> 缓冲，按最近使用排序
+    _nbytes = 0
+    _lock = threading.Lock()
     
-    # ==================== 4. 替换 AudioHandler 类的 merge_h264 方法 ====================
-    @staticmethod
-    def merge_h264(video_frames_dir, audio, output, fps, width, height):
-        """使用FFmpeg的H.264编码合并视频 - 2025万能兼容版"""
-        try:
-            ffmpeg = AudioHandler._get_ffmpeg()
-            si = subprocess.STARTUPINFO()
-            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            
-            if not os.path.isfile(ffmpeg):
-                print(f"[FFmpeg错误] FFmpeg不存在: {ffmpeg}")
-                return False
-            
-            first_frame = os.path.join(video_frames_dir, 'frame_000000.png')
-            if not os.path.exists(first_frame):
-                print(f"[FFmpeg错误] 帧文件不存在: {first_frame}")
-                return False
-            
-            # GOP大小：30fps用90，60fps用180
-            gop_size = 90 if fps <= 30 else 180
-            keyint_min = 30 if fps <= 30 else 60
-            
-            cmd = [
-                ffmpeg,
-                '-y',
-                '-framerate', str(fps),
-                '-i', os.path.join(video_frames_dir, 'frame_%06d.png'),
-            ]
-            
-            if audio and os.path.exists(audio):
-                cmd.extend(['-i', audio])
-            
-            # 2025万能兼容参数
-            cmd.extend([
-                '-c:v', 'libx264',
-                '-profile:v', 'main',
-                '-level', '4.0',
-                '-preset', 'medium',
-                '-crf', '23',                    # 画质优秀，体积更小
-                '-pix_fmt', 'yuv420p',
-                '-g', str(gop_size),             # 关键帧间隔
-                '-keyint_min', str(keyint_min),
-                '-bf', '2',
-                '-movflags', '+faststart',       # 网页秒开必加
-            ])
-            
-            if audio and os.path.exists(audio):
-                cmd.extend([
-                    '-c:a', 'aac',
-                    '-b:a', '128k',
-                    '-ac', '2',
-                ])
-            
-            cmd.append(output)
-            
-            print(f"[FFmpeg] 万能兼容编码中...")
-            
-            result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                startupinfo=si, 
-                timeout=600,
-                text=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
-            
-            if result.returncode != 0:
-                print(f"[FFmpeg错误] 返回码: {result.returncode}")
-                print(f"[FFmpeg stderr] {result.stderr[:500] if result.stderr else '无'}")
-                return False
-            
-            if os.path.exists(output) and os.path.getsize(output) > 1000:
-                print(f"[FFmpeg] 编码成功: {output}")
-                return True
-            else:
-                print(f"[FFmpeg错误] 输出文件无效")
-                return False
-                
-        except subprocess.TimeoutExpired:
-            print("[FFmpeg错误] 编码超时")
-            return False
-        except Exception as e:
-            print(f"[FFmpeg错误] 异常: {e}")
-            return False
+    @classmethod
+    def get(cls, slot, shape, dtype=np.float32):
+        """借出 slot 槽位的 shape/dtype 缓冲（内容未初始化）"""
+        key = (threading.get_ident(), slot, tuple(shape), np.dtype(dtype))
+        with cls._lock:
+            buf = cls._buffers.get(key)
+            hit = buf is not None
+            if hit:
+                cls._buffers.move_to_end(key)
+            cls.counts["reuse" if hit else "alloc"] += 1
+        if hit:
+            return buf
+        
+        buf = np.empty(shape, dtype)
+        with cls._lock:
+            cls._buffers[key] = buf
+            cls._nbytes += buf.nbytes
+            while cls._nbytes > cls.MAX_BYTES and len(cls._buffers) > 1:
+                _, old = cls._buffers.popitem(last=False)
+                cls._nbytes -= old.nbytes
+        return buf
     
-    @staticmethod
-    def merge(video, audio, output):
-        """合并视频和音频"""
-        try:
-            ffmpeg = AudioHandler._get_ffmpeg()
-            si = subprocess.STARTUPINFO()
-            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            subprocess.run([ffmpeg, '-i', video, '-i', audio, '-c:v', 'copy',
-                          '-c:a', 'aac', '-strict', 'experimental', '-y', output],
-                         capture_output=True, startupinfo=si, timeout=120)
-            return os.path.exists(output)
-        except:
-            return False
+    @classmethod
+    def release(cls):
+        """清空全部线程保留的缓冲（各工作线程池结束后调用）"""
+        with cls._lock:
+            cls._buffers.clear()
+            cls._nbytes = 0
     
-    # ==================== 5. 替换 AudioHandler 类的 encode_h264 方法 ====================
-    @staticmethod
-    def encode_h264(input_raw, output, fps):
-        """将原始视频重新编码为H.264 - 2025万能兼容版"""
+    @classmethod
+    def cast(cls, slot, img, dtype=np.float32):
+        """借出 slot 槽位的缓冲并写入 img 转为 dtype 的值（代替 img.astype(dtype)）"""
+        buf = cls.get(slot, img.shape, dtype)
+        np.copyto(buf, img)
+        return buf
+
+
+# ==================== 12.12 CPU 线程预算 ====================
+class CPUBudget:
+    """CPU 线程预算 - 把资源比例换算为总线程数，在 Python 工作线程与 OpenCV/BLAS 内部线程间分配
+    
+    total = 核数 × 比例，Python 并行的工作线程数取 total（至少 2，不设上限）。处理时按实际
+    并发的 Python 线程数（use）分摊：每个线程可用 total // 并发数 个 OpenCV/BLAS 线程，
+    避免 N 个工作线程再各自开满核的内部线程池。工作线程池按全部核数启动、经 slot() 闸门
+    只放行 workers 个。set_ratio（资源滑块）可在处理中从界面线程调用：闸门立即生效，
+    内部线程数只记为待更新，由处理线程在一帧完成时经 sync() 应用，不在界面线程里改动 OpenCV。
+    """
+    
+    def __init__(self, cores=None, ratio=0.7):
+        self.cores = max(1, cores or os.cpu_count() or 4)
+        self.ratio = ratio
+        self.concurrency = 1
+        self._active = 0
+        self._cond = threading.Condition()
+        self._initial_threads = cv2.getNumThreads()
+        self._applied = False
+        self._pending = False
+    
+    @property
+    def total(self):
+        return max(1, int(self.cores * self.ratio))
+    
+    @property
+    def workers(self):
+        """当前比例下放行的 Python 工作线程数"""
+        return max(2, self.total)
+    
+    @property
+    def max_workers(self):
+        """工作线程池的启动线程数：比例调到 100% 时也不必重建线程池"""
+        return max(2, self.cores)
+    
+    @property
+    def native_threads(self):
+        """每个并发 Python 线程可用的 OpenCV/BLAS 线程数"""
+        return max(1, self.total // max(1, min(self.concurrency, self.workers)))
+    
+    def use(self, concurrency):
+        """登记当前并发的 Python 处理线程数并应用内部线程限制"""
+        with self._cond:
+            self.concurrency = max(1, concurrency)
+        self._apply()
+    
+    def set_ratio(self, ratio):
+        """资源比例变化（处理中亦可）：闸门立即放宽/收紧，内部线程数待下一次 sync() 应用"""
+        with self._cond:
+            self.ratio = ratio
+            self._pending = self._applied
+            self._cond.notify_all()
+    
+    def sync(self):
+        """安全点（一帧处理完成时，处理线程调用）：应用 set_ratio 后待更新的内部线程数"""
+        with self._cond:
+            pending, self._pending = self._pending, False
+        if pending and self._applied:
+            self._apply()
+    
+    def _apply(self):
+        threads = self.native_threads
+        cv2.setNumThreads(threads)
+        if threadpool_limits:
+            threadpool_limits(limits=threads, user_api="blas")
+        self._applied = True
+        self._pending = False
+    
+    def restore(self):
+        """恢复 OpenCV 原有的线程数（BLAS 限制解除为核数）"""
+        if not self._applied:
+            return
+        cv2.setNumThreads(self._initial_threads)
+        if threadpool_limits:
+            threadpool_limits(limits=self.cores, user_api="blas")
+        self._applied = False
+    
+    @contextmanager
+    def slot(self):
+        """工作线程闸门：同时处理的线程数不超过 workers"""
+        with self._cond:
+            while self._active >= self.workers:
+                self._cond.wait()
+            self._active += 1
         try:
-            ffmpeg = AudioHandler._get_ffmpeg()
-            si = subprocess.STARTUPINFO()
-            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            
-            gop_size = 90 if fps <= 30 else 180
-            keyint_min = 30 if fps <= 30 else 60
-            
-            cmd = [
-                ffmpeg,
-                '-y',
-                '-i', input_raw,
-                '-c:v', 'libx264',
-                '-profile:v', 'main',
-                '-level', '4.0',
-                '-preset', 'medium',
-                '-crf', '23',
-                '-pix_fmt', 'yuv420p',
-                '-g', str(gop_size),
-                '-keyint_min', str(keyint_min),
-                '-bf', '2',
-                '-movflags', '+faststart',
-                '-c:a', 'aac',
-                '-b:a', '128k',
-                '-ac', '2',
-                output
-            ]
-            
-            subprocess.run(cmd, capture_output=True, startupinfo=si, timeout=600)
-            return os.path.exists(output)
-        except:
-            return False
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+    
+    def describe(self):
+        return (f"⚙️ CPU 预算: {self.total}/{self.cores} 线程 ({int(self.ratio * 100)}%), "
+                f"Python 工作线程 {min(self.concurrency, self.workers)}, "
+                f"OpenCV{'/BLAS' if threadpool_limits else ''} 每线程 {self.native_threads}")
+
 
 # ==================== 13. 视频处理管线 ====================
 STOP_FLAG = False
@@ -1781,166 +4080,760 @@ PAUSE_FLAG = False
 class VideoPipeline:
     """视频处理管线 - H.264编码优化版"""
     
+    SEGMENT_MIN_SECONDS = 10                                  # 分段模式下每段最短时长
+    SEGMENT_OVERLAP = ProfessionalRestorer.TEMPORAL_HISTORY   # 段首预热的重叠帧数
+    SEGMENT_RETRIES = 1                                       # 失败分段的重试次数
+    CHECKPOINT_SECONDS = 10                                   # 断点续传模式下每个分块的时长
+    
     def __init__(self, task, log_func, gpu_info, resource_ratio=0.7):
         self.task = task
         self.log = log_func
         self.resource_ratio = resource_ratio
         self.sample_metrics = None
+        self.media_info = None
         self.smart_mode = task.smart_mode
+        self.plan = None
+        self.tile_large_frames = True
+        self.planar = False     # 解码帧为 yuv420p（I420 布局）时按平面执行计划
         
-        cores = gpu_info.get("cores", 4)
-        self.max_workers = max(2, min(8, int(cores * resource_ratio)))
+        # 资源比例经 CPUBudget 换算为线程预算；max_workers 为开始处理时的 Python 工作线程数
+        self.budget = CPUBudget(gpu_info.get("cores", 4), resource_ratio)
+        self.max_workers = self.budget.workers
         self.parallel_processor = ParallelProcessor(self.max_workers, resource_ratio)
+        self._tiler = TileExecutor()
     
     def run(self, progress_cb, time_cb=None, status_cb=None):
         global STOP_FLAG, PAUSE_FLAG
         start_time = time.time()
         temp_dir = tempfile.mkdtemp()
-        audio_path = os.path.join(temp_dir, "audio.aac")
         frames_dir = os.path.join(temp_dir, "frames")
         temp_video = os.path.join(temp_dir, "temp_raw.mp4")
-        os.makedirs(frames_dir, exist_ok=True)
         
         try:
-            has_audio = AudioHandler.extract(self.task.input_path, audio_path)
-            self.log(f"音频: {'有' if has_audio else '无'}")
+            # 不再预先抽取音轨：最终封装时直接从源文件读取音频，与处理过程互不阻塞
+            has_audio = AudioHandler.has_audio(self.task.input_path)
+            audio_path = self.task.input_path if has_audio is not False else None
+            if has_audio:
+                codec = MediaProbe.audio_codec(self.task.input_path)
+                copy = AudioHandler.can_copy_audio(codec, self.task.output_path)
+                self.log(f"音频: {codec} ({'流复制' if copy else '转AAC'})")
+            else:
+                self.log(f"音频: {'无' if has_audio is False else '未知'}")
             
-            cap = cv2.VideoCapture(self.task.input_path)
-            fps = cap.get(cv2.CAP_PROP_FPS) or 25
-            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            cfg = self.task.get_config()
+            self.media_info = MediaProbe.probe(self.task.input_path)
+            cap = self._open_capture(cfg)
+            
+            info = self.media_info
+            if info:
+                fps, total = info["fps"], info["frames"]
+                w, h = info["width"], info["height"]
+            else:
+                fps = cap.get(cv2.CAP_PROP_FPS) or 25
+                total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
             
             self.task.total_frames = total
-            self.log(f"视频: {w}x{h}, {fps:.1f}fps, {total}帧")
+            self.log(f"视频: {w}x{h}, {fps:.1f}fps, {total}帧"
+                     + (f", 旋转{info['rotation']}°" if info and info["rotation"] else ""))
+            self.log(f"解码: {'FFmpeg管道' if isinstance(cap, FFmpegFrameReader) else 'OpenCV'}")
+            self.planar = isinstance(cap, FFmpegFrameReader) and cap.pix_fmt == "yuv420p"
+            pix_fmt = cap.pix_fmt if self.planar else "bgr24"
             self.log(f"并行线程: {self.max_workers}")
             
-            cfg = self.task.get_config()
-            
             if self.smart_mode or cfg.get("use_detail_restore"):
                 self.log("🔍 智能分析中...")
-                cap.set(cv2.CAP_PROP_POS_FRAMES, total // 2)
-                ret, sample_frame = cap.read()
-                if ret:
+                sample_frame = self._grab_sample(cap, total // 2)
+                if sample_frame is not None:
                     self.sample_metrics = ImageAnalyzer.analyze(sample_frame)
                     self.log(f"📊 亮度:{self.sample_metrics['brightness']:.0f} "
                             f"对比:{self.sample_metrics['contrast']:.0f} "
                             f"清晰:{self.sample_metrics['sharpness']:.0f}")
-                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
             
-            ProfessionalRestorer.clear_frame_buffer()
+            self._compile_plan(cfg)
+            tiled = cfg.get("tile_large_frames", True) and w * h >= TileExecutor.MIN_PIXELS
+            if self.planar:
+                self.log(self.plan.planar_report(tiled))
+                tiled = tiled and not all(stage.planar for stage in self.plan.stages)
             
-            processed = self._process_frames_to_sequence(
-                cap, frames_dir, total, fps, progress_cb, time_cb, start_time, cfg
-            )
+            if tiled:
+                self.log(f"🧱 分块处理: {w}x{h} 按 {TileExecutor.TILE}px 图块执行，整帧统计量预先计算")
             
-            cap.release()
+            checkpoint = None
+            if cfg.get("checkpoint", True) and cfg.get("stream_encode", True):
+                checkpoint = TaskCheckpoint(self.task)
             
-            if STOP_FLAG:
-                self.log("⏹ 处理已停止")
+            if cfg.get("segment_parallel", False):
+                cap.release()
+                processed = self._run_segments(checkpoint, temp_dir, audio_path,
+                                               total, fps, progress_cb, time_cb, status_cb, start_time, cfg)
                 return processed, time.time() - start_time
             
-            self.log("📦 正在编码 H.264...")
-            if status_cb:
-                status_cb("正在编码视频...")
-            
-            if AudioHandler.merge_h264(frames_dir, audio_path if has_audio else None, 
-                                       self.task.output_path, fps, w, h):
-                self.log("✅ H.264编码完成")
+            if checkpoint:
+                start_frame = checkpoint.load()
+                chunked = ChunkedStreamWriter(checkpoint, fps, int(fps * self.CHECKPOINT_SECONDS), pix_fmt)
+                if chunked.open(w, h):
+                    processed = self._run_chunked(cap, chunked, start_frame, audio_path,
+                                                  total, progress_cb, time_cb, status_cb, start_time, cfg)
+                    return processed, time.time() - start_time
+                self.log("⚠️ 流式编码不可用，改用图片序列模式")
+            
+            writer = None
+            if cfg.get("stream_encode", True) and not checkpoint:
+                writer = FFmpegStreamWriter(self.task.output_path, fps, audio_path, pix_fmt)
+                if not writer.start(w, h):
+                    self.log("⚠️ 流式编码不可用，改用图片序列模式")
+                    writer = None
+            
+            if writer:
+                processed = self._run_stream(cap, writer, total, progress_cb, time_cb, status_cb,
+                                             start_time, cfg)
             else:
-                self.log("⚠️ FFmpeg编码失败，尝试备用方案...")
-                writer = cv2.VideoWriter(temp_video, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
-                
-                frame_files = sorted(glob.glob(os.path.join(frames_dir, 'frame_*.png')))
-                for frame_file in frame_files:
-                    frame = cv2.imread(frame_file)
-                    if frame is not None:
-                        writer.write(frame)
-                writer.release()
-                
-                if has_audio:
-                    AudioHandler.merge(temp_video, audio_path, self.task.output_path)
-                else:
-                    AudioHandler.encode_h264(temp_video, self.task.output_path, fps)
+                processed = self._run_sequence(cap, frames_dir, temp_video, audio_path,
+                                               total, fps, w, h, progress_cb, time_cb, status_cb,
+                                               start_time, cfg)
             
             elapsed = time.time() - start_time
             return processed, elapsed
         finally:
+            self.parallel_processor.close()
+            self.budget.restore()
+            BufferArena.release()
             shutil.rmtree(temp_dir, ignore_errors=True)
     
-    def _process_frames_to_sequence(self, cap, frames_dir, total, fps, progress_cb, time_cb, start_time, cfg):
-        global STOP_FLAG, PAUSE_FLAG
+    def _open_capture(self, cfg):
+        """打开解码器：优先 FFmpeg 管道（帧数、定位准确），ffprobe 不可用时回退到 OpenCV"""
+        if cfg.get("ffmpeg_decode", True) and self.media_info:
+            pix_fmt = "yuv420p" if self._wants_planar(cfg) else "bgr24"
+            reader = FFmpegFrameReader.open(self.task.input_path, self.media_info, pix_fmt)
+            if reader:
+                return reader
+        return cv2.VideoCapture(self.task.input_path)
+    
+    def _wants_planar(self, cfg):
+        """planar_yuv 开启且当前模式支持时以 yuv420p 解码/编码（4:2:0 要求宽高为偶数）"""
+        if not cfg.get("planar_yuv", False):
+            return False
+        info = self.media_info
+        if info["width"] % 2 or info["height"] % 2:
+            self.log("⚠️ yuv420p 平面直通要求宽高为偶数，已改为 BGR 处理")
+            return False
+        blocked = [name for key, name in (("segment_parallel", "分段并行"), ("process_pool", "多进程"),
+                                          ("stage_pipeline", "流水线"), ("dirty_regions", "脏区域处理"))
+                   if cfg.get(key, False)]
+        if blocked:
+            self.log(f"⚠️ yuv420p 平面直通不支持{'、'.join(blocked)}，已改为 BGR 处理")
+            return False
+        return True
+    
+    def _grab_sample(self, cap, index):
+        """读取第 index 帧用于智能分析；管道解码器另起一次快速定位，不打断主解码流"""
+        if isinstance(cap, FFmpegFrameReader):
+            return FFmpegFrameReader.grab(self.task.input_path, index, self.media_info)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ret, frame = cap.read()
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return frame if ret else None
+    
+    def _run_stream(self, cap, writer, total, progress_cb, time_cb, status_cb, start_time, cfg):
+        """流式模式：处理后的帧直接送入FFmpeg编码，处理与编码重叠进行"""
+        self.log("📦 流式编码 H.264 (rawvideo管道)")
+        
+        try:
+            processed = self._process_frames(
+                cap, lambda index, frame: writer.write(frame),
+                total, progress_cb, time_cb, start_time, cfg
+            )
+        except:
+            cap.release()
+            writer.abort()
+            raise
         
-        processed = 0
-        frame_times = []
+        cap.release()
         
-        basic_int = cfg.get("basic_intensity", "medium")
-        adv_int = cfg.get("adv_intensity", "medium")
-        detail_int = cfg.get("detail_intensity", "medium")
+        if STOP_FLAG:
+            writer.abort()
+            self.log("⏹ 处理已停止")
+            return processed
         
-        while not STOP_FLAG:
-            while PAUSE_FLAG and not STOP_FLAG:
-                time.sleep(0.1)
+        if status_cb:
+            status_cb("正在完成编码...")
+        
+        if not writer.close():
+            raise RuntimeError(f"FFmpeg流式编码失败: {writer.get_error()}")
+        
+        self.log("✅ H.264编码完成")
+        return processed
+    
+    def _run_chunked(self, cap, chunked, start_frame, audio_path, total, progress_cb, time_cb, status_cb,
+                     start_time, cfg):
+        """断点续传模式：分块流式编码，每个分块完成即提交断点，结束后无损拼接所有分块"""
+        checkpoint = chunked.checkpoint
+        if start_frame > 0:
+            self.log(f"♻️ 从断点续传: 第 {start_frame} 帧起 (已完成 {len(checkpoint.data['chunks'])} 个分块)")
+        self.log(f"📦 分块流式编码 H.264 (每 {chunked.chunk_frames} 帧保存一次断点)")
+        
+        try:
+            processed = self._process_frames(
+                cap, lambda index, frame: chunked.write(frame),
+                total, progress_cb, time_cb, start_time, cfg, start=start_frame
+            )
+        except:
+            chunked.abort()
+            raise
+        finally:
+            cap.release()
+        
+        chunked.commit()
+        
+        if STOP_FLAG:
+            self.log(f"⏹ 处理已停止，断点已保存 (第 {checkpoint.data['committed_frame']} 帧)")
+            return processed
+        
+        if status_cb:
+            status_cb("正在拼接分块...")
+        
+        if not AudioHandler.concat(checkpoint.chunk_paths(), audio_path, self.task.output_path,
+                                   os.path.join(checkpoint.work_dir, "concat.txt"),
+                                   self._encode_progress("正在拼接分块", total, None, status_cb)):
+            raise RuntimeError("分块拼接失败")
+        
+        checkpoint.clear()
+        self.log("✅ H.264编码完成")
+        return processed
+    
+    def _run_segments(self, checkpoint, work_dir, audio_path, total, fps, progress_cb, time_cb, status_cb,
+                      start_time, cfg):
+        """分段并行模式：按关键帧切段，各段独立解码、处理、编码，最后用concat无损拼接
+        
+        有断点时分段方案和已完成的分段记录在 manifest 中，续传时跳过已完成的分段。
+        """
+        arena_start = dict(BufferArena.counts)
+        segments, done = None, {}
+        if checkpoint:
+            checkpoint.load()
+            seg_dir = checkpoint.work_dir
+            if checkpoint.data.get("segments"):
+                segments = [tuple(seg) for seg in checkpoint.data["segments"]]
+                done = checkpoint.data.get("segments_done", {})
+        else:
+            seg_dir = os.path.join(work_dir, "segments")
+            os.makedirs(seg_dir, exist_ok=True)
+        
+        if segments is None:
+            keyframes = MediaProbe.keyframes(self.task.input_path)
+            min_len = max(1, int(fps * self.SEGMENT_MIN_SECONDS))
+            segments = self._plan_segments(total, keyframes, self.max_workers * 2, min_len)
+            self.log(f"✂️ 分段并行: {len(segments)} 段, 关键帧 {len(keyframes)} 个, "
+                     f"{self.max_workers} 个工作线程")
+            if checkpoint:
+                checkpoint.data["segments"] = [list(seg) for seg in segments]
+                checkpoint.save()
+        else:
+            self.log(f"♻️ 分段续传: 共 {len(segments)} 段, 已完成 {len(done)} 段")
+        
+        seg_paths = [os.path.join(seg_dir, f"seg_{i:04d}.mp4") for i in range(len(segments))]
+        
+        progress = [0] * len(segments)
+        skipped = [0] * len(segments)
+        lock = threading.Lock()
+        emit_times = deque(maxlen=30)
+        cancel = threading.Event()
+        
+        for key, count in done.items():
+            if os.path.isfile(seg_paths[int(key)]) or count == 0:
+                progress[int(key)] = count
+        
+        use_dirty = self._create_dirty_tracker(cfg) is not None
+        
+        def on_frame(i, duplicate=False):
+            with lock:
+                progress[i] += 1
+                skipped[i] += duplicate
+                self._report_progress(sum(progress), total, emit_times, progress_cb, time_cb, start_time)
+        
+        def run_one(i):
+            start, end = segments[i]
+            if str(i) in done and (os.path.isfile(seg_paths[i]) or done[str(i)] == 0):
+                return done[str(i)]
+            for attempt in range(self.SEGMENT_RETRIES + 1):
+                with lock:
+                    progress[i] = skipped[i] = 0
+                try:
+                    with self.budget.slot():
+                        count = self._process_segment(start, end, seg_paths[i], fps, cfg,
+                                                      lambda duplicate: on_frame(i, duplicate), cancel, use_dirty)
+                    if checkpoint and not (STOP_FLAG or cancel.is_set()):
+                        with lock:
+                            checkpoint.commit_segment(i, count)
+                    return count
+                except Exception as e:
+                    if STOP_FLAG or cancel.is_set() or attempt >= self.SEGMENT_RETRIES:
+                        cancel.set()
+                        raise
+                    self.log(f"⚠️ 第{i + 1}段处理失败，重试: {e}")
+        
+        self.budget.use(len(segments))
+        self.log(self.budget.describe())
+        with ThreadPoolExecutor(max_workers=min(len(segments), self.budget.max_workers)) as executor:
+            counts = list(executor.map(run_one, range(len(segments))))
+        
+        processed = sum(counts)
+        if cfg.get("skip_duplicates", False):
+            self._report_skipped(sum(skipped), processed - sum(done.values()))
+        self._report_planes()
+        self._report_buffers(arena_start)
+        if STOP_FLAG:
+            self.log("⏹ 处理已停止")
+            return processed
+        
+        self.log("📦 正在拼接分段...")
+        if status_cb:
+            status_cb("正在拼接分段...")
+        
+        parts = [path for path, count in zip(seg_paths, counts) if count > 0]
+        if not AudioHandler.concat(parts, audio_path, self.task.output_path,
+                                   os.path.join(seg_dir, "concat.txt"),
+                                   self._encode_progress("正在拼接分段", total, None, status_cb)):
+            raise RuntimeError("分段拼接失败")
+        
+        if checkpoint:
+            checkpoint.clear()
+        self.log("✅ H.264编码完成")
+        return processed
+    
+    @staticmethod
+    def _plan_segments(total, keyframes, count, min_len):
+        """把 [0, total) 切成约 count 段，切点尽量落在关键帧上；最后一段读到文件末尾(end=None)"""
+        if total <= 0:
+            return [(0, None)]
+        
+        count = max(1, min(count, total // min_len))
+        keyframes = [k for k in keyframes if 0 < k < total]
+        
+        cuts = []
+        for i in range(1, count):
+            cut = total * i // count
+            if keyframes:
+                cut = min(keyframes, key=lambda k: abs(k - cut))
+            prev = cuts[-1] if cuts else 0
+            if cut - prev >= min_len and total - cut >= min_len:
+                cuts.append(cut)
+        
+        bounds = [0] + cuts + [None]
+        return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+    
+    def _process_segment(self, start, end, seg_path, fps, cfg, on_frame, cancel, use_dirty=False):
+        """处理 [start, end) 区间并编码到 seg_path，返回处理帧数
+        
+        段首之前的 SEGMENT_OVERLAP 帧只读取不输出，用于预热时序稳定的参考帧。
+        """
+        cap = self._open_capture(dict(cfg, planar_yuv=False))   # 分段并行不支持平面直通，已在 run() 中提示
+        writer = FFmpegStreamWriter(seg_path, fps)
+        dedup = FrameDeduplicator(None, start) if cfg.get("skip_duplicates", False) else None
+        dirty = DirtyRegionTracker(cfg) if use_dirty else None
+        count = 0
+        result = None
+        
+        try:
+            history = self._seek_with_history(cap, start)
+            while end is None or start + count < end:
+                while PAUSE_FLAG and not STOP_FLAG:
+                    time.sleep(0.1)
+                if STOP_FLAG or cancel.is_set():
+                    writer.abort()
+                    return count
+                
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                
+                duplicate = dedup is not None and dedup.is_duplicate(frame)
+                if dirty and not duplicate:
+                    result = dirty.compose(self._process_regions(frame, list(history), dirty.plan(frame), dirty))
+                elif not duplicate:
+                    result = self._process_frame(frame, list(history))
+                if writer.proc is None and not writer.start(result.shape[1], result.shape[0]):
+                    raise IOError("FFmpeg流式编码启动失败")
+                writer.write(result)
+                
+                history.append(frame)
+                count += 1
+                on_frame(duplicate)
             
-            if STOP_FLAG:
-                break
+            if count == 0:
+                writer.abort()
+                return 0
             
+            if not writer.close():
+                raise RuntimeError(f"分段编码失败: {writer.get_error()}")
+            return count
+        except:
+            writer.abort()
+            raise
+        finally:
+            cap.release()
+    
+    def _seek_with_history(self, cap, start):
+        """定位到第 start 帧；之前的 SEGMENT_OVERLAP 帧只读取不处理，作为时序稳定的参考帧"""
+        history = deque(maxlen=ProfessionalRestorer.TEMPORAL_HISTORY)
+        warm = min(self.SEGMENT_OVERLAP, start)
+        if start - warm > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start - warm)
+        for _ in range(warm):
             ret, frame = cap.read()
             if not ret:
                 break
-            
-            frame_start = time.time()
-            
-            result = self._process_frame(frame, cfg, basic_int, adv_int, detail_int)
-            
-            frame_path = os.path.join(frames_dir, f'frame_{processed:06d}.png')
-            cv2.imwrite(frame_path, result)
-            
-            processed += 1
-            self.task.current_frame = processed
-            self.task.progress = processed / total * 100
-            
-            frame_time = time.time() - frame_start
-            frame_times.append(frame_time)
-            if len(frame_times) > 30:
-                frame_times.pop(0)
-            
-            current_fps = 1.0 / (sum(frame_times) / len(frame_times)) if frame_times else 0
-            self.task.fps = current_fps
-            
-            elapsed = time.time() - start_time
-            self.task.elapsed_time = elapsed
-            
-            if progress_cb:
-                progress_cb(processed, total, current_fps)
-            if time_cb:
-                time_cb(elapsed)
-        
-        return processed
+            history.append(frame)
+        return history
     
-    def _process_frame(self, frame, cfg, basic_int, adv_int, detail_int):
-        result = frame.copy()
-        original = frame.copy()
+    def _run_sequence(self, cap, frames_dir, temp_video, audio_path, total, fps, w, h,
+                      progress_cb, time_cb, status_cb, start_time, cfg):
+        """图片序列模式：先输出PNG序列，再统一编码（无FFmpeg管道时的备用方案）"""
+        os.makedirs(frames_dir, exist_ok=True)
         
-        result = ProfessionalRestorer.temporal_stabilize(result)
+        def write_png(index, frame):
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
+            cv2.imwrite(os.path.join(frames_dir, f'frame_{index:06d}.png'), frame)
         
-        if cfg.get("use_detail_restore"):
-            result = self.parallel_processor.process_frame_parallel(
-                result, cfg, detail_int, self.sample_metrics, original
-            )
+        processed = self._process_frames(
+            cap, write_png, total, progress_cb, time_cb, start_time, cfg
+        )
         
-        if cfg.get("use_basic"):
-            result = ImageProcessor.apply_basic_parallel(
-                result, cfg, basic_int, self.sample_metrics, self.smart_mode
-            )
+        cap.release()
         
-        if cfg.get("use_advanced"):
-            result = ImageProcessor.apply_advanced_parallel(
-                result, cfg, adv_int, self.sample_metrics, self.smart_mode
-            )
+        if STOP_FLAG:
+            self.log("⏹ 处理已停止")
+            return processed
         
-        result = ImageProcessor.apply_filters(result, cfg, basic_int)
+        self.log("📦 正在编码 H.264...")
+        if status_cb:
+            status_cb("正在编码视频...")
         
-        return result
+        on_progress = self._encode_progress("正在编码视频", processed, progress_cb, status_cb)
+        if AudioHandler.merge_h264(frames_dir, audio_path, self.task.output_path, fps, w, h, on_progress):
+            self.log("✅ H.264编码完成")
+        else:
+            self.log("⚠️ FFmpeg编码失败，尝试备用方案...")
+            writer = cv2.VideoWriter(temp_video, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+            
+            frame_files = sorted(glob.glob(os.path.join(frames_dir, 'frame_*.png')))
+            for frame_file in frame_files:
+                frame = cv2.imread(frame_file)
+                if frame is not None:
+                    writer.write(frame)
+            writer.release()
+            
+            if audio_path:
+                AudioHandler.merge(temp_video, audio_path, self.task.output_path, on_progress)
+            else:
+                AudioHandler.encode_h264(temp_video, self.task.output_path, fps, on_progress)
+        
+        return processed
+    
+    def _encode_progress(self, label, total, progress_cb, status_cb):
+        """把 FFmpegRunner 的 -progress 汇报转成状态栏文字；给出 progress_cb 时同时驱动进度条"""
+        t0 = time.time()
+        
+        def on_progress(info):
+            frame = info["frame"]
+            if status_cb:
+                # 流复制时 FFmpeg 不统计帧数，改报已输出的时长
+                done = f"{frame}/{total}帧" if frame > 0 else f"{self._format_seconds(info['out_time'])}"
+                status_cb(f"{label}... {done} | 速度 {info['speed']}")
+            if progress_cb and total > 0 and frame > 0:
+                progress_cb(min(frame, total), total, frame / max(time.time() - t0, 1e-6))
+        return on_progress
+    
+    @staticmethod
+    def _format_seconds(seconds):
+        seconds = int(seconds)
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    
+    def _process_frames(self, cap, emit, total, progress_cb, time_cb, start_time, cfg, start=0):
+        """从第 start 帧起读取并处理所有帧，按顺序交给 emit(index, frame) 输出
+        
+        process_pool 开启时由 FrameProcessPool 多进程处理，stage_pipeline 开启时按处理组
+        分阶段流水线执行，frame_parallel 开启时由 OrderedFramePool 多线程并行处理整帧，
+        否则逐帧串行。
+        """
+        dirty = self._create_dirty_tracker(cfg)
+        arena_start = dict(BufferArena.counts)
+        def process(frame, history):
+            if dirty:
+                frame, rects = frame
+                return self._process_regions(frame, history, rects, dirty)
+            return self._process_frame(frame, history)
+        
+        state = {"processed": start}
+        emit_times = deque(maxlen=30)
+        
+        def emit_and_report(index, result):
+            if dirty:
+                result = dirty.compose(result)
+            emit(index, result)
+            state["processed"] = processed = index + 1
+            self._report_progress(processed, total, emit_times, progress_cb, time_cb, start_time)
+        
+        history = self._seek_with_history(cap, start)
+        
+        dedup = None
+        if cfg.get("skip_duplicates", False):
+            dedup = FrameDeduplicator(emit_and_report, start)
+            self.log("♻️ 重复帧跳过: 已开启")
+        
+        try:
+            if cfg.get("stage_pipeline", False) and not cfg.get("process_pool", False):
+                return self._process_frames_staged(cap, emit_and_report, state, start, history, dedup)
+            
+            pool = None
+            pool_emit = dedup.pool_emit if dedup else emit_and_report
+            if cfg.get("process_pool", False) and self.max_workers > 1:
+                pool = FrameProcessPool(self.task, self.sample_metrics, pool_emit, self.max_workers,
+                                        self.plan.color_tables())
+                self.budget.use(self.max_workers)
+                self.log(f"🚀 多进程并行: {self.max_workers} 个工作进程 (共享内存帧环 {pool.slots} 槽)")
+            elif cfg.get("frame_parallel", True) and self.max_workers > 1:
+                # 按全部核数启动工作线程，由预算闸门放行 workers 个，资源比例调高时无需重建
+                pool = OrderedFramePool(process, pool_emit, self.budget.max_workers, self.max_workers * 2,
+                                        start_index=start, budget=self.budget)
+                pool.start()
+                self.budget.use(self.budget.max_workers)
+                self.log(f"🧵 帧级并行: {self.max_workers} 个工作线程")
+            elif self.max_workers > 1:
+                # 逐帧串行时由图块并行占用工作线程
+                self._tiler = TileExecutor(self.max_workers)
+                info = self.media_info
+                tiled = self.tile_large_frames and info and info["width"] * info["height"] >= TileExecutor.MIN_PIXELS
+                self.budget.use(self.max_workers if tiled else 1)
+            self.log(self.budget.describe())
+            
+            index = start
+            
+            try:
+                while not STOP_FLAG:
+                    while PAUSE_FLAG and not STOP_FLAG:
+                        time.sleep(0.1)
+                    
+                    if STOP_FLAG:
+                        break
+                    
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    
+                    if dedup and dedup.is_duplicate(frame):
+                        dedup.emit(index, None)
+                        history.append(frame)
+                        index += 1
+                        continue
+                    
+                    job = (frame, dirty.plan(frame)) if dirty else frame
+                    if pool:
+                        pool.submit(dedup.pool_index(index) if dedup else index, job, list(history))
+                    elif dedup:
+                        dedup.emit(index, process(job, list(history)))
+                    else:
+                        emit_and_report(index, process(job, list(history)))
+                    
+                    history.append(frame)
+                    index += 1
+            finally:
+                if pool:
+                    pool.finish()
+                self._tiler.close()
+                self._tiler = TileExecutor()
+        finally:
+            if dedup:
+                self._report_skipped(dedup.skipped, state["processed"] - start)
+            if dirty:
+                self.log(dirty.report())
+            self._report_planes()
+            self._report_buffers(arena_start)
+        
+        return state["processed"]
+    
+    def _create_dirty_tracker(self, cfg):
+        """dirty_regions 开启且当前步骤组合支持时返回 DirtyRegionTracker，否则返回 None"""
+        if not cfg.get("dirty_regions", False):
+            return None
+        if not cfg.get("segment_parallel", False) and (cfg.get("process_pool", False)
+                                                       or cfg.get("stage_pipeline", False)):
+            self.log("⚠️ 脏区域处理不支持多进程/流水线模式，已改为整帧处理")
+            return None
+        blocked = DirtyRegionTracker.unsupported(cfg)
+        if blocked:
+            self.log(f"⚠️ 脏区域处理与 {'、'.join(blocked)} 不兼容（依赖整帧统计或逐帧噪声），已改为整帧处理")
+            return None
+        tracker = DirtyRegionTracker(cfg)
+        self.log(f"🧩 脏区域处理: 图块 {tracker.TILE}px, halo {tracker.halo}px")
+        return tracker
+    
+    def _process_regions(self, frame, history, rects, dirty):
+        """脏区域模式：rects 为 None 时整帧处理，否则只处理各区域（含 halo），返回 [(区域, 区域结果)]"""
+        ctx = ProcessingPlan.context(frame, history, self.plan.plane_counts)
+        if rects is None:
+            return self._run_plan(frame, ctx)
+        
+        frame_area = frame.shape[0] * frame.shape[1]
+        patches = []
+        for rect in rects:
+            window, center = dirty.crop(frame, rect)
+            cy0, cy1, cx0, cx1 = window
+            crop = frame[cy0:cy1, cx0:cx1]
+            crop_ctx = ProcessingPlan.crop_context(ctx, window, crop.shape[0] * crop.shape[1] / frame_area)
+            patches.append((rect, self._run_plan(crop, crop_ctx)[center]))
+        return patches
+    
+    def _report_skipped(self, skipped, processed):
+        """累计并记录本任务跳过的重复帧数"""
+        self.task.skipped_frames += skipped
+        ratio = skipped / processed * 100 if processed > 0 else 0
+        self.log(f"♻️ 重复帧: 跳过 {skipped}/{processed} 帧 ({ratio:.1f}%)")
+    
+    def _process_frames_staged(self, cap, emit, state, start, history, dedup=None):
+        """流水线模式：解码 | 修复 | 智能后期 | 高级后期+滤镜 | 编码 各占一个线程"""
+        def decode():
+            index = start
+            while not STOP_FLAG:
+                while PAUSE_FLAG and not STOP_FLAG:
+                    time.sleep(0.1)
+                if STOP_FLAG:
+                    break
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if dedup and dedup.is_duplicate(frame):
+                    dedup.emit(index, None)
+                else:
+                    yield index, (frame, list(history))
+                history.append(frame)
+                index += 1
+        
+        # 各组经 _run_stages 执行，4K/8K 帧在各阶段线程内同样分块处理
+        counts = self.plan.plane_counts
+        groups = {group: tuple(stage for stage in self.plan.stages if stage.group == group)
+                  for group in ("restore", "basic", "post")}
+        pipeline = StagePipeline([
+            ("restore", lambda item: self._run_stages(item[0], groups["restore"],
+                                                      ProcessingPlan.context(*item, counts))),
+            ("basic", lambda img: self._run_stages(img, groups["basic"], ProcessingPlan.context(img, (), counts))),
+            ("post", lambda img: self._run_stages(img, groups["post"], ProcessingPlan.context(img, (), counts))),
+        ], queue_size=4)
+        self.log("🏭 流水线并行: 解码 | 修复 | 智能后期 | 高级后期+滤镜 | 编码")
+        self.budget.use(len(pipeline.stages))
+        self.log(self.budget.describe())
+        
+        try:
+            pipeline.run(decode, dedup.emit if dedup else emit)
+        finally:
+            self.log("📊 流水线阶段统计:")
+            for line in pipeline.report():
+                self.log(f"   {line}")
+        
+        return state["processed"]
+    
+    def _report_planes(self):
+        """记录派生平面缓存的复用统计与 DAG 调度器各节点的执行/等待耗时"""
+        report = self.plan.plane_report() if self.plan else None
+        if report:
+            self.log(report)
+        lines = self.parallel_processor.report()
+        if lines:
+            self.log("📊 并行节点统计:")
+            for line in lines:
+                self.log(f"   {line}")
+    
+    def _report_buffers(self, arena_start):
+        """记录临时缓冲（BufferArena）的新分配/复用次数"""
+        alloc = BufferArena.counts["alloc"] - arena_start["alloc"]
+        reuse = BufferArena.counts["reuse"] - arena_start["reuse"]
+        if alloc + reuse:
+            self.log(f"🧮 缓冲复用: 临时缓冲 复用 {reuse} / 新分配 {alloc}")
+    
+    def _report_progress(self, processed, total, emit_times, progress_cb, time_cb, start_time):
+        """更新任务进度，帧率按最近30帧的输出吞吐计算；一帧完成也是应用线程预算变化的安全点"""
+        self.budget.sync()
+        now = time.time()
+        emit_times.append(now)
+        
+        self.task.current_frame = processed
+        self.task.progress = min(100.0, processed / total * 100) if total > 0 else 0
+        
+        if len(emit_times) > 1:
+            current_fps = (len(emit_times) - 1) / max(emit_times[-1] - emit_times[0], 1e-6)
+        else:
+            current_fps = 1.0 / max(now - start_time, 1e-6)
+        self.task.fps = current_fps
+        
+        elapsed = now - start_time
+        self.task.elapsed_time = elapsed
+        
+        if progress_cb:
+            progress_cb(processed, total, current_fps)
+        if time_cb:
+            time_cb(elapsed)
+    
+    def _compile_plan(self, cfg, tables=None):
+        """按任务配置和采样指标编译执行计划并写入日志（tables 见 ProcessingPlan.compile）"""
+        self.plan = ProcessingPlan.compile(cfg, self.sample_metrics, self.smart_mode, self.parallel_processor,
+                                           tables)
+        self.tile_large_frames = cfg.get("tile_large_frames", True)
+        for line in self.plan.describe():
+            self.log(line)
+        return self.plan
+    
+    def _process_frame(self, frame, history):
+        ctx = ProcessingPlan.context(frame, history, self.plan.plane_counts)
+        if self.planar:
+            return self.plan.run_planar(frame, ctx, self._run_stages)
+        return self._run_plan(frame, ctx)
+    
+    def _run_plan(self, img, ctx):
+        return self._run_stages(img, self.plan.stages, ctx)
+    
+    def _run_stages(self, img, stages, ctx):
+        if self.tile_large_frames and TileExecutor.wants(img):
+            return self._run_plan_tiled(img, ctx, stages)
+        for stage in stages:
+            img = stage.fn(img, ctx)
+        return img
+    
+    def _run_plan_tiled(self, img, ctx, stages=None):
+        """分块执行计划：局部步骤按图块（含 halo）处理，依赖整帧的步骤在拼好的整帧上执行
+        
+        带整帧统计量的步骤（去块的边缘检测、自动白平衡、自动色阶、去雾）执行前先在整帧上
+        统计，再经 ctx["stats"] 注入后续的分块处理；连续的局部步骤合并为一次分块遍历。
+        """
+        tiler = self._tiler
+        area = img.shape[0] * img.shape[1]
+        pending = []
+        
+        def flush(src):
+            if not pending:
+                return src
+            stages = tuple(pending)
+            pending.clear()
+            
+            def run(tile, window):
+                tile_ctx = ProcessingPlan.crop_context(ctx, window, tile.shape[0] * tile.shape[1] / area)
+                for stage in stages:
+                    tile = stage.fn(tile, tile_ctx)
+                return tile
+            
+            return tiler.map(run, src, sum(stage.radius for stage in stages))
+        
+        result = img
+        for stage in self.plan.stages if stages is None else stages:
+            if stage.full_frame:
+                result = stage.fn(flush(result), ctx)
+                continue
+            if stage.stat:
+                result = flush(result)
+                ctx["stats"][stage.key] = stage.stat(result)
+            pending.append(stage)
+        return flush(result)
 
 
 # ==================== 14. 预览窗口 ====================
@@ -2078,6 +4971,22 @@ class NewTaskDialog:
             'opt_highlight_rec': BooleanVar(value=True),
             'opt_dehaze': BooleanVar(value=False),  # 去雾默认不选，与全选一致
         }
+        
+        self.perf_opts = {
+            'stream_encode': BooleanVar(value=True),
+            'frame_parallel': BooleanVar(value=True),
+            'process_pool': BooleanVar(value=False),
+            'stage_pipeline': BooleanVar(value=False),
+            'segment_parallel': BooleanVar(value=False),
+            'checkpoint': BooleanVar(value=True),
+            'ffmpeg_decode': BooleanVar(value=True),
+            'skip_duplicates': BooleanVar(value=False),
+            'dirty_regions': BooleanVar(value=False),
+            'tile_large_frames': BooleanVar(value=True),
+            'float64_precision': BooleanVar(value=False),
+            'luma_detail': BooleanVar(value=False),
+            'planar_yuv': BooleanVar(value=False),
+        }
     
     def _create_colored_check(self, parent, text, var, color):
         """创建彩色复选框 - 深色主题"""
@@ -2270,6 +5179,31 @@ class NewTaskDialog:
                    bg=self.DARK_FRAME_BG, fg="#50C878", font=("微软雅黑", 9), 
                    selectcolor=self.DARK_BG, activebackground=self.DARK_FRAME_BG).pack(anchor='w')
         
+        # ===== 性能选项区块 =====
+        perf_frame = LabelFrame(scroll_frame, text="⚡ 性能选项",
+                               bg=self.DARK_FRAME_BG, fg="#00BFFF",
+                               font=("微软雅黑", 10, "bold"), padx=10, pady=5)
+        perf_frame.pack(fill='x', padx=10, pady=5)
+        
+        perf_items = [
+            ("📡流式编码 (不生成临时图片)", "stream_encode", "#00BFFF"),
+            ("🧵帧级多线程并行", "frame_parallel", "#87CEFA"),
+            ("🚀多进程并行 (共享内存)", "process_pool", "#1E90FF"),
+            ("🏭分阶段流水线", "stage_pipeline", "#4682B4"),
+            ("✂️分段并行 (长视频)", "segment_parallel", "#5F9EA0"),
+            ("💾断点续传", "checkpoint", "#48D1CC"),
+            ("🎞️FFmpeg管道解码", "ffmpeg_decode", "#40E0D0"),
+            ("♻️跳过重复帧 (录屏/动画)", "skip_duplicates", "#66CDAA"),
+            ("🧩只处理变化区域 (静态背景)", "dirty_regions", "#8FBC8F"),
+            ("🧱4K/8K 分块处理", "tile_large_frames", "#9ACD32"),
+            ("🎯float64 高精度 (较慢)", "float64_precision", "#BDB76B"),
+            ("🌗亮度域修复 (去块/反锯齿/降噪/锐化仅处理 Y)", "luma_detail", "#DAA520"),
+            ("🎞️yuv420p 平面直通 (解码/编码不转 BGR)", "planar_yuv", "#5F9EA0"),
+        ]
+        for row, (text, key, color) in enumerate(perf_items):
+            self._create_colored_check(perf_frame, text, self.perf_opts[key], color).grid(
+                row=row // 2, column=row % 2, sticky='w', padx=2, pady=1)
+        
         # ===== 按钮区域 - 高级后期区块下方右对齐 =====
         btn_frame = Frame(scroll_frame, bg=self.DARK_BG)
         btn_frame.pack(fill='x', padx=10, pady=(10, 15), anchor='e')
@@ -2304,6 +5238,9 @@ class NewTaskDialog:
         for k, v in task.adv_opts.items():
             if k in self.adv_opts:
                 self.adv_opts[k].set(v)
+        for k, v in task.perf_opts.items():
+            if k in self.perf_opts:
+                self.perf_opts[k].set(v)
     
     def _apply(self):
         """应用配置 - 修复文件名重复问题"""
@@ -2331,6 +5268,7 @@ class NewTaskDialog:
             adv_intensity=self.adv_intensity.get(),
             smart_mode=self.smart_mode.get(),
             adv_opts={k: v.get() for k, v in self.adv_opts.items()},
+            perf_opts={k: v.get() for k, v in self.perf_opts.items()},
         )
         
         self.result = task
@@ -2426,6 +5364,7 @@ class App:
         self.is_running = False
         self.is_paused = False
         self.current_processing_task = None
+        self.current_pipeline = None
         self.log_visible = False
         self.selected_task_id = None
         self._last_width = 800  # 记录上次窗口宽度
@@ -2761,6 +5700,10 @@ class App:
         
         def update_resource(*args):
             self.resource_label.config(text=f"{int(self.resource_var.get()*100)}%")
+            # 处理中拖动滑块时更新线程预算（内部线程数在下一帧完成时应用）
+            pipeline = getattr(self, "current_pipeline", None)
+            if pipeline:
+                pipeline.budget.set_ratio(self.resource_var.get())
         self.resource_var.trace_add("write", update_resource)
         
         # ========== 工具栏 ==========
@@ -3473,6 +6416,19 @@ class App:
             return
         
         task = self.task_manager.get_next_task()
+        if not task:
+            resumable = self.task_manager.get_resumable_tasks()
+            if resumable and messagebox.askyesno(
+                "继续处理",
+                f"有 {len(resumable)} 个已停止或失败的任务，是否继续处理？\n\n"
+                "已保存断点的任务将从上次的进度继续，不会从头开始。"
+            ):
+                for t in resumable:
+                    t.status = TaskStatus.PENDING
+                    if TaskCheckpoint.has_progress(t):
+                        self._log(f"[info] 将从断点续传: {t.get_filename()}")
+                self._refresh_task_list()
+                task = self.task_manager.get_next_task()
         if not task:
             messagebox.showinfo("提示", "没有待处理的任务")
             return
@@ -3553,6 +6509,7 @@ class App:
             
             try:
                 pipeline = VideoPipeline(task, self._log, self.gpu.info, self.resource_var.get())
+                self.current_pipeline = pipeline
                 
                 def progress_cb(current, total, fps):
                     task.current_frame = current
@@ -3571,12 +6528,14 @@ class App:
                 if not STOP_FLAG:
                     task.status = TaskStatus.COMPLETED
                     task.progress = 100
-                    self._log(f"[info] 完成: {task.get_filename()}, 用时 {self._format_time(elapsed)}")
+                    self._log(f"[info] 完成: {task.get_filename()}, 用时 {self._format_time(elapsed)}"
+                              + (f", 跳过重复帧 {task.skipped_frames}" if task.skipped_frames else ""))
                     
             except Exception as e:
                 task.status = TaskStatus.FAILED
                 self._log(f"[error] 处理失败: {e}")
             
+            self.current_pipeline = None
             self.root.after(0, self._refresh_task_list)
         
         self.root.after(0, self._on_all_complete)
@@ -4413,5 +7372,6 @@ class App:
 
 # ==================== 程序入口 ====================
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     app = App()
     app.run()
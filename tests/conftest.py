@@ -0,0 +1,18 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def frame():
+    """合成测试帧：随机纹理叠加水平/垂直渐变，覆盖暗部、高光与饱和色"""
+    rng = np.random.RandomState(0)
+    h, w = 72, 96
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([x * 255 / (w - 1), y * 255 / (h - 1), (x + y) * 255 / (h + w - 2)], axis=2)
+    noise = rng.randint(-40, 41, (h, w, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
@@ -0,0 +1,37 @@
+"""MaskBlend 与原先的三通道 float 写法（裁剪后截断取整）逐像素一致"""
+import numpy as np
+
+from biekuai import MaskBlend
+
+
+def _mask(frame, seed):
+    rng = np.random.RandomState(seed)
+    return rng.uniform(0, 1, frame.shape[:2]).astype(np.float32)
+
+
+def test_blend_truncates_like_float_path(frame):
+    other = frame[::-1, ::-1].copy()
+    mask = _mask(frame, 1)
+    mask3 = np.stack([mask] * 3, axis=-1)
+    expected = np.clip(frame.astype(np.float32) * (1 - mask3) + other.astype(np.float32) * mask3,
+                       0, 255).astype(np.uint8)
+    assert np.array_equal(MaskBlend.blend(frame, other, mask), expected)
+
+
+def test_add_truncates_like_float_path(frame):
+    rng = np.random.RandomState(2)
+    delta = rng.normal(0, 20, frame.shape).astype(np.float32)
+    mask = _mask(frame, 3)
+    mask3 = np.stack([mask] * 3, axis=-1)
+    expected = np.clip(frame.astype(np.float32) + delta * mask3 * 0.6, 0, 255).astype(np.uint8)
+    assert np.array_equal(MaskBlend.add(frame, delta, mask, 0.6), expected)
+
+
+def test_chained_blends_keep_no_rounding_bias(frame):
+    """反复以 0.6 的权重混入高 1 级的图像：截断取整保持原值，四舍五入则整体偏高 1 级"""
+    brighter = np.minimum(frame, 254) + 1
+    weight = np.full(frame.shape[:2], 0.6, np.float32)
+    result = np.minimum(frame, 254)
+    for _ in range(10):
+        result = MaskBlend.blend(result, brighter, weight)
+    assert np.array_equal(result, np.minimum(frame, 254))
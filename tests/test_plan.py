@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from biekuai import ProcessingPlan
+
+# 连续的逐像素步骤：基础后期（逐通道 + 颜色相关）与高级后期（HSV）各合并为一张查找表
+POINT_CFG = {
+    "use_basic": True, "opt_bright": True, "opt_temp": True, "opt_highlight": True,
+    "use_advanced": True, "opt_shadow": True, "opt_highlight_rec": True,
+}
+
+
+def _no_color_chains(monkeypatch):
+    monkeypatch.setattr(ProcessingPlan, "_fuse_color_spaces",
+                        classmethod(lambda cls, stages, precise=False: stages))
+
+
+def test_fused_point_ops_match_unfused(monkeypatch, frame):
+    _no_color_chains(monkeypatch)
+    fused = ProcessingPlan.compile(POINT_CFG)
+    assert any(stage.point == "color" and "+" in stage.key for stage in fused.stages)
+    
+    monkeypatch.setattr(ProcessingPlan, "_fuse_point_ops",
+                        classmethod(lambda cls, stages, tables=None: stages))
+    plain = ProcessingPlan.compile(POINT_CFG)
+    assert len(plain.stages) > len(fused.stages)
+    
+    np.testing.assert_array_equal(fused.run(frame.copy()), plain.run(frame.copy()))
+
+
+def test_compile_reuses_color_tables(monkeypatch, frame):
+    _no_color_chains(monkeypatch)
+    plan = ProcessingPlan.compile(POINT_CFG)
+    tables = plan.color_tables()
+    assert tables
+    
+    def rebuild(cls, stages):
+        pytest.fail("颜色查找表被重复构建")
+    
+    monkeypatch.setattr(ProcessingPlan, "_color_table", classmethod(rebuild))
+    again = ProcessingPlan.compile(POINT_CFG, tables=tables)
+    assert again.color_tables().keys() == tables.keys()
+    np.testing.assert_array_equal(again.run(frame.copy()), plan.run(frame.copy()))
+
+
+# 自动白平衡之后接可合并为浮点色彩链的步骤
+CHAIN_CFG = {
+    "use_basic": True, "opt_landscape": True, "opt_cinematic": True,
+    "use_advanced": True, "opt_auto_wb": True, "opt_shadow": True,
+}
+
+
+def test_color_chains_stay_close_to_unfused(monkeypatch, frame):
+    fused = ProcessingPlan.compile(CHAIN_CFG)
+    keys = [stage.key for stage in fused.stages]
+    assert "opt_auto_wb" in keys, "自动白平衡不应并入浮点色彩链"
+    assert any("+" in key and "opt_auto_wb" not in key for key in keys)
+    
+    _no_color_chains(monkeypatch)
+    plain = ProcessingPlan.compile(CHAIN_CFG)
+    diff = np.abs(fused.run(frame.copy()).astype(np.int16) - plain.run(frame.copy()))
+    assert diff.max() <= 2
@@ -0,0 +1,52 @@
+"""float32（默认）与 float64 精度下各步骤的逐像素差值不超过 ±1 LSB"""
+import cv2
+import numpy as np
+import pytest
+
+from biekuai import FramePlanes, ImageProcessor, ProfessionalRestorer as PR
+
+INTENSITIES = ("light", "medium", "heavy")
+
+
+@pytest.fixture
+def reference(frame):
+    """参考帧：放大后按低质量 JPEG 压缩，带真实的 8x8 块效应与色带"""
+    big = cv2.resize(frame, (320, 240), interpolation=cv2.INTER_CUBIC)
+    ok, data = cv2.imencode(".jpg", big, [cv2.IMWRITE_JPEG_QUALITY, 20])
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def _with_face(img):
+    """预置人脸框，使 step5 在没有真实人脸的合成帧上也执行修复"""
+    planes = FramePlanes(img)
+    planes._cache["faces"] = [(80, 60, 120, 100)]
+    return planes
+
+
+def _seeded(fn):
+    def run(img, intensity, dtype):
+        np.random.seed(0)       # step1 的去色带抖动噪声
+        return fn(img, intensity, dtype)
+    return run
+
+
+STEPS = {
+    "step1": _seeded(lambda img, i, dt: PR.step1_artifact_removal(img, i, dtype=dt)),
+    "step3": lambda img, i, dt: PR.step3_antialiasing(img, i, min_mask=0, dtype=dt),
+    "step5": lambda img, i, dt: PR.step5_face_repair(img, i, _with_face(img), dtype=dt),
+    "step7": lambda img, i, dt: PR.step7_final_sharpen(img, i, dtype=dt),
+    "dehaze": lambda img, i, dt: ImageProcessor._dehaze(img, {"light": 0.6, "medium": 0.85, "heavy": 0.95}[i],
+                                                        dtype=dt),
+}
+
+
+@pytest.mark.parametrize("intensity", INTENSITIES)
+@pytest.mark.parametrize("step", sorted(STEPS))
+def test_float32_within_one_lsb_of_float64(step, intensity, reference):
+    fn = STEPS[step]
+    f32 = fn(reference.copy(), intensity, np.float32)
+    f64 = fn(reference.copy(), intensity, np.float64)
+    assert f32.dtype == f64.dtype == np.uint8
+    assert not np.array_equal(f64, reference), "步骤未改动参考帧，比较没有意义"
+    diff = np.abs(f32.astype(np.int16) - f64.astype(np.int16))
+    assert diff.max() <= 1, f"{step}/{intensity}: 最大差值 {diff.max()}"